@@ -19,6 +19,9 @@ from argparse import ArgumentParser
 import datetime
 import hashlib
 import imp_build_utils
+import imp_build_analysis
+import imp_build_search
+import imp_schema
 from imp_build_utils import SPECIAL_COMPONENTS, OK_STATES
 import xml.sax
 from xml.sax.handler import ContentHandler
@@ -26,6 +29,7 @@ import json
 import yaml
 import base64
 import zlib
+import concurrent.futures
 
 imp_testhtml = '/guitar3/home/www/html/imp/nightly/'
 imp_testurl = 'http://salilab.org/imp/nightly/tests.html'
@@ -34,6 +38,18 @@ imp_downloadhtml = '/guitar3/home/www/html/imp/nightly/download/'
 imp_lab_testhtml = '/guitar3/home/www/html/internal/imp-salilab/nightly/'
 imp_lab_testurl = 'https://salilab.org/internal/imp-salilab/nightly/tests.html'
 
+# Results pages (relative to the results URL) that most people visit after
+# a build, which are requested to fill caches; pages for components with
+# new failures are also requested
+WARM_CACHE_PAGES = ['', 'new-fail', 'all-fail', 'all-fail/grouped', 'flaky',
+                    'long', 'badge.svg']
+
+# Number of results pages to request at once when warming caches
+WARM_CACHE_THREADS = 4
+
+# URL of the results web app on the local web server, used to warm caches
+WARM_CACHE_URL = 'http://localhost/nightly/results/'
+
 
 class ExcludedModule(object):
     pass
@@ -242,6 +258,46 @@ class CCoverageLink(CoverageLink):
             r'<td class="headerCovTableEntry\w+">(\d+\.\d+)(\s|&nbsp;)*%</td>')
 
 
+class CacheWarmer(object):
+    """Request the most-visited results pages for a new build, so that
+       the first real visitors find them in the web app's and database's
+       caches"""
+
+    def __init__(self, threads=WARM_CACHE_THREADS, timeout=120):
+        self.threads, self.timeout = threads, timeout
+        self.requests = []
+
+    def add_pages(self, url_root, branch, components, auth=None):
+        """Add the pages for a branch to request. If auth is given, it
+           should be a dict with username and password keys."""
+        headers = {'User-Agent': 'urllib'}
+        if auth:
+            authstr = auth['username'] + ":" + auth['password']
+            authstr = base64.b64encode(authstr.encode('ascii'))
+            headers['Authorization'] = 'Basic %s' % authstr.decode('ascii')
+        query = ''
+        if branch != 'develop':
+            query = '?' + urllib.parse.urlencode({'branch': branch})
+        for page in WARM_CACHE_PAGES + ['comp/%d' % c for c in components]:
+            self.requests.append(
+                urllib.request.Request(url_root + page + query,
+                                       headers=headers))
+
+    def _get(self, req):
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as fh:
+                fh.read()
+        except (urllib.request.URLError, http.client.HTTPException,
+                ssl.SSLError, socket.error) as detail:
+            return "%s: %s" % (req.full_url, detail)
+
+    def warm(self):
+        """Request every page, at most self.threads at once. Return a list
+           of errors."""
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as ex:
+            return [err for err in ex.map(self._get, self.requests) if err]
+
+
 class GitHubStatusUpdater(object):
     """Update the status of a repository in GitHub"""
 
@@ -918,6 +974,36 @@ class PruneDirectories(object):
         return dirs_to_prune
 
 
+class CompressLogs(object):
+    """Compress the log files in build directories more than min_age days
+       old, in a format that the web interface can still read quickly"""
+    def __init__(self, topdir, min_age=3):
+        self._topdir = topdir
+        self._min_age = min_age
+
+    def compress(self):
+        for d in self._get_dirs_to_compress():
+            logdir = os.path.join(self._topdir, d, 'build', 'logs')
+            for dirpath, dirnames, filenames in os.walk(logdir):
+                for f in filenames:
+                    fname = os.path.join(dirpath, f)
+                    if f.endswith('.log') and not os.path.islink(fname):
+                        imp_build_utils.compress_log(fname)
+
+    def _get_dirs_to_compress(self):
+        today = datetime.datetime.today()
+        dirre = re.compile(r'(\d{4})(\d{2})(\d{2})-')
+        dirs = []
+        for d in sorted(os.listdir(self._topdir)):
+            m = dirre.match(d)
+            if m and not os.path.islink(os.path.join(self._topdir, d)):
+                dirdate = datetime.datetime(int(m.group(1)), int(m.group(2)),
+                                            int(m.group(3)))
+                if (today - dirdate).days > self._min_age:
+                    dirs.append(d)
+        return dirs
+
+
 class Checker(object):
     def __init__(self, dirroot):
         self._products = []
@@ -1272,7 +1358,7 @@ class TestXMLParser(object):
 
 class TestSQLInserter(object):
     def __init__(self, table, name_table, unit, unit_table, lab_only,
-                 arch_id, date, cur, prev_tests):
+                 arch_id, date, cur, prev_tests, states, signatures):
         self.table = table
         self.name_table = name_table
         self.unit = unit
@@ -1282,6 +1368,10 @@ class TestSQLInserter(object):
         self.date = date
         self.cur = cur
         self.prev_tests = prev_tests
+        # Pass/fail state of each test, to update the test history
+        self.states = states
+        # Summary of each failure signature seen
+        self.signatures = signatures
         self.seen_names = {}
         self.unit_id = None
 
@@ -1317,11 +1407,18 @@ class TestSQLInserter(object):
                 delta = 'NEWFAIL'
             elif prev_status not in OK_STATES and test['status'] in OK_STATES:
                 delta = 'NEWOK'
+        signature = None
+        if test['status'] not in OK_STATES:
+            signature, summary = imp_build_analysis.get_failure_signature(
+                test['name'], test['status'], test['output'])
+            self.signatures.setdefault(signature, summary)
         self.cur.execute("INSERT INTO " + self.table + " (name, arch, "
-                         "state, detail, runtime, date, delta) VALUES "
-                         "(%s, %s, %s, %s, %s, %s, %s)",
+                         "state, detail, runtime, date, delta, signature) "
+                         "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
                          (name_id, self.arch_id, test['status'],
-                          test['output'], test['time'], self.date, delta))
+                          test['output'], test['time'], self.date, delta,
+                          signature))
+        self.states[(name_id, self.arch_id)] = test['status'] in OK_STATES
 
 
 class DatabaseUpdater(object):
@@ -1339,6 +1436,19 @@ class DatabaseUpdater(object):
         self.imp_branch_sql = imp_branch.replace('/', '_').replace('.', '_')
         self.conn = connect_mysql()
 
+    def create_missing_table(self, suffix):
+        """Create a table that is normally made by imp_schema.py, and its
+           copy for this branch, if they do not exist yet, so that results
+           can be stored before imp_schema.py is next run (which is still
+           needed to add indexes and access for the web user)."""
+        name = self.test_table_prefix + '_' + suffix
+        tables = [name]
+        if self.imp_branch != 'develop':
+            tables.append(name + '_' + self.imp_branch_sql)
+        cur = self.conn.cursor()
+        for table in tables:
+            cur.execute(imp_schema.get_create_table_sql(name, table))
+
     def get_test_table(self, suffix, per_branch):
         return self.get_table(self.test_table_prefix + '_' + suffix,
                               per_branch)
@@ -1412,6 +1522,170 @@ class DatabaseUpdater(object):
                              getattr(state, '_line_number', None), date))
         self.conn.commit()
 
+    def get_test_rollup(self, date=None):
+        """Precompute the number of failed tests for each unit and platform,
+           so that the build summary page and email don't need to scan all
+           of the day's test results. This must be run after both
+           get_test_results and get_unit_summary. Any existing rollup for
+           the date is replaced."""
+        if date is None:
+            date = datetime.date.today()
+        self.create_missing_table("rollup")
+        cur = self.conn.cursor()
+        table = self.get_test_table("rollup", True)
+        # Always include lab-only units; the web interface filters them out
+        db = imp_build_utils.BuildDatabase(self.conn, date, True,
+                                           self.imp_branch)
+        # Read the same tables that get_test_results and get_unit_summary
+        # wrote to (the temporary copies, in a dry run)
+        rows = db.get_unit_rollup(
+            test_table=self.get_table(self.test_table_prefix, per_branch=True),
+            unit_result_table=self.get_test_table("unit_result", True))
+        cur.execute("DELETE FROM " + table + " WHERE date=%s", (date,))
+        for row in rows:
+            cur.execute("INSERT INTO " + table +
+                        " (date, arch, unit, state, numfails, numnewfails, "
+                        "logline) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                        (date,) + row)
+        self.conn.commit()
+
+    def get_test_slowdowns(self, date=None):
+        """Record tests whose runtime jumped in the build on the given date
+           (replacing any previously found for the date). This should be
+           run after get_test_results."""
+        if date is None:
+            date = datetime.date.today()
+        cur = self.conn.cursor()
+        table = self.get_table(self.test_table_prefix, per_branch=True)
+        slow_table = self.get_test_table("slowdown", True)
+        ok = "(" + ", ".join("'%s'" % x for x in OK_STATES) + ")"
+        start = date - datetime.timedelta(
+            days=imp_build_analysis.TEST_BASELINE_DAYS)
+        # Only get the history of tests that took a significant time today
+        cur.execute("SELECT h.name, h.arch, h.date, h.runtime FROM "
+                    + table + " h, " + table + " t WHERE t.date=%s "
+                    "AND t.runtime>=%s AND t.state IN " + ok
+                    + " AND h.name=t.name AND h.arch=t.arch "
+                    "AND h.date>%s AND h.date<=%s AND h.state IN " + ok
+                    + " ORDER BY h.name, h.arch, h.date",
+                    (date, imp_build_analysis.MIN_TEST_RUNTIME, start, date))
+        slowdowns = imp_build_analysis.find_test_slowdowns(cur.fetchall(),
+                                                           date)
+        cur.execute("DELETE FROM " + slow_table + " WHERE date=%s", (date,))
+        cur.executemany("INSERT INTO " + slow_table + " (date, name, arch, "
+                        "baseline, runtime, effect) VALUES (%s, %s, %s, %s, "
+                        "%s, %s)", [(date,) + tuple(s) for s in slowdowns])
+        self.conn.commit()
+
+    def get_flaky_tests(self, date=None):
+        """Record tests that flip between passing and failing (replacing any
+           previously found for the given date). This uses the test history,
+           so should be run after get_test_results."""
+        if date is None:
+            date = datetime.date.today()
+        cur = self.conn.cursor()
+        table = self.get_test_table("history", True)
+        flaky_table = self.get_test_table("flaky", True)
+        start = date - datetime.timedelta(
+            days=imp_build_analysis.FLAKY_DAYS)
+        # Only tests that both passed and failed recently can be flaky
+        cur.execute("SELECT name, arch, first_date, last_date, runs, "
+                    "last_ok, last_fail FROM " + table
+                    + " WHERE last_ok>%s AND last_fail>%s", (start, start))
+
+        def get_states():
+            for row in cur.fetchall():
+                h = imp_build_utils.TestHistory(*row[2:])
+                yield (row[0], row[1],
+                       [state == h.PASS for d, state
+                        in h.get_states(date, imp_build_analysis.FLAKY_DAYS)
+                        if state != h.NOT_RUN])
+        flaky = list(imp_build_analysis.find_flaky_tests(get_states()))
+        cur.execute("DELETE FROM " + flaky_table + " WHERE date=%s", (date,))
+        cur.executemany("INSERT INTO " + flaky_table + " (date, name, arch, "
+                        "runs, flips, score) VALUES (%s, %s, %s, %s, %s, %s)",
+                        [(date,) + tuple(f) for f in flaky])
+        self.conn.commit()
+
+    def register_branch(self):
+        """Add this branch to the imp_branch table, so that the web
+           interface shows it"""
+        if self.dryrun:
+            return
+        cur = self.conn.cursor()
+        cur.execute("INSERT IGNORE INTO imp_branch (name) VALUES (%s)",
+                    (self.imp_branch,))
+        self.conn.commit()
+
+    def get_new_failure_components(self, lab_only):
+        """Get the IDs of all components with new test failures in the
+           most recent build of this branch"""
+        table = self.get_test_table("rollup", True)
+        unit_table = self.get_test_table("units", False)
+        query = ("SELECT DISTINCT r.unit FROM " + table + " r, "
+                 + unit_table + " u WHERE r.unit=u.id AND r.numnewfails>0 "
+                 "AND r.date=(SELECT MAX(date) FROM " + table + ")")
+        if not lab_only:
+            query += " AND u.lab_only=false"
+        cur = self.conn.cursor()
+        cur.execute(query)
+        return [row[0] for row in cur]
+
+    def backfill_test_history(self, start, end):
+        """Add the results of every build between start and end inclusive
+           to the test history, in date order. Results older than a test's
+           history cannot be added to it, so if start is before the
+           history's coverage, the whole history is rebuilt from start
+           (up to the latest build already in it, if later than end)."""
+        cur = self.conn.cursor()
+        table = self.get_table(self.test_table_prefix, per_branch=True)
+        history_table = self.get_test_table("history", True)
+        covered_from = self._get_history_start()
+        if covered_from is None or start < covered_from:
+            cur.execute("SELECT last_date FROM " + history_table
+                        + " ORDER BY last_date DESC LIMIT 1")
+            row = cur.fetchone()
+            if row:
+                print("Rebuilding test history from %s" % start)
+                end = max(end, row[0])
+                cur.execute("DELETE FROM " + history_table)
+            covered_from = start
+        cur.execute("SELECT DISTINCT date FROM " + table
+                    + " WHERE date>=%s AND date<=%s ORDER BY date",
+                    (start, end))
+        for (date,) in cur.fetchall():
+            print("Adding test history for %s" % date)
+            cur.execute("SELECT name, arch, state FROM " + table
+                        + " WHERE date=%s", (date,))
+            self.update_test_history(
+                date, dict(((name, arch), state in OK_STATES)
+                           for name, arch, state in cur.fetchall()),
+                covered_from)
+            self.conn.commit()
+
+    def backfill_search_index(self, start, end):
+        """Add failed tests from every build between start and end inclusive
+           to the full-text search index"""
+        cur = self.conn.cursor()
+        table = self.get_table(self.test_table_prefix, per_branch=True)
+        cur.execute("SELECT DISTINCT date FROM " + table
+                    + " WHERE date>=%s AND date<=%s ORDER BY date",
+                    (start, end))
+        for (date,) in cur.fetchall():
+            print("Adding failed tests for %s to search index" % date)
+            self.update_search_index(date)
+
+    def backfill_test_rollup(self, start, end):
+        """Write rollups for every build between start and end inclusive"""
+        cur = self.conn.cursor()
+        result_table = self.get_test_table("unit_result", True)
+        cur.execute("SELECT DISTINCT date FROM " + result_table
+                    + " WHERE date>=%s AND date<=%s ORDER BY date",
+                    (start, end))
+        for row in cur.fetchall():
+            print("Writing test rollup for %s" % row[0])
+            self.get_test_rollup(row[0])
+
     def get_benchmarks(self, xmldir, comp, ignore_unknown=False):
         cur = self.conn.cursor()
         date = datetime.date.today()
@@ -1443,6 +1717,90 @@ class DatabaseUpdater(object):
                             file_table, t.unit, unit_table, self.lab_only,
                             table, name_table, arch_id, cur, date))
         self.conn.commit()
+        self.get_benchmark_rollup(date)
+
+    def get_benchmark_rollup(self, date=None):
+        """Update the weekly and monthly benchmark summaries that contain
+           the given date, so that long-range benchmark plots don't need to
+           read every daily result. Each summary is recalculated from the
+           daily results, so this can be rerun for the same date."""
+        if date is None:
+            date = datetime.date.today()
+        cur = self.conn.cursor()
+        table = self.get_table(self.bench_table_prefix, per_branch=True)
+        rollup_table = self.get_table(self.bench_table_prefix + '_rollup',
+                                      per_branch=True)
+        for bucket in imp_build_utils.BENCHMARK_ROLLUP_BUCKETS:
+            start, end = imp_build_utils.get_bucket_range(date, bucket)
+            cur.execute("SELECT name, platform, runtime, checkval FROM "
+                        + table + " WHERE date>=%s AND date<%s "
+                        "ORDER BY name, platform", (start, end))
+            rows = list(imp_build_utils.summarize_benchmarks(cur.fetchall()))
+            cur.execute("DELETE FROM " + rollup_table + " WHERE bucket=%s "
+                        "AND bucket_start=%s", (bucket, start))
+            cur.executemany(
+                "INSERT INTO " + rollup_table + " (bucket, bucket_start, "
+                "name, platform, samples, min_runtime, median_runtime, "
+                "max_runtime, min_checkval, median_checkval, max_checkval) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                [(bucket, start) + row for row in rows])
+        self.conn.commit()
+
+    def backfill_benchmark_rollup(self, start, end):
+        """Write benchmark rollups for every week and month containing
+           a build between start and end inclusive"""
+        cur = self.conn.cursor()
+        table = self.get_table(self.bench_table_prefix, per_branch=True)
+        cur.execute("SELECT DISTINCT date FROM " + table
+                    + " WHERE date>=%s AND date<=%s ORDER BY date",
+                    (start, end))
+        done = set()
+        for row in cur.fetchall():
+            buckets = tuple(imp_build_utils.get_bucket_range(row[0], b)[0]
+                            for b in imp_build_utils.BENCHMARK_ROLLUP_BUCKETS)
+            if buckets not in done:
+                print("Writing benchmark rollup for %s" % row[0])
+                self.get_benchmark_rollup(row[0])
+                done.add(buckets)
+
+    def get_benchmark_regressions(self, date=None):
+        """Look for step changes in benchmark runtimes that became apparent
+           in the build on the given date, and record them (replacing any
+           previously found for the date). This should be run after
+           get_benchmarks and get_repo_revision."""
+        if date is None:
+            date = datetime.date.today()
+        cur = self.conn.cursor()
+        table = self.get_table(self.bench_table_prefix, per_branch=True)
+        reg_table = self.get_table(self.bench_table_prefix + '_regression',
+                                   per_branch=True)
+        rev_table = self.get_test_table("reporev", True)
+        start = date - datetime.timedelta(
+            days=imp_build_analysis.BASELINE_DAYS)
+        cur.execute("SELECT name, platform, date, runtime FROM " + table
+                    + " WHERE date>%s AND date<=%s "
+                    "ORDER BY name, platform, date", (start, date))
+        regressions = list(imp_build_analysis.find_regressions(
+            cur.fetchall(), date))
+
+        def get_rev(query, change_date):
+            cur.execute("SELECT rev FROM " + rev_table + query
+                        + " ORDER BY date DESC LIMIT 1", (change_date,))
+            row = cur.fetchone()
+            return row[0] if row else None
+        cur.execute("DELETE FROM " + reg_table + " WHERE date=%s", (date,))
+        for r in regressions:
+            # Range of commits between the build before the change
+            # and the first build with the change
+            rev_from = get_rev(" WHERE date<%s", r.change_date)
+            rev_to = get_rev(" WHERE date=%s", r.change_date)
+            cur.execute("INSERT INTO " + reg_table + " (date, change_date, "
+                        "name, platform, baseline, runtime, effect, "
+                        "rev_from, rev_to) VALUES (%s, %s, %s, %s, %s, %s, "
+                        "%s, %s, %s)",
+                        (date, r.change_date, r.name, r.platform,
+                         r.baseline, r.runtime, r.effect, rev_from, rev_to))
+        self.conn.commit()
 
     def get_repo_revision(self, rev, version=None):
         """Record the revision number of today's build in the database."""
@@ -1509,6 +1867,11 @@ class DatabaseUpdater(object):
                     " (state, date, lab_only) VALUES (%s, %s, %s)",
                     (comp.state, date, self.lab_only))
         self.conn.commit()
+        if not self.dryrun:
+            # Invalidate build status badges cached by the web interface
+            stamp = imp_build_utils.get_summary_stamp(self.imp_branch)
+            with open(stamp, 'a'):
+                os.utime(stamp)
 
     def get_test_results(self, comp, xmldir, ignore_unknown=False):
         """Extract all IMP test results from ctest XML in the named directory,
@@ -1531,6 +1894,8 @@ class DatabaseUpdater(object):
         name_table = self.get_test_table("names", False)
         if self.clean:
             cur.execute("DELETE FROM " + table + " WHERE date=%s", (date,))
+        states = {}
+        signatures = {}
 
         try:
             archs = os.listdir(xmldir)
@@ -1549,10 +1914,142 @@ class DatabaseUpdater(object):
                     if t.unit:
                         ntests = t.parse(TestSQLInserter(
                             table, name_table, t.unit, unit_table,
-                            self.lab_only, arch_id, date, cur, prev_tests))
+                            self.lab_only, arch_id, date, cur, prev_tests,
+                            states, signatures))
                         if test_xml.endswith('.test.xml') and ntests == 0:
                             print("WARNING: no tests for", t.unit, arch)
+        self.update_test_history(date, states)
+        self.update_failure_signatures(date, signatures)
         self.conn.commit()
+        self.update_search_index(date)
+
+    def update_search_index(self, date):
+        """Add the failed tests for the given date to the full-text
+           search index"""
+        if self.dryrun:
+            return
+        cur = self.conn.cursor()
+        table = self.get_table(self.test_table_prefix, per_branch=True)
+        ok = "(" + ", ".join("'%s'" % x for x in OK_STATES) + ")"
+        cur.execute("SELECT t.name, n.unit, t.arch, u.lab_only, n.name, "
+                    "t.detail FROM " + table + " t, imp_test_names n, "
+                    "imp_test_units u WHERE t.date=%s AND t.state NOT IN "
+                    + ok + " AND t.name=n.id AND n.unit=u.id", (date,))
+        index = imp_build_search.SearchIndex(imp_build_utils.search_index)
+        index.add_results(self.imp_branch, date, cur.fetchall())
+
+    def update_failure_signatures(self, date, signatures):
+        """Record the first and last dates each failure signature was seen.
+           signatures is a dict of one-line summaries keyed by signature."""
+        if not signatures:
+            return
+        cur = self.conn.cursor()
+        table = self.get_test_table("signature", True)
+        cur.execute("SELECT signature FROM " + table + " WHERE signature IN ("
+                    + ", ".join(["%s"] * len(signatures)) + ")",
+                    list(signatures.keys()))
+        existing = frozenset(row[0] for row in cur)
+        cur.executemany("UPDATE " + table + " SET first_date=CASE WHEN "
+                        "first_date>%s THEN %s ELSE first_date END, "
+                        "last_date=CASE WHEN last_date<%s THEN %s ELSE "
+                        "last_date END WHERE signature=%s",
+                        [(date, date, date, date, sig) for sig in existing])
+        cur.executemany("INSERT INTO " + table + " (signature, first_date, "
+                        "last_date, summary) VALUES (%s, %s, %s, %s)",
+                        [(sig, date, date, summary)
+                         for sig, summary in signatures.items()
+                         if sig not in existing])
+
+    def backfill_failure_signatures(self, start, end):
+        """Add failure signatures to test results from every build between
+           start and end inclusive"""
+        cur = self.conn.cursor()
+        table = self.get_table(self.test_table_prefix, per_branch=True)
+        name_table = self.get_test_table("names", False)
+        ok = "(" + ", ".join("'%s'" % x for x in OK_STATES) + ")"
+        cur.execute("SELECT DISTINCT date FROM " + table
+                    + " WHERE date>=%s AND date<=%s ORDER BY date",
+                    (start, end))
+        for (date,) in cur.fetchall():
+            print("Adding failure signatures for %s" % date)
+            cur.execute("SELECT t.name, t.arch, t.state, t.detail, n.name "
+                        "FROM " + table + " t, " + name_table + " n "
+                        "WHERE t.date=%s AND t.state NOT IN " + ok
+                        + " AND t.name=n.id", (date,))
+            signatures = {}
+            updates = []
+            for name, arch, state, detail, test_name in cur.fetchall():
+                sig, summary = imp_build_analysis.get_failure_signature(
+                    test_name, state, detail)
+                signatures.setdefault(sig, summary)
+                updates.append((sig, date, name, arch))
+            cur.executemany("UPDATE " + table + " SET signature=%s "
+                            "WHERE date=%s AND name=%s AND arch=%s", updates)
+            self.update_failure_signatures(date, signatures)
+            self.conn.commit()
+
+    def _get_history_start(self):
+        """Get the date from which the test history covers every build,
+           or None if it is empty"""
+        cur = self.conn.cursor()
+        cur.execute("SELECT covered_from, first_date FROM "
+                    + self.get_test_table("history", True)
+                    + " ORDER BY COALESCE(covered_from, first_date) LIMIT 1")
+        row = cur.fetchone()
+        return (row[0] or row[1]) if row else None
+
+    def _get_test_history(self, date):
+        """Get the history of every test that ran on the given date"""
+        cur = self.conn.cursor()
+        table = self.get_test_table("history", True)
+        test_table = self.get_table(self.test_table_prefix, per_branch=True)
+        cur.execute("SELECT h.name, h.arch, h.first_date, h.last_date, "
+                    "h.runs, h.last_ok, h.last_fail FROM " + table + " h, "
+                    + test_table + " t WHERE t.date=%s AND h.name=t.name "
+                    "AND h.arch=t.arch", (date,))
+        return dict((tuple(row[:2]), imp_build_utils.TestHistory(*row[2:]))
+                    for row in cur.fetchall())
+
+    def update_test_history(self, date, states, covered_from=None):
+        """Add the pass/fail state of each test on the given date (a dict
+           keyed by test name and platform IDs) to the imp_test_history
+           table, so that the web interface can get a test's past results
+           with a single lookup. Histories of new tests are marked as
+           covering every build since covered_from (by default, since the
+           first build in the history)."""
+        cur = self.conn.cursor()
+        table = self.get_test_table("history", True)
+        history = self._get_test_history(date)
+        updates, inserts = [], []
+        for key, ok in states.items():
+            h = history.get(key)
+            if h is None:
+                if covered_from is None:
+                    covered_from = self._get_history_start() or date
+                h = history[key] = imp_build_utils.TestHistory(
+                    covered_from=covered_from)
+                h.add(date, ok)
+                inserts.append(key + (h.first_date, h.last_date, h.runs,
+                                      h.last_ok, h.last_fail, h.covered_from))
+            else:
+                h.add(date, ok)
+                updates.append((h.last_date, h.runs, h.last_ok, h.last_fail)
+                               + key)
+        cur.executemany("UPDATE " + table + " SET last_date=%s, runs=%s, "
+                        "last_ok=%s, last_fail=%s WHERE name=%s AND arch=%s",
+                        updates)
+        cur.executemany("INSERT INTO " + table + " (name, arch, first_date, "
+                        "last_date, runs, last_ok, last_fail, covered_from) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", inserts)
+
+
+def write_log_indexes(logdir):
+    """Write line index files for all platform build logs, so that the
+       web interface can quickly show the parts of each log with errors"""
+    for plat in imp_build_utils.platforms_dict.values():
+        logfile = os.path.join(logdir, plat.logfile)
+        if os.path.exists(logfile):
+            imp_build_utils.write_line_index(logfile)
 
 
 def link_to_logs(dirroot, subdir, destdir, branch):
@@ -1682,12 +2179,19 @@ class IMPChecker(Checker):
                                          'logs', 'imp'))
         db.get_other_repo_revisions(os.path.join(self.newbuilddir, 'build'))
         db.get_unit_summary(self._products[0])
+        db.get_test_rollup()
+        db.get_test_slowdowns()
+        db.get_flaky_tests()
         db.get_benchmarks(os.path.join(self.newbuilddir, 'build',
                                        'logs', 'imp'),
                           self._products[0])
         db.get_build_summary(self._products[0])
+        db.register_branch()
         for p in self._products:
             p.update_status(dryrun)
+        if not dryrun:
+            write_log_indexes(os.path.join(self.newbuilddir, 'build',
+                                           'logs', 'imp'))
 
         version = None
         if not dryrun and self.branch == 'main':
@@ -1701,6 +2205,7 @@ class IMPChecker(Checker):
                 src = os.readlink(self.newbuilddir)
                 os.symlink(src, verlink)
         db.get_repo_revision(self._repos[0].newrevision, version)
+        db.get_benchmark_regressions()
 
         if dryrun:
             return
@@ -1745,6 +2250,7 @@ class IMPChecker(Checker):
             # Remove old builds
             p = PruneDirectories(self.dirroot)
             p.prune()
+        CompressLogs(self.dirroot).compress()
 
         link_to_logs(self.dirroot, 'imp', imp_testhtml, self.branch)
 
@@ -1772,14 +2278,21 @@ class IMPLabChecker(Checker):
                                          'imp-salilab'),
                             ignore_unknown=True)
         db.get_unit_summary(self._products[0])
+        db.get_test_rollup()
+        db.get_test_slowdowns()
+        db.get_flaky_tests()
         db.get_benchmarks(os.path.join(self.newbuilddir, 'build',
                                        'logs', 'imp-salilab'),
                           self._products[0], ignore_unknown=True)
+        db.get_benchmark_regressions()
         db.get_build_summary(self._products[0])
 
         if dryrun:
             return
 
+        write_log_indexes(os.path.join(self.newbuilddir, 'build', 'logs',
+                                       'imp-salilab'))
+
         # Update done-build symlink to point to the new build
         src = os.readlink(self.newbuilddir)
         if os.path.exists(self.donebuildlink):
@@ -1789,6 +2302,7 @@ class IMPLabChecker(Checker):
         # Remove old builds
         p = PruneDirectories(self.dirroot)
         p.prune()
+        CompressLogs(self.dirroot).compress()
         link_to_logs(self.dirroot, 'imp-salilab', imp_lab_testhtml, None)
 
     def activate_new_build(self):
@@ -1812,9 +2326,61 @@ def get_options():
                         action="store_true",
                         help="Run checks only; don't update databases "
                              "or send out email")
+    parser.add_argument("--backfill", "--backfill-rollup", dest="backfill",
+                        nargs=2, metavar=("START", "END"), default=None,
+                        help="Instead of checking today's build, write "
+                             "test and benchmark rollups, test histories, "
+                             "failure signatures and the test search index "
+                             "for all builds between the given dates "
+                             "(YYYYMMDD) inclusive, then exit "
+                             "(--backfill-rollup is an older name for this)")
+    parser.add_argument("--no-warm-cache", dest="warm_cache", default=True,
+                        action="store_false",
+                        help="Don't request the most-visited results pages "
+                             "after the build is stored and before email "
+                             "is sent")
+    parser.add_argument("--warm-cache-url", default=WARM_CACHE_URL,
+                        help="URL of the results web app to request pages "
+                             "from (default %s)" % WARM_CACHE_URL)
+    parser.add_argument("--warm-cache-lab-url", default=None,
+                        help="URL of the lab-only results web app to request "
+                             "pages from, with the credentials in "
+                             "resultsauth.yaml (default: don't request "
+                             "lab-only pages)")
     return parser.parse_args()
 
 
+def get_results_auth():
+    """Read the username and password to use to access lab-only results
+       pages, or return None if there are none. The auth file has the same
+       format as that used for GitHub."""
+    authfile = os.path.join(os.path.dirname(sys.argv[0]),
+                            'resultsauth.yaml')
+    if os.path.exists(authfile):
+        with open(authfile) as fh:
+            return yaml.safe_load(fh)
+
+
+def warm_results_cache(branch, url, lab_url):
+    """Request the most-visited results pages of the given branch from
+       the web app at url, and the lab-only pages from lab_url (if given)"""
+    db = DatabaseUpdater(False, 'imp_test', 'imp_benchmark', False, branch)
+    warmer = CacheWarmer()
+    warmer.add_pages(url, branch, db.get_new_failure_components(False))
+    # Lab-only components are currently only built against develop
+    auth = get_results_auth() if lab_url and branch == 'develop' else None
+    if auth:
+        warmer.add_pages(lab_url, branch,
+                         db.get_new_failure_components(True), auth)
+    for err in warmer.warm():
+        print("WARNING: could not warm cache for " + err)
+
+
+def _parse_date(date):
+    """Parse a date in YYYYMMDD format"""
+    return datetime.datetime.strptime(date, '%Y%m%d').date()
+
+
 def _deb_packages(version, codename):
     """Get a list of all generated .deb binary and source packages"""
     srcprefix = 'packages/%s/source/imp_%s-1~%s' % (codename, version,
@@ -1829,6 +2395,16 @@ def _deb_packages(version, codename):
 
 def main():
     opts = get_options()
+    if opts.backfill:
+        db = DatabaseUpdater(opts.dryrun, 'imp_test', 'imp_benchmark', False,
+                             opts.imp_branch)
+        dates = [_parse_date(d) for d in opts.backfill]
+        db.backfill_test_rollup(*dates)
+        db.backfill_benchmark_rollup(*dates)
+        db.backfill_test_history(*dates)
+        db.backfill_search_index(*dates)
+        db.backfill_failure_signatures(*dates)
+        return
     impcheck = IMPChecker("/salilab/diva1/home/imp/" + opts.imp_branch,
                           opts.imp_branch)
     # Lab-only components are currently only built against the develop branch
@@ -2023,6 +2599,14 @@ def main():
             if nerr == 0:
                 check.activate_new_build()
         check.update_done_build(opts.dryrun)
+    # Fill the results caches before the email sends people to the pages
+    # (this only helps the first visitors, so never fail the build)
+    if not opts.dryrun and opts.warm_cache:
+        try:
+            warm_results_cache(opts.imp_branch, opts.warm_cache_url,
+                               opts.warm_cache_lab_url)
+        except Exception as detail:
+            print("WARNING: could not warm results caches: %s" % detail)
     if not opts.dryrun and opts.email \
        and opts.imp_branch == 'develop':
         email_from = get_imp_build_email_from()
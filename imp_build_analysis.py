@@ -0,0 +1,248 @@
+"""Find step changes (regressions) in benchmark and test runtimes.
+
+   Each benchmark series (a benchmark name on a platform) is compared
+   with a robust baseline over a trailing window: the median of the
+   earlier runtimes in the window, with the spread estimated from the
+   median absolute deviation (MAD) so that the occasional outlier does not
+   affect it. A regression is flagged when the most recent few runtimes
+   are all slower than the baseline by both a statistically significant
+   amount and a minimum relative effect, and the run before them was not;
+   that is, at the point where the runtime steps up. A single slow run
+   is not enough, and a change is only reported once.
+
+   Test runtimes are noisier, and there are many more of them, so only
+   tests that take a significant amount of time are considered. A test is
+   flagged when its latest runtime jumps relative to its own median over
+   a trailing window, by more than the typical noise of tests on the same
+   platform (some build hosts are much noisier than others).
+
+   A test is considered flaky if, over a trailing window, its state on a
+   platform flips between passing and failing much more often than a
+   test that simply broke (one flip) and was later fixed (another).
+
+   Failures are grouped by a signature, a hash of the test output with
+   anything that varies between platforms and nights (file paths, line
+   numbers, memory addresses, timings and floating-point values) removed,
+   so that one bug that breaks a test on many platforms is seen once.
+"""
+
+import collections
+import hashlib
+import itertools
+import re
+import statistics
+
+# Number of days of history used for the baseline
+BASELINE_DAYS = 28
+
+# Minimum number of earlier runs needed for a baseline
+MIN_BASELINE_POINTS = 7
+
+# Number of consecutive slow runs needed to flag a step change
+RECENT_POINTS = 3
+
+# Minimum change, as a fraction of the baseline runtime, to report
+MIN_EFFECT = 0.1
+
+# Minimum change, in robust standard deviations, to report
+MIN_ZSCORE = 4.0
+
+# Scale factor to estimate the standard deviation from the MAD
+# (for normally distributed data)
+MAD_SCALE = 1.4826
+
+# Number of days of history used for the test runtime baseline
+TEST_BASELINE_DAYS = 14
+
+# Minimum number of earlier runs of a test needed for a baseline
+MIN_TEST_BASELINE_POINTS = 5
+
+# Only consider tests that took at least this long (in seconds), and
+# increased by at least this much
+MIN_TEST_RUNTIME = 5.0
+
+# Minimum change in test runtime, as a fraction of the baseline, to report
+MIN_TEST_EFFECT = 0.5
+
+# Number of days of test results used to look for flaky tests
+FLAKY_DAYS = 30
+
+# Minimum number of runs in the window needed to judge a test as flaky
+MIN_FLAKY_RUNS = 10
+
+# Minimum number of pass/fail flips in the window for a flaky test
+MIN_FLAKY_FLIPS = 3
+
+# Minimum flakiness score (the fraction of consecutive runs in which the
+# state flipped) for a flaky test
+MIN_FLAKY_SCORE = 0.15
+
+# Patterns replaced in test output to get a failure signature, in order
+_SIGNATURE_SUBS = [
+    # File paths (keep only the file name)
+    (re.compile(r'(?:[A-Za-z]:)?(?:[\w.+~-]*[/\\])+([\w.+~-]+)'), r'\1'),
+    # Line numbers
+    (re.compile(r'\b(line) \d+', re.IGNORECASE), r'\1 N'),
+    (re.compile(r'(\.\w+)[:(]\d+\)?'), r'\1:N'),
+    # Memory addresses
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), '0xN'),
+    # Timings
+    (re.compile(r'\b\d+(?:\.\d+)?\s*(?:s|ms|sec|secs|seconds)\b'), 'Ts'),
+    # Floating-point values
+    (re.compile(r'[-+]?\b\d+\.\d*(?:[eE][-+]?\d+)?'), 'F'),
+    (re.compile(r'\s+'), ' ')]
+
+# Words that suggest a line of test output describes the error
+_ERROR_LINE = re.compile(r'Error|Exception|assert|FAIL|Abort|Segmentation',
+                         re.IGNORECASE)
+
+# Maximum length of the summary stored for each failure signature
+MAX_SUMMARY_LENGTH = 200
+
+
+Regression = collections.namedtuple(
+    'Regression', ['name', 'platform', 'change_date', 'baseline', 'runtime',
+                   'effect'])
+
+Slowdown = collections.namedtuple(
+    'Slowdown', ['name', 'arch', 'baseline', 'runtime', 'effect'])
+
+Flaky = collections.namedtuple(
+    'Flaky', ['name', 'arch', 'runs', 'flips', 'score'])
+
+
+def get_robust_baseline(values):
+    """Get the median and robust standard deviation of a list of values"""
+    median = statistics.median(values)
+    mad = statistics.median(abs(v - median) for v in values)
+    return median, mad * MAD_SCALE
+
+
+def find_series_regression(name, platform, dates, runtimes):
+    """Look for a step change at the end of a single series of runtimes
+       (sorted by date). Return a Regression, or None."""
+    if len(runtimes) < MIN_BASELINE_POINTS + RECENT_POINTS:
+        return None
+    baseline_runtimes = runtimes[:-RECENT_POINTS]
+    recent = runtimes[-RECENT_POINTS:]
+    baseline, sigma = get_robust_baseline(baseline_runtimes)
+    if baseline <= 0.:
+        return None
+    threshold = baseline + max(MIN_ZSCORE * sigma, MIN_EFFECT * baseline)
+    # Every recent run must be slow, but not the one before, otherwise the
+    # change started earlier (and would have been reported then)
+    if min(recent) <= threshold or baseline_runtimes[-1] > threshold:
+        return None
+    runtime = statistics.median(recent)
+    return Regression(name=name, platform=platform,
+                      change_date=dates[-RECENT_POINTS], baseline=baseline,
+                      runtime=runtime, effect=(runtime - baseline) / baseline)
+
+
+def _get_series(rows, date):
+    """Split (name, platform, date, value) rows, sorted by name, platform
+       and date, into series, skipping missing values. Yield a
+       (name, platform, dates, values) tuple for each series that has
+       a value on the given date."""
+    for key, group in itertools.groupby(rows, key=lambda r: r[:2]):
+        group = [r for r in group if r[3] is not None]
+        if group and group[-1][2] == date:
+            yield (key[0], key[1], [r[2] for r in group],
+                   [r[3] for r in group])
+
+
+def find_regressions(rows, date):
+    """Find regressions in all benchmark series in a single pass.
+       rows should be (name, platform, date, runtime) tuples, sorted by
+       name, platform and date, covering the BASELINE_DAYS up to and
+       including the given date. Only series that have a result on the
+       date are checked. Yield Regression objects."""
+    for name, platform, dates, runtimes in _get_series(rows, date):
+        r = find_series_regression(name, platform, dates, runtimes)
+        if r:
+            yield r
+
+
+def find_test_slowdowns(rows, date):
+    """Find tests that got slower in the build on the given date.
+       rows should be (name, arch, date, runtime) tuples for successful
+       test runs, sorted by name, arch and date, covering the
+       TEST_BASELINE_DAYS up to and including the given date.
+       Yield Slowdown objects."""
+    # Get the baseline for each test, and the noise in test runtimes,
+    # relative to the baseline, for each platform
+    series = []
+    noise = collections.defaultdict(list)
+    for name, arch, dates, runtimes in _get_series(rows, date):
+        if len(runtimes) <= MIN_TEST_BASELINE_POINTS:
+            continue
+        baseline, sigma = get_robust_baseline(runtimes[:-1])
+        if baseline > 0.:
+            series.append((name, arch, runtimes, baseline))
+            noise[arch].append(sigma / baseline)
+    noise = dict((arch, statistics.median(n)) for arch, n in noise.items())
+    for name, arch, runtimes, baseline in series:
+        threshold = baseline * (1. + max(MIN_TEST_EFFECT,
+                                         MIN_ZSCORE * noise[arch]))
+        threshold = max(threshold, baseline + MIN_TEST_RUNTIME)
+        # Only report the test the first time it is slow
+        if runtimes[-1] > threshold and runtimes[-2] <= threshold:
+            yield Slowdown(name=name, arch=arch, baseline=baseline,
+                           runtime=runtimes[-1],
+                           effect=(runtimes[-1] - baseline) / baseline)
+
+
+def get_flips(states):
+    """Get the number of runs in a sequence of pass/fail (True/False)
+       states, and the number of times the state changed"""
+    runs = flips = 0
+    prev = None
+    for ok in states:
+        if prev is not None and ok != prev:
+            flips += 1
+        prev = ok
+        runs += 1
+    return runs, flips
+
+
+def find_flaky_tests(rows):
+    """Find flaky tests. rows should be (name, arch, states) tuples, where
+       states is the sequence of pass/fail (True/False) states of the test
+       over the FLAKY_DAYS window, oldest first. Yield Flaky objects."""
+    for name, arch, states in rows:
+        runs, flips = get_flips(states)
+        if runs < MIN_FLAKY_RUNS or flips < MIN_FLAKY_FLIPS:
+            continue
+        score = flips / (runs - 1)
+        if score >= MIN_FLAKY_SCORE:
+            yield Flaky(name=name, arch=arch, runs=runs, flips=flips,
+                        score=score)
+
+
+def normalize_failure(detail):
+    """Remove anything that varies between platforms and nights from
+       a line of test output"""
+    for regex, repl in _SIGNATURE_SUBS:
+        detail = regex.sub(repl, detail)
+    return detail.strip()
+
+
+def get_failure_signature(test_name, state, detail):
+    """Get the signature of a test failure (a short hash of its normalized
+       output) and a one-line summary of the error. Failures with no
+       output are distinguished only by the test name and state."""
+    lines = (detail or '').split('\n')
+    if lines[0].startswith('[...]'):
+        # Output was truncated (see TestSQLInserter), so the first line
+        # is partial and depends on where the truncation happened
+        lines = lines[1:]
+    lines = [normalize_failure(line) for line in lines]
+    lines = [line for line in lines if line]
+    if lines:
+        text = "\n".join(lines)
+        errors = [line for line in lines if _ERROR_LINE.search(line)]
+        summary = (errors or lines)[-1]
+    else:
+        text = summary = "%s %s" % (test_name, state)
+    sig = hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+    return sig, summary[:MAX_SUMMARY_LENGTH]
@@ -0,0 +1,105 @@
+"""Full-text search over failed tests.
+
+   Test failures (the test name and its output) are added to an sqlite
+   FTS5 index, stored in a single file alongside the MySQL database, by
+   check_build.py as each build is stored. The web interface can then find
+   every build in which a given error message or traceback appeared,
+   without scanning the (very large) test detail column in MySQL.
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+
+# Markers placed around matched terms in snippets (these should not appear
+# in test output, and are replaced after the snippet is HTML-escaped)
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+
+def get_fts_query(text):
+    """Convert user-supplied search text into an FTS5 query. Each word,
+       or each "quoted phrase", must appear in a result. Any FTS5 query
+       syntax or punctuation in the text is treated as ordinary text."""
+    terms = [m.group(1) if m.group(1) is not None else m.group(2)
+             for m in re.finditer(r'"([^"]*)"|(\S+)', text)]
+    return " ".join('"%s"' % t.replace('"', '""') for t in terms if t)
+
+
+class SearchIndex:
+    """An sqlite full-text index of failed tests in all branches"""
+
+    def __init__(self, fname, readonly=False):
+        if readonly:
+            self.conn = sqlite3.connect('file:%s?mode=ro' % fname, uri=True)
+        else:
+            self.conn = sqlite3.connect(fname)
+            self._create()
+
+    @classmethod
+    def open(cls, fname):
+        """Open an existing index for searching, or return None if it
+           does not exist"""
+        if fname and os.path.exists(fname):
+            return cls(fname, readonly=True)
+
+    def _create(self):
+        c = self.conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS result (id INTEGER PRIMARY KEY, "
+                  "branch TEXT NOT NULL, date TEXT NOT NULL, "
+                  "test INT NOT NULL, unit INT NOT NULL, arch INT NOT NULL, "
+                  "lab_only INT NOT NULL)")
+        c.execute("CREATE INDEX IF NOT EXISTS result_branch_date "
+                  "ON result (branch, date)")
+        c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS result_text "
+                  "USING fts5(name, detail)")
+        self.conn.commit()
+
+    def add_results(self, branch, date, rows):
+        """Add the failed tests for a build, replacing any previously added.
+           rows should be (test ID, unit ID, platform ID, lab_only, test name,
+           detail) tuples."""
+        c = self.conn.cursor()
+        c.execute("DELETE FROM result_text WHERE rowid IN (SELECT id "
+                  "FROM result WHERE branch=? AND date=?)",
+                  (branch, date.isoformat()))
+        c.execute("DELETE FROM result WHERE branch=? AND date=?",
+                  (branch, date.isoformat()))
+        for test, unit, arch, lab_only, name, detail in rows:
+            c.execute("INSERT INTO result (branch, date, test, unit, arch, "
+                      "lab_only) VALUES (?, ?, ?, ?, ?, ?)",
+                      (branch, date.isoformat(), test, unit, arch,
+                       bool(lab_only)))
+            c.execute("INSERT INTO result_text (rowid, name, detail) "
+                      "VALUES (?, ?, ?)", (c.lastrowid, name, detail or ''))
+        self.conn.commit()
+
+    def search(self, text, branch, lab_only, start_date=None, end_date=None,
+               arch=None, unit=None, offset=0, limit=50):
+        """Find failed tests matching the given text, most recent first.
+           Return a list of dicts, each containing the date, test, unit and
+           arch IDs, and a snippet of the matching output."""
+        query = get_fts_query(text)
+        if not query:
+            return []
+        sql = ("SELECT r.date, r.test, r.unit, r.arch, "
+               "snippet(result_text, -1, ?, ?, '...', 24) "
+               "FROM result_text JOIN result r ON r.id=result_text.rowid "
+               "WHERE result_text MATCH ? AND r.branch=?")
+        args = [MATCH_START, MATCH_END, query, branch]
+        if not lab_only:
+            sql += " AND r.lab_only=0"
+        for cond, value in (("r.date>=?", start_date),
+                            ("r.date<=?", end_date),
+                            ("r.arch=?", arch), ("r.unit=?", unit)):
+            if value is not None:
+                sql += " AND " + cond
+                args.append(value.isoformat() if hasattr(value, 'isoformat')
+                            else value)
+        sql += " ORDER BY r.date DESC, r.id DESC LIMIT ? OFFSET ?"
+        args.extend((limit, offset))
+        c = self.conn.cursor()
+        c.execute(sql, args)
+        return [{'date': datetime.date.fromisoformat(date), 'test': test,
+                 'unit': unit, 'arch': arch, 'snippet': snippet}
+                for date, test, unit, arch, snippet in c]
@@ -1,13 +1,24 @@
 import glob
+import html
+import array
+import bisect
+import gzip
+import io
 import datetime
 import pickle
+import re
 import os
 import MySQLdb
 import collections
+import itertools
+import statistics
 from email.message import EmailMessage
+import imp_build_analysis
 
 topdir = '/salilab/diva1/home/imp'
 lab_only_topdir = '/salilab/diva1/home/imp-salilab/develop'
+# Full-text index of test failures (see imp_build_search.py)
+search_index = '/salilab/diva1/home/imp/search-index.db'
 OK_STATES = ('OK', 'SKIP', 'EXPFAIL', 'SKIP_EXPFAIL')
 lab_only_results_url = 'https://salilab.org/internal/imp/nightly/results/'
 results_url = 'https://integrativemodeling.org/nightly/results/'
@@ -42,6 +53,20 @@ def get_topdir(branch):
     return os.path.join(topdir, branch)
 
 
+def get_branch_table(name, branch):
+    """Get the name of the copy of a table for the given IMP branch"""
+    if branch == 'develop':
+        return name
+    else:
+        return name + '_' + branch.replace('/', '_').replace('.', '_')
+
+
+def get_summary_stamp(branch):
+    """Get the file that is touched whenever a build summary is stored
+       for this branch, so that cached build status can be invalidated"""
+    return os.path.join(get_topdir(branch), '.summary')
+
+
 class Platform:
     def __init__(self, very_short, short, long, very_long, logfile):
         self.very_short = very_short
@@ -905,6 +930,351 @@ def date_to_directory(date):
     return date.strftime('%Y%m%d')
 
 
+# Periods that benchmark results are rolled up into, finest first
+BENCHMARK_ROLLUP_BUCKETS = ('week', 'month')
+
+
+def get_bucket_range(date, bucket):
+    """Get the first date of the week (starting Monday) or month containing
+       the given date, and the first date of the following week or month"""
+    if bucket == 'week':
+        start = date - datetime.timedelta(days=date.weekday())
+        return start, start + datetime.timedelta(days=7)
+    elif bucket == 'month':
+        start = date.replace(day=1)
+        if start.month == 12:
+            return start, start.replace(year=start.year + 1, month=1)
+        else:
+            return start, start.replace(month=start.month + 1)
+    else:
+        raise ValueError("Unknown bucket %s" % bucket)
+
+
+def summarize_benchmarks(rows):
+    """Given (name, platform, runtime, checkval) rows sorted by name and
+       platform, yield a (name, platform, samples, min, median and max
+       runtime, min, median and max checkval) tuple for each benchmark
+       and platform. Missing runtimes or checkvals are ignored."""
+    def get_stats(values):
+        values = sorted(v for v in values if v is not None)
+        if values:
+            return values[0], statistics.median(values), values[-1]
+        else:
+            return None, None, None
+    for key, group in itertools.groupby(rows, key=lambda r: r[:2]):
+        group = list(group)
+        yield (key + (len(group),) + get_stats(r[2] for r in group)
+               + get_stats(r[3] for r in group))
+
+
+def get_commit_range_url(rev_from, rev_to):
+    """Get a URL showing all IMP commits between two git revisions,
+       or None if either is unknown"""
+    if rev_from and rev_to:
+        return ('https://github.com/salilab/imp/compare/%s...%s'
+                % (rev_from, rev_to))
+
+
+def get_line_index_file(logfile):
+    """Get the name of the line index file for the given log file"""
+    return logfile + '.idx'
+
+
+def write_line_index(logfile):
+    """Write a line index file for the given log file, containing the byte
+       offset of the start of each line as an unsigned 64-bit integer"""
+    offsets = array.array('Q')
+    offset = 0
+    with open(logfile, 'rb') as fh:
+        for line in fh:
+            offsets.append(offset)
+            offset += len(line)
+    with open(get_line_index_file(logfile), 'wb') as fh:
+        offsets.tofile(fh)
+
+
+class LogLineIndex:
+    """Read arbitrary lines from a log file, using the line index file
+       written by write_line_index(). Only the parts of the index and the
+       log that are needed are read."""
+
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self._index = get_line_index_file(logfile)
+        self._log_size = os.path.getsize(logfile)
+        self.num_lines = os.path.getsize(self._index) // 8
+
+    @classmethod
+    def open(cls, logfile):
+        """Get a LogLineIndex for the given file, or None if it has
+           no index or the index is older than the file"""
+        idx = get_line_index_file(logfile)
+        if (os.path.exists(idx)
+                and os.path.getmtime(idx) >= os.path.getmtime(logfile)):
+            return cls(logfile)
+
+    def _get_offset(self, line, fh):
+        if line >= self.num_lines:
+            return self._log_size
+        fh.seek(line * 8)
+        a = array.array('Q')
+        a.frombytes(fh.read(8))
+        return a[0]
+
+    def get_lines(self, start, end):
+        """Get lines start through end-1 (counting from zero)
+           of the log file"""
+        start = max(start, 0)
+        end = min(end, self.num_lines)
+        if start >= end:
+            return []
+        with open(self._index, 'rb') as fh:
+            start_offset = self._get_offset(start, fh)
+            end_offset = self._get_offset(end, fh)
+        with open(self.logfile, 'rb') as fh:
+            fh.seek(start_offset)
+            data = fh.read(end_offset - start_offset)
+        return _split_log_lines(data)
+
+    def get_tail(self, size=65536):
+        """Get up to the last size bytes of the log file"""
+        with open(self.logfile, 'rb') as fh:
+            fh.seek(max(self._log_size - size, 0))
+            return fh.read().decode('utf-8', errors='replace')
+
+    def __iter__(self):
+        with open(self.logfile, 'rb') as fh:
+            for line in fh:
+                yield line.decode('utf-8', errors='replace')
+
+
+def _split_log_lines(data):
+    """Split raw log file contents into lines (only on newlines, as
+       the line index does)"""
+    return [line.decode('utf-8', errors='replace')
+            for line in io.BytesIO(data)]
+
+
+# Approximate uncompressed size of each block in compressed log files
+LOG_BLOCK_SIZE = 1024 * 1024
+
+
+def compress_log(logfile, block_size=LOG_BLOCK_SIZE):
+    """Compress a log file to logfile.gz, and remove the original (and its
+       line index, if any).
+       The compressed file is a series of gzip members, each holding whole
+       lines and about block_size bytes of the original, so it can be read
+       with any gzip tool, but also read block by block. An index file
+       logfile.gz.idx records the compressed offset, uncompressed offset,
+       and first line number of each block (as unsigned 64-bit integers),
+       followed by the compressed size, uncompressed size and number of
+       lines of the whole file."""
+    gzfile = logfile + '.gz'
+    blocks = array.array('Q')
+    offset = nlines = 0
+    with open(logfile, 'rb') as fin, open(gzfile, 'wb') as fout:
+        def write_block(lines):
+            blocks.extend((fout.tell(), offset, nlines))
+            fout.write(gzip.compress(b''.join(lines)))
+        lines, size = [], 0
+        for line in fin:
+            lines.append(line)
+            size += len(line)
+            if size >= block_size:
+                write_block(lines)
+                offset += size
+                nlines += len(lines)
+                lines, size = [], 0
+        if lines:
+            write_block(lines)
+            offset += size
+            nlines += len(lines)
+        blocks.extend((fout.tell(), offset, nlines))
+    with open(get_line_index_file(gzfile), 'wb') as fh:
+        blocks.tofile(fh)
+    os.unlink(logfile)
+    if os.path.exists(get_line_index_file(logfile)):
+        os.unlink(get_line_index_file(logfile))
+
+
+class CompressedLog:
+    """Read arbitrary lines from a log file compressed by compress_log(),
+       decompressing only the blocks that are needed"""
+
+    def __init__(self, gzfile):
+        self.logfile = gzfile
+        a = array.array('Q')
+        with open(get_line_index_file(gzfile), 'rb') as fh:
+            a.frombytes(fh.read())
+        self._blocks = [tuple(a[i:i + 3]) for i in range(0, len(a), 3)]
+        self._first_lines = [b[2] for b in self._blocks]
+        self.num_lines = self._blocks[-1][2]
+
+    def _read_blocks(self, first, last):
+        """Get the uncompressed contents of blocks first through last"""
+        with open(self.logfile, 'rb') as fh:
+            fh.seek(self._blocks[first][0])
+            data = fh.read(self._blocks[last + 1][0]
+                           - self._blocks[first][0])
+        return gzip.decompress(data)
+
+    def get_lines(self, start, end):
+        """Get lines start through end-1 (counting from zero)
+           of the log file"""
+        start = max(start, 0)
+        end = min(end, self.num_lines)
+        if start >= end:
+            return []
+        first = bisect.bisect_right(self._first_lines, start) - 1
+        last = bisect.bisect_left(self._first_lines, end) - 1
+        lines = _split_log_lines(self._read_blocks(first, last))
+        skip = start - self._first_lines[first]
+        return lines[skip:skip + end - start]
+
+    def get_tail(self, size=65536):
+        """Get up to the last size bytes of the log file"""
+        last = len(self._blocks) - 2
+        if last < 0:
+            return ''
+        first = last
+        total = self._blocks[-1][1]
+        while first > 0 and total - self._blocks[first][1] < size:
+            first -= 1
+        data = self._read_blocks(first, last)[-size:]
+        return data.decode('utf-8', errors='replace')
+
+    def __iter__(self):
+        for i in range(len(self._blocks) - 1):
+            yield from _split_log_lines(self._read_blocks(i, i))
+
+
+def open_log(logfile):
+    """Get an object to read lines from the given log file (either
+       a compressed file, or an uncompressed file with an up to date
+       line index), or None if the log file can only be read in full"""
+    if logfile.endswith('.gz'):
+        return CompressedLog(logfile)
+    else:
+        return LogLineIndex.open(logfile)
+
+
+class TestHistory:
+    """The daily pass/fail history of a test on a single platform, as stored
+       in the imp_test_history table. States are run-length encoded as
+       a string such as '30P2F1-3P' (30 days passing, 2 failing, 1 day not
+       run, 3 passing) covering every day from first_date to last_date.
+       Every build since covered_from (if known) was added to the history,
+       so the test did not run on that platform between covered_from and
+       first_date."""
+    PASS, FAIL, NOT_RUN = 'P', 'F', '-'
+    _run_re = re.compile(r'(\d+)([PF-])')
+
+    def __init__(self, first_date=None, last_date=None, runs='',
+                 last_ok=None, last_fail=None, covered_from=None):
+        self.first_date, self.last_date = first_date, last_date
+        self.last_ok, self.last_fail = last_ok, last_fail
+        self.covered_from = covered_from
+        self._runs = [[state, int(count)]
+                      for count, state in self._run_re.findall(runs)]
+
+    @property
+    def runs(self):
+        """The run-length encoded states"""
+        return "".join("%d%s" % (count, state) for state, count in self._runs)
+
+    def _append(self, state, count=1):
+        if self._runs and self._runs[-1][0] == state:
+            self._runs[-1][1] += count
+        else:
+            self._runs.append([state, count])
+
+    def add(self, date, ok):
+        """Add the result of the test on the given date. Days since the last
+           result are recorded as not run. Results older than the last one
+           are ignored; a new result for the same day replaces it."""
+        replaced = None
+        if self.last_date is None:
+            self.first_date = date
+        elif date < self.last_date:
+            return
+        elif date == self.last_date:
+            replaced = self._runs[-1][0]
+            self._runs[-1][1] -= 1
+            if self._runs[-1][1] == 0:
+                self._runs.pop()
+        else:
+            gap = (date - self.last_date).days - 1
+            if gap > 0:
+                self._append(self.NOT_RUN, gap)
+        self._append(self.PASS if ok else self.FAIL)
+        self.last_date = date
+        if ok:
+            self.last_ok = date
+            if replaced == self.FAIL:
+                self.last_fail = self._find_previous_date(date, self.FAIL)
+        else:
+            self.last_fail = date
+            if replaced == self.PASS:
+                self.last_ok = self._find_previous_date(date, self.PASS)
+
+    def _reversed_days(self):
+        """Yield (date, state) for every day, most recent first"""
+        date = self.last_date
+        for state, count in reversed(self._runs):
+            for i in range(count):
+                yield date, state
+                date -= datetime.timedelta(days=1)
+
+    def get_previous_date(self, before, ok):
+        """Get the most recent date before the given one on which the
+           test passed (or failed, if ok is False), or None"""
+        if ok and self.last_ok is not None and self.last_ok < before:
+            return self.last_ok
+        if not ok and self.last_fail is not None and self.last_fail < before:
+            return self.last_fail
+        return self._find_previous_date(before,
+                                        self.PASS if ok else self.FAIL)
+
+    def _find_previous_date(self, before, want):
+        for date, state in self._reversed_days():
+            if date < before and state == want:
+                return date
+
+    def get_streak(self, date):
+        """Get the state of the test on the given date, the number of
+           consecutive runs (ignoring days on which it did not run) with that
+           state, and the first date of the streak. Return None if the test
+           did not run on the date."""
+        streak = None
+        for d, state in self._reversed_days():
+            if d > date:
+                continue
+            if streak is None:
+                if state == self.NOT_RUN:
+                    return None
+                streak = [state, 0, d]
+            if state == streak[0]:
+                streak[1] += 1
+                streak[2] = d
+            elif state != self.NOT_RUN:
+                break
+        return tuple(streak) if streak else None
+
+    def get_states(self, date, days):
+        """Get (date, state) for the given number of days up to and
+           including the given date, oldest first"""
+        start = date - datetime.timedelta(days=days)
+        states = {}
+        for d, state in self._reversed_days():
+            if d <= start:
+                break
+            if d <= date:
+                states[d] = state
+        return [(d, states.get(d, self.NOT_RUN))
+                for d in (start + datetime.timedelta(days=i + 1)
+                          for i in range(days))]
+
+
 class _UnitSummary:
     def __init__(self, cur, test_fails, new_test_fails, build_info):
         self.data = summary = {}
@@ -967,6 +1337,12 @@ class _UnitSummary:
         return sorted_units + list(unsorted_units.keys())
 
 
+# Test detail can be large, so test lists just select whether it is present
+# (it can be fetched for individual tests with get_test_detail)
+_HAS_DETAIL = ("(imp_test.detail IS NOT NULL AND imp_test.detail!='') "
+               "AS has_detail")
+
+
 class BuildDatabase:
     def __init__(self, conn, date, lab_only, branch):
         self.conn = conn
@@ -984,10 +1360,7 @@ class BuildDatabase:
             return " AND imp_test_units.lab_only=false"
 
     def get_branch_table(self, name):
-        if self.branch == 'develop':
-            return name
-        else:
-            return name + '_' + self.branch.replace('/', '_').replace('.', '_')
+        return get_branch_table(name, self.branch)
 
     def get_previous_build_date(self):
         """Get the date of the previous build, or None."""
@@ -1006,8 +1379,45 @@ class BuildDatabase:
                 return row[0]
 
     def get_unit_summary(self):
-        c = MySQLdb.cursors.DictCursor(self.conn)
-        table = self.get_branch_table('imp_test')
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
+        rows = self._get_unit_rollup(c)
+        if rows:
+            test_fails = dict(((row['arch_id'], row['unit_id']),
+                               row['numfails']) for row in rows)
+            new_test_fails = dict(((row['arch_id'], row['unit_id']),
+                                   row['numnewfails']) for row in rows)
+        else:
+            # No rollup for this date (e.g. an old build), so calculate
+            # everything from the raw test results
+            test_fails, new_test_fails = self._get_test_fail_counts(c)
+            rows = self._get_unit_results(c)
+        return _UnitSummary(rows, test_fails, new_test_fails,
+                            self.get_build_info())
+
+    def _get_unit_rollup(self, c):
+        """Get the precomputed per-unit, per-platform summary for this date,
+           as written by check_build.py. This will be empty if no rollup
+           exists for this date."""
+        table = self.get_branch_table('imp_test_rollup')
+        query = 'SELECT imp_test_archs.name AS arch_name, ' \
+                'imp_test_units.lab_only, ' \
+                'imp_test_rollup.arch AS arch_id, ' \
+                'imp_test_units.id AS unit_id, ' \
+                'imp_test_units.name AS unit_name, ' \
+                'imp_test_rollup.state, imp_test_rollup.logline, ' \
+                'imp_test_rollup.numfails, imp_test_rollup.numnewfails ' \
+                'FROM imp_test_archs, imp_test_units, ' + table \
+                + ' imp_test_rollup WHERE ' \
+                'imp_test_archs.id=imp_test_rollup.arch AND ' \
+                'imp_test_units.id=imp_test_rollup.unit AND date=%s' \
+                + self.get_sql_lab_only()
+        c.execute(query, (self.date,))
+        return c.fetchall()
+
+    def _get_test_fail_counts(self, c, table=None):
+        """Count the failed (and newly-failed) tests for this date,
+           keyed by platform and unit ID"""
+        table = table or self.get_branch_table('imp_test')
         query = 'SELECT arch,imp_test_names.unit,delta FROM ' + table \
                 + ' imp_test,imp_test_names WHERE date=%s AND state NOT IN ' \
                 + str(OK_STATES) + ' AND imp_test.name=imp_test_names.id'
@@ -1019,8 +1429,10 @@ class BuildDatabase:
             test_fails[key] = test_fails.get(key, 0) + 1
             if row['delta'] == 'NEWFAIL':
                 new_test_fails[key] = new_test_fails.get(key, 0) + 1
+        return test_fails, new_test_fails
 
-        table = self.get_branch_table('imp_test_unit_result')
+    def _get_unit_results(self, c, table=None):
+        table = table or self.get_branch_table('imp_test_unit_result')
         query = 'SELECT imp_test_archs.name AS arch_name, ' \
                 'imp_test_units.lab_only, ' \
                 'imp_test_unit_result.arch AS arch_id, ' \
@@ -1033,19 +1445,35 @@ class BuildDatabase:
                 'imp_test_units.id=imp_test_unit_result.unit AND date=%s' \
                 + self.get_sql_lab_only()
         c.execute(query, (self.date,))
-        return _UnitSummary(c, test_fails, new_test_fails,
-                            self.get_build_info())
+        return c.fetchall()
+
+    def get_unit_rollup(self, test_table=None, unit_result_table=None):
+        """Calculate the per-unit, per-platform summary of this date's build
+           from the raw test results, for storage in the imp_test_rollup
+           table. Each row is an (arch, unit, state, numfails, numnewfails,
+           logline) tuple. The test and unit result tables to read can be
+           overridden (e.g. to use the temporary tables of a dry run)."""
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
+        test_fails, new_test_fails = self._get_test_fail_counts(c, test_table)
+        rows = []
+        for row in self._get_unit_results(c, unit_result_table):
+            key = (row['arch_id'], row['unit_id'])
+            rows.append((row['arch_id'], row['unit_id'], row['state'],
+                         test_fails.get(key, 0), new_test_fails.get(key, 0),
+                         row['logline']))
+        return rows
 
     def get_doc_summary(self):
         """Get a summary of the doc build"""
-        c = MySQLdb.cursors.DictCursor(self.conn)
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
         table = self.get_branch_table('imp_doc')
         query = "SELECT * FROM " + table + " WHERE date=%s"
         c.execute(query, (self.date,))
         return c.fetchone()
 
-    def get_build_summary(self):
-        """Get a one-word summary of the build"""
+    def get_build_summary(self, missing='OK'):
+        """Get a one-word summary of the build, or `missing` if no summary
+           has been stored for the build"""
         c = self.conn.cursor()
         state_ind = 0
         # States ordered by severity
@@ -1055,7 +1483,10 @@ class BuildDatabase:
         if not self.lab_only:
             query += ' AND lab_only=false'
         c.execute(query, (self.date,))
-        for row in c:
+        rows = c.fetchall()
+        if not rows:
+            return missing
+        for row in rows:
             # Report worst state
             state_ind = max(state_ind, states.index(row[0]))
         return states[state_ind]
@@ -1136,7 +1567,7 @@ class BuildDatabase:
         query = "SELECT imp_test_names.name AS test_name, imp_test.name, " \
                 "imp_test.arch, imp_test_units.name AS unit_name, " \
                 "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
+                "imp_test.state, imp_test.delta, " + _HAS_DETAIL + " FROM " \
                 + test + " imp_test, " \
                 "imp_test_names, imp_test_units, imp_test_archs WHERE " \
                 "imp_test.date=%s AND imp_test_names.unit=%s " \
@@ -1157,7 +1588,7 @@ class BuildDatabase:
                 "imp_test.arch, imp_test_units.name AS unit_name, " \
                 "imp_test_names.unit AS unit_id, " \
                 "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
+                "imp_test.state, imp_test.delta, " + _HAS_DETAIL + " FROM " \
                 + test + " imp_test, " \
                 "imp_test_names, imp_test_units, imp_test_archs WHERE " \
                 "imp_test.date=%s AND imp_test.state NOT IN " \
@@ -1167,13 +1598,130 @@ class BuildDatabase:
                 + " ORDER BY imp_test_units.name,imp_test_names.id"
         return self._get_tests(query, (self.date,))
 
+    def get_failure_groups(self):
+        """Get all failed tests in this build grouped by failure signature,
+           most common first. Each group is a dict containing the signature,
+           a summary of the error, the date the signature was first seen,
+           and a list of the failed tests. Signatures of failures stored
+           without one (by older builds) are computed from their output."""
+        test = self.get_branch_table('imp_test')
+        query = "SELECT imp_test.signature, imp_test_names.name AS " \
+                "test_name, imp_test.name, imp_test.arch, " \
+                "CASE WHEN imp_test.signature IS NULL " \
+                "THEN imp_test.detail END AS detail, " \
+                "imp_test_units.name AS unit_name, " \
+                "imp_test_names.unit AS unit_id, " \
+                "imp_test_archs.name AS arch_name, imp_test.state FROM " \
+                + test + " imp_test, imp_test_names, imp_test_units, " \
+                "imp_test_archs WHERE imp_test.date=%s AND " \
+                "imp_test.state NOT IN " + str(OK_STATES) + \
+                " AND imp_test.name=imp_test_names.id " \
+                "AND imp_test_names.unit=imp_test_units.id AND " \
+                "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only() \
+                + " ORDER BY imp_test.signature, imp_test_units.name, " \
+                "imp_test_names.id"
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
+        c.execute(query, (self.date,))
+        groups = {}
+        for row in c.fetchall():
+            sig, summary = row['signature'], None
+            if sig is None:
+                sig, summary = imp_build_analysis.get_failure_signature(
+                    row['test_name'], row['state'], row['detail'])
+            g = groups.get(sig)
+            if g is None:
+                g = groups[sig] = {'signature': sig, 'summary': summary,
+                                   'first_date': None, 'tests': []}
+            g['tests'].append(row)
+        groups = list(groups.values())
+        for g in groups:
+            g['tests'].sort(key=lambda r: (r['unit_name'], r['name']))
+        sigs = [g['signature'] for g in groups]
+        if sigs:
+            table = self.get_branch_table('imp_test_signature')
+            c.execute("SELECT signature, first_date, summary FROM " + table
+                      + " WHERE signature IN ("
+                      + ", ".join(["%s"] * len(sigs)) + ")", sigs)
+            info = dict((row['signature'], row) for row in c)
+            for g in groups:
+                if g['signature'] in info:
+                    g['first_date'] = info[g['signature']]['first_date']
+                    g['summary'] = info[g['signature']]['summary']
+        groups.sort(key=lambda g: len(g['tests']), reverse=True)
+        return groups
+
+    def get_test_diff(self, other, kind):
+        """Compare the tests in this build with those in another build
+           (a BuildDatabase for a different date and/or branch), using a
+           single join or anti-join. kind is 'newfail' or 'newok' for tests
+           that started failing or passing in this build, 'added' for tests
+           only in this build, or 'removed' for tests only in the other."""
+        ok = str(OK_STATES)
+        this = self.get_branch_table('imp_test')
+        prev = other.get_branch_table('imp_test')
+        # a is the test in the other build, b in this build
+        if kind in ('newfail', 'newok'):
+            t = 'a'
+            tables = prev + " a JOIN " + this + " b ON b.name=a.name " \
+                "AND b.arch=a.arch AND b.date=%s"
+            args = (self.date, other.date)
+            where = "a.date=%s AND a.state " \
+                + ("IN " if kind == 'newfail' else "NOT IN ") + ok \
+                + " AND b.state " \
+                + ("NOT IN " if kind == 'newfail' else "IN ") + ok
+        elif kind == 'added':
+            t = 'b'
+            tables = this + " b LEFT JOIN " + prev + " a ON a.name=b.name " \
+                "AND a.arch=b.arch AND a.date=%s"
+            args = (other.date, self.date)
+            where = "b.date=%s AND a.name IS NULL"
+        elif kind == 'removed':
+            t = 'a'
+            tables = prev + " a LEFT JOIN " + this + " b ON b.name=a.name " \
+                "AND b.arch=a.arch AND b.date=%s"
+            args = (self.date, other.date)
+            where = "a.date=%s AND b.name IS NULL"
+        else:
+            raise ValueError("Unknown kind of test diff: %s" % kind)
+        query = "SELECT imp_test_names.name AS test_name, " \
+                "{t}.name, {t}.arch, imp_test_units.name AS unit_name, " \
+                "imp_test_names.unit AS unit_id, " \
+                "imp_test_archs.name AS arch_name, a.state AS from_state, " \
+                "b.state AS to_state FROM {tables} " \
+                "JOIN imp_test_names ON {t}.name=imp_test_names.id " \
+                "JOIN imp_test_units ON " \
+                "imp_test_names.unit=imp_test_units.id " \
+                "JOIN imp_test_archs ON {t}.arch=imp_test_archs.id " \
+                "WHERE {where}".format(t=t, tables=tables, where=where) \
+                + self.get_sql_lab_only() \
+                + " ORDER BY imp_test_units.name, imp_test_names.name, " \
+                "imp_test_archs.name"
+        return self._get_tests(query, args)
+
+    def get_unit_diff(self, other):
+        """Get all components whose build state on some platform differs
+           between this build and another (see get_test_diff)"""
+        this = self.get_branch_table('imp_test_unit_result')
+        prev = other.get_branch_table('imp_test_unit_result')
+        query = "SELECT imp_test_units.name AS unit_name, " \
+                "a.unit AS unit_id, a.arch, " \
+                "imp_test_archs.name AS arch_name, " \
+                "a.state AS from_state, b.state AS to_state FROM " + prev \
+                + " a JOIN " + this + " b ON b.arch=a.arch AND " \
+                "b.unit=a.unit AND b.date=%s JOIN imp_test_units ON " \
+                "a.unit=imp_test_units.id JOIN imp_test_archs ON " \
+                "a.arch=imp_test_archs.id WHERE a.date=%s AND " \
+                "a.state<>b.state" + self.get_sql_lab_only() \
+                + " ORDER BY imp_test_units.name, imp_test_archs.name"
+        return self._get_tests(query, (self.date, other.date))
+
     def get_new_failed_tests(self):
         test = self.get_branch_table('imp_test')
         query = "SELECT imp_test_names.name AS test_name, imp_test.name, " \
                 "imp_test.arch, imp_test_units.name AS unit_name, " \
                 "imp_test_names.unit AS unit_id, " \
                 "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
+                "imp_test.state, imp_test.delta, " + _HAS_DETAIL + " FROM " \
                 + test + " imp_test, " \
                 "imp_test_names, imp_test_units, imp_test_archs WHERE " \
                 "imp_test.date=%s AND imp_test.delta='NEWFAIL' " \
@@ -1189,7 +1737,7 @@ class BuildDatabase:
                 "imp_test.arch, imp_test_units.name AS unit_name, " \
                 "imp_test_names.unit AS unit_id, " \
                 "imp_test_archs.name AS arch_name, imp_test.runtime, " \
-                "imp_test.state, imp_test.delta, imp_test.detail FROM " \
+                "imp_test.state, imp_test.delta, " + _HAS_DETAIL + " FROM " \
                 + test + " imp_test, " \
                 "imp_test_names, imp_test_units, imp_test_archs WHERE " \
                 "imp_test.date=%s AND imp_test.runtime>20.0 AND " \
@@ -1199,13 +1747,87 @@ class BuildDatabase:
                 + " ORDER BY imp_test.runtime DESC"
         return self._get_tests(query, (self.date,))
 
+    def get_benchmark_regressions(self, days=1):
+        """Get benchmark regressions detected in builds in the given number
+           of days up to and including this build, most recent first"""
+        table = self.get_branch_table('imp_benchmark_regression')
+        query = "SELECT r.date, r.change_date, r.name, r.platform, " \
+                "r.baseline, r.runtime, r.effect, r.rev_from, r.rev_to, " \
+                "imp_benchmark_names.name AS bench_name, " \
+                "imp_benchmark_names.algorithm, " \
+                "imp_benchmark_files.id AS file_id, " \
+                "imp_benchmark_files.name AS file_name, " \
+                "imp_test_units.name AS unit_name, " \
+                "imp_test_archs.name AS arch_name FROM " + table + " r, " \
+                "imp_benchmark_names, imp_benchmark_files, imp_test_units, " \
+                "imp_test_archs WHERE r.date<=%s AND r.date>%s AND " \
+                "r.name=imp_benchmark_names.id AND " \
+                "imp_benchmark_names.file=imp_benchmark_files.id AND " \
+                "imp_benchmark_files.unit=imp_test_units.id AND " \
+                "r.platform=imp_test_archs.id" + self.get_sql_lab_only() \
+                + " ORDER BY r.date DESC, r.effect DESC"
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
+        c.execute(query, (self.date,
+                          self.date - datetime.timedelta(days=days)))
+        return c.fetchall()
+
+    def get_test_history(self, name, arch):
+        """Get the TestHistory of a test on a platform, or None if no
+           history has been recorded"""
+        table = self.get_branch_table('imp_test_history')
+        c = self.conn.cursor()
+        c.execute("SELECT first_date, last_date, runs, last_ok, last_fail, "
+                  "covered_from FROM " + table + " WHERE name=%s AND arch=%s",
+                  (name, arch))
+        row = c.fetchone()
+        if row:
+            return TestHistory(*row)
+
+    def get_test_slowdowns(self, days=1):
+        """Get tests that were found to have got slower in builds in the
+           given number of days up to and including this build,
+           most recent first"""
+        table = self.get_branch_table('imp_test_slowdown')
+        query = "SELECT s.date, s.name, s.arch, s.baseline, s.runtime, " \
+                "s.effect, imp_test_names.name AS test_name, " \
+                "imp_test_units.name AS unit_name, " \
+                "imp_test_archs.name AS arch_name FROM " + table + " s, " \
+                "imp_test_names, imp_test_units, imp_test_archs " \
+                "WHERE s.date<=%s AND s.date>%s AND " \
+                "s.name=imp_test_names.id AND " \
+                "imp_test_names.unit=imp_test_units.id AND " \
+                "s.arch=imp_test_archs.id" + self.get_sql_lab_only() \
+                + " ORDER BY s.date DESC, s.runtime - s.baseline DESC"
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
+        c.execute(query, (self.date,
+                          self.date - datetime.timedelta(days=days)))
+        return c.fetchall()
+
+    def get_flaky_tests(self):
+        """Get tests that were found to be flaky in this build, flakiest
+           first"""
+        table = self.get_branch_table('imp_test_flaky')
+        query = "SELECT f.name, f.arch, f.runs, f.flips, f.score, " \
+                "imp_test_names.name AS test_name, " \
+                "imp_test_names.unit AS unit_id, " \
+                "imp_test_units.name AS unit_name, " \
+                "imp_test_archs.name AS arch_name FROM " + table + " f, " \
+                "imp_test_names, imp_test_units, imp_test_archs " \
+                "WHERE f.date=%s AND f.name=imp_test_names.id AND " \
+                "imp_test_names.unit=imp_test_units.id AND " \
+                "f.arch=imp_test_archs.id" + self.get_sql_lab_only() \
+                + " ORDER BY f.score DESC, f.flips DESC"
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
+        c.execute(query, (self.date,))
+        return c.fetchall()
+
     def get_test_dict(self, date=None):
         """Get the state of every one of the day's tests, as a dict keyed by
            the test name and platform."""
         if date is None:
             date = self.date
         d = {}
-        c = MySQLdb.cursors.DictCursor(self.conn)
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
         table = self.get_branch_table('imp_test')
         query = "SELECT name,arch,state FROM " + table + " WHERE date=%s"
         c.execute(query, (date,))
@@ -1213,8 +1835,24 @@ class BuildDatabase:
             d[(row['name'], row['arch'])] = row['state']
         return d
 
+    def get_test_detail(self, name, arch):
+        """Get the detailed output of a single test, or None if the test
+           did not run"""
+        test = self.get_branch_table('imp_test')
+        query = "SELECT imp_test.detail FROM " + test + " imp_test, " \
+                "imp_test_names, imp_test_units WHERE imp_test.date=%s " \
+                "AND imp_test.name=%s AND imp_test.arch=%s " \
+                "AND imp_test.name=imp_test_names.id " \
+                "AND imp_test_names.unit=imp_test_units.id" \
+                + self.get_sql_lab_only()
+        c = self.conn.cursor()
+        c.execute(query, (self.date, name, arch))
+        row = c.fetchone()
+        if row is not None:
+            return row[0] or ''
+
     def _get_tests(self, query, args):
-        c = MySQLdb.cursors.DictCursor(self.conn)
+        c = self.conn.cursor(MySQLdb.cursors.DictCursor)
         c.execute(query, args)
         return c
 
@@ -1326,12 +1964,28 @@ class _EmailBody:
                  'skip': 'not built on this platform'}
 
     def get_failed_units(self):
-        numfail = 0
+        """Get the number of new test failures, the components they are in,
+           and the number of new failures of known flaky tests (which are
+           not included in the first two)"""
+        flaky = frozenset((t['name'], t['arch'])
+                          for t in self.db.get_flaky_tests())
+        numfail = numflaky = 0
         failed_units = {}
         for test in self.db.get_new_failed_tests():
-            numfail += 1
-            failed_units[test['unit_name']] = None
-        return numfail, failed_units
+            if (test['name'], test['arch']) in flaky:
+                numflaky += 1
+            else:
+                numfail += 1
+                failed_units[test['unit_name']] = None
+        return numfail, failed_units, numflaky
+
+    def get_flaky_failures(self, numflaky):
+        if numflaky == 0:
+            return ""
+        return "\n\n%d new test failure%s %s of tests known to be flaky " \
+               "(tests that\nfrequently flip between passing and failing).\n" \
+               % (numflaky, "" if numflaky == 1 else "s",
+                  "was" if numflaky == 1 else "were")
 
     def get_all_broken_links(self):
         if not self.doc:
@@ -1354,7 +2008,10 @@ class _EmailBody:
 
     def get_text(self):
         return (self.get_header() + self.get_component_summary()
-                + self.get_new_failures() + self.get_broken_links()
+                + self.get_new_failures()
+                + self.get_test_slowdowns()
+                + self.get_benchmark_regressions()
+                + self.get_broken_links()
                 + self.get_logs() + self.get_footer())
 
 
@@ -1383,16 +2040,45 @@ class _PlainEmailBody(_EmailBody):
         return body
 
     def get_new_failures(self):
-        numfail, failed_units = self.get_failed_units()
+        numfail, failed_units, numflaky = self.get_failed_units()
         if numfail > 0:
             return "\nThere were %d new test failures (tests that passed " \
                    "yesterday\n" % numfail \
                    + "but failed today) in the following components:\n" \
                    + "\n".join("   " + unit
-                               for unit in sorted(failed_units.keys()))
+                               for unit in sorted(failed_units.keys())) \
+                   + self.get_flaky_failures(numflaky)
         else:
+            return self.get_flaky_failures(numflaky)
+
+    def get_test_slowdowns(self):
+        slow = self.db.get_test_slowdowns()
+        if not slow:
+            return ""
+        return "\n\nTests that got much slower today:\n" \
+               + "\n".join("   %s on %s: %.1fs -> %.1fs"
+                           % (s['test_name'],
+                              platforms_dict[s['arch_name']].very_short,
+                              s['baseline'], s['runtime'])
+                           for s in slow) + "\n"
+
+    def get_benchmark_regressions(self):
+        regs = self.db.get_benchmark_regressions()
+        if not regs:
             return ""
 
+        def _format_reg(r):
+            txt = "   %s %s on %s: %.1f%% slower since %s" % (
+                r['bench_name'], r['algorithm'],
+                platforms_dict[r['arch_name']].very_short,
+                r['effect'] * 100., r['change_date'])
+            url = get_commit_range_url(r['rev_from'], r['rev_to'])
+            if url:
+                txt += "\n      " + url
+            return txt
+        return "\n\nBenchmarks that got slower:\n" \
+               + "\n".join(_format_reg(r) for r in regs) + "\n"
+
     def get_broken_links(self):
         return "\n".join(f"Today's {title} contains {broken}"
                          for title, broken in self.get_all_broken_links())
@@ -1440,7 +2126,7 @@ class _HTMLEmailBody(_EmailBody):
         return body + "\n</table>\n"
 
     def get_new_failures(self):
-        numfail, failed_units = self.get_failed_units()
+        numfail, failed_units, numflaky = self.get_failed_units()
         if numfail > 0:
             return "\n<p>There were %d new test failures (tests that passed " \
                    "yesterday\n" % numfail \
@@ -1448,9 +2134,43 @@ class _HTMLEmailBody(_EmailBody):
                    + "<ul>" \
                    + "\n".join("  <li>%s</li>" % unit
                                for unit in sorted(failed_units.keys())) \
-                   + "\n</ul>"
+                   + "\n</ul>" + self.get_flaky_failures(numflaky)
         else:
+            return self.get_flaky_failures(numflaky)
+
+    def get_flaky_failures(self, numflaky):
+        txt = super().get_flaky_failures(numflaky)
+        if txt:
+            txt = "\n<p>" + txt.strip() + "</p>\n"
+        return txt
+
+    def get_test_slowdowns(self):
+        slow = self.db.get_test_slowdowns()
+        if not slow:
             return ""
+        return "\n<p>Tests that got much slower today:</p>\n<ul>\n" \
+               + "\n".join("  <li>%s on %s: %.1fs &rarr; %.1fs</li>"
+                           % (html.escape(s['test_name']),
+                              platforms_dict[s['arch_name']].short,
+                              s['baseline'], s['runtime'])
+                           for s in slow) + "\n</ul>\n"
+
+    def get_benchmark_regressions(self):
+        regs = self.db.get_benchmark_regressions()
+        if not regs:
+            return ""
+
+        def _format_reg(r):
+            txt = "%s %s on %s: %.1f%% slower since %s" % (
+                html.escape(r['bench_name']), html.escape(r['algorithm']),
+                platforms_dict[r['arch_name']].short,
+                r['effect'] * 100., r['change_date'])
+            url = get_commit_range_url(r['rev_from'], r['rev_to'])
+            if url:
+                txt += ' (<a href="%s">commits</a>)' % url
+            return "  <li>%s</li>" % txt
+        return "\n<p>Benchmarks that got slower:</p>\n<ul>\n" \
+               + "\n".join(_format_reg(r) for r in regs) + "\n</ul>\n"
 
     def get_broken_links(self):
         txt = "\n".join(f"Today's {title} contains {broken}<br>"
@@ -0,0 +1,470 @@
+#!/usr/bin/python3
+
+"""Manage indexes and derived tables in the IMP build results database.
+
+   The schema is described by an ordered list of migrations. Running this
+   script applies any indexes or tables that are missing (including on
+   the per-branch copies of tables made by make-branch-tables.py), records
+   the schema version in the imp_schema_version table, and can check with
+   EXPLAIN that the most common queries actually use the indexes.
+"""
+
+import os
+import re
+import sys
+import pickle
+import datetime
+from argparse import ArgumentParser
+
+# MySQL accounts used by the web interface (read only) and the build
+# scripts, which need access to every table (see www/make-branch-tables.py)
+WEB_USER = "'imp_www'@'localhost'"
+BUILD_USER = "'impusers'@'localhost'"
+
+# Tables that have a copy for each IMP branch other than develop
+# (see www/make-branch-tables.py)
+PER_BRANCH_TABLES = frozenset(('imp_test_unit_result', 'imp_test_rollup',
+                               'imp_test_reporev', 'imp_test_other_reporev',
+                               'imp_benchmark', 'imp_build_summary',
+                               'imp_test', 'imp_doc',
+                               'imp_benchmark_rollup',
+                               'imp_benchmark_regression',
+                               'imp_test_slowdown', 'imp_test_history',
+                               'imp_test_flaky', 'imp_test_signature'))
+
+# Branches that were shown in the web interface before the imp_branch
+# table was added
+INITIAL_BRANCHES = ('develop', 'main', 'release/2.10.1', 'release/2.11.0',
+                    'release/2.11.1', 'release/2.12.0', 'release/2.13.0',
+                    'release/2.14.0', 'release/2.15.0', 'release/2.16.0',
+                    'release/2.17.0', 'release/2.18.0', 'release/2.19.0',
+                    'release/2.20.0', 'release/2.20.1', 'release/2.20.2',
+                    'release/2.21.0', 'release/2.22.0', 'release/2.23.0',
+                    'release/2.24.0')
+
+
+class Index:
+    """A (possibly composite) index on a table"""
+    def __init__(self, table, name, columns):
+        self.table, self.name, self.columns = table, name, columns
+
+    def get_sql(self, table):
+        # Index names only need to be unique per table in MySQL, but are
+        # global in sqlite, so they are all distinct here, and we add the
+        # table suffix for per-branch copies
+        name = self.name + table[len(self.table):]
+        return "CREATE INDEX %s ON %s (%s)" % (name, table,
+                                               ", ".join(self.columns))
+
+    def is_applied(self, schema, table):
+        # Tables copied with mysqldump keep the original index names
+        indexes = schema.get_indexes(table)
+        return (self.name in indexes
+                or self.name + table[len(self.table):] in indexes)
+
+
+class Table:
+    """A table that is created and maintained by the build scripts"""
+    def __init__(self, table, columns):
+        self.table, self.columns = table, columns
+
+    def get_sql(self, table, if_not_exists=False):
+        return "CREATE TABLE %s%s (%s)" % (
+            "IF NOT EXISTS " if if_not_exists else "", table,
+            ", ".join(self.columns))
+
+    def is_applied(self, schema, table):
+        return table in schema.get_tables(table)
+
+
+class Column:
+    """A column added to an existing table"""
+    def __init__(self, table, name, definition):
+        self.table, self.name, self.definition = table, name, definition
+
+    def get_sql(self, table):
+        return "ALTER TABLE %s ADD COLUMN %s %s" % (table, self.name,
+                                                    self.definition)
+
+    def is_applied(self, schema, table):
+        return self.name in schema.get_columns(table)
+
+
+class Row:
+    """A row that a table created by a migration should start with"""
+    def __init__(self, table, column, value):
+        self.table, self.column, self.value = table, column, value
+
+    def get_sql(self, table):
+        return ("INSERT INTO %s (%s) VALUES ('%s')"
+                % (table, self.column, self.value))
+
+    def is_applied(self, schema, table):
+        if table not in schema.get_tables(table):
+            return False
+        c = schema.conn.cursor()
+        c.execute("SELECT %s FROM %s WHERE %s=%%s"
+                  % (self.column, table, self.column), (self.value,))
+        return c.fetchone() is not None
+
+
+class Migration:
+    def __init__(self, version, description, operations):
+        self.version, self.description = version, description
+        self.operations = operations
+
+
+MIGRATIONS = [
+    Migration(1, "Indexes for common queries on result tables", [
+        Index('imp_test', 'date_state', ('date', 'state')),
+        Index('imp_test', 'date_runtime', ('date', 'runtime')),
+        Index('imp_test', 'name_arch_date', ('name', 'arch', 'date')),
+        Index('imp_test_names', 'names_unit', ('unit',)),
+        Index('imp_test_unit_result', 'date_arch', ('date', 'arch')),
+        Index('imp_test_reporev', 'reporev_date', ('date',)),
+        Index('imp_test_other_reporev', 'other_reporev_date', ('date',)),
+        Index('imp_build_summary', 'date_lab_only', ('date', 'lab_only')),
+        Index('imp_doc', 'doc_date', ('date',)),
+        Index('imp_benchmark', 'name_platform_date',
+              ('name', 'platform', 'date')),
+        Index('imp_benchmark', 'date_platform', ('date', 'platform')),
+        Index('imp_benchmark_names', 'names_file', ('file',)),
+        Index('imp_benchmark_files', 'files_unit', ('unit',))]),
+    Migration(2, "Precomputed per-unit test failure counts", [
+        Table('imp_test_rollup',
+              ('date DATE NOT NULL', 'arch INT NOT NULL', 'unit INT NOT NULL',
+               'state VARCHAR(20) NOT NULL', 'numfails INT NOT NULL',
+               'numnewfails INT NOT NULL', 'logline INT')),
+        Index('imp_test_rollup', 'date_arch_unit',
+              ('date', 'arch', 'unit'))]),
+    Migration(3, "Weekly and monthly benchmark summaries", [
+        Table('imp_benchmark_rollup',
+              ('bucket VARCHAR(5) NOT NULL', 'bucket_start DATE NOT NULL',
+               'name INT NOT NULL', 'platform INT NOT NULL',
+               'samples INT NOT NULL', 'min_runtime FLOAT',
+               'median_runtime FLOAT', 'max_runtime FLOAT',
+               'min_checkval FLOAT', 'median_checkval FLOAT',
+               'max_checkval FLOAT')),
+        Index('imp_benchmark_rollup', 'name_platform_bucket',
+              ('name', 'platform', 'bucket', 'bucket_start'))]),
+    Migration(4, "Detected benchmark regressions", [
+        Table('imp_benchmark_regression',
+              ('date DATE NOT NULL', 'change_date DATE NOT NULL',
+               'name INT NOT NULL', 'platform INT NOT NULL',
+               'baseline FLOAT', 'runtime FLOAT', 'effect FLOAT',
+               'rev_from VARCHAR(40)', 'rev_to VARCHAR(40)')),
+        Index('imp_benchmark_regression', 'regression_date', ('date',))]),
+    Migration(5, "Tests that got slower", [
+        Table('imp_test_slowdown',
+              ('date DATE NOT NULL', 'name INT NOT NULL', 'arch INT NOT NULL',
+               'baseline FLOAT', 'runtime FLOAT', 'effect FLOAT')),
+        Index('imp_test_slowdown', 'slowdown_date', ('date',))]),
+    Migration(6, "Run-length encoded pass/fail history of each test", [
+        Table('imp_test_history',
+              ('name INT NOT NULL', 'arch INT NOT NULL',
+               'first_date DATE NOT NULL', 'last_date DATE NOT NULL',
+               'runs TEXT NOT NULL', 'last_ok DATE', 'last_fail DATE',
+               'PRIMARY KEY (name, arch)'))]),
+    Migration(7, "Flaky tests", [
+        Table('imp_test_flaky',
+              ('date DATE NOT NULL', 'name INT NOT NULL', 'arch INT NOT NULL',
+               'runs INT NOT NULL', 'flips INT NOT NULL', 'score FLOAT')),
+        Index('imp_test_flaky', 'flaky_date', ('date',))]),
+    Migration(8, "Normalized signatures of test failures", [
+        Column('imp_test', 'signature', 'CHAR(16)'),
+        Index('imp_test', 'date_signature', ('date', 'signature')),
+        Table('imp_test_signature',
+              ('signature CHAR(16) NOT NULL', 'first_date DATE NOT NULL',
+               'last_date DATE NOT NULL', 'summary TEXT',
+               'PRIMARY KEY (signature)'))]),
+    Migration(9, "Registry of IMP branches shown in the web interface",
+              [Table('imp_branch', ('name VARCHAR(40) NOT NULL',
+                                    'PRIMARY KEY (name)'))]
+              + [Row('imp_branch', 'name', b) for b in INITIAL_BRANCHES]),
+    Migration(10, "Date from which each test history is complete", [
+        Column('imp_test_history', 'covered_from', 'DATE')]),
+]
+
+# Representative queries made by the web interface and the build scripts,
+# with typical arguments, and the index (or tuple of acceptable indexes)
+# each is expected to use on the given table
+_today = datetime.date.today()
+CHECK_QUERIES = [
+    ("Failed tests for a date",
+     "SELECT name FROM imp_test WHERE date=%s AND state NOT IN ('OK')",
+     (_today,), 'imp_test', ('date_state', 'date_runtime')),
+    ("Previous pass/fail of a test (get_previous_test_link)",
+     "SELECT date FROM imp_test WHERE name=%s AND arch=%s AND state IN "
+     "('OK') AND date<%s ORDER BY date DESC LIMIT 1",
+     (1, 1, _today), 'imp_test', 'name_arch_date'),
+    ("Test runtime history",
+     "SELECT runtime, date, arch FROM imp_test WHERE date<=%s AND name=%s "
+     "AND state='OK' ORDER BY arch, date",
+     (_today, 1), 'imp_test', 'name_arch_date'),
+    ("Failures grouped by signature",
+     "SELECT signature, arch FROM imp_test WHERE date=%s AND signature "
+     "IS NOT NULL ORDER BY signature",
+     (_today,), 'imp_test', 'date_signature'),
+    ("Tests added since another build (get_test_diff)",
+     "SELECT b.name FROM imp_test b LEFT JOIN imp_test a ON a.name=b.name "
+     "AND a.arch=b.arch AND a.date=%s WHERE b.date=%s AND a.name IS NULL",
+     (_today, _today), 'imp_test', 'name_arch_date'),
+    ("Unit results for a date",
+     "SELECT unit, state FROM imp_test_unit_result WHERE date=%s",
+     (_today,), 'imp_test_unit_result', 'date_arch'),
+    ("Test rollup for a date",
+     "SELECT unit, numfails FROM imp_test_rollup WHERE date=%s",
+     (_today,), 'imp_test_rollup', 'date_arch_unit'),
+    ("Benchmark history",
+     "SELECT runtime, date FROM imp_benchmark WHERE name=%s AND "
+     "platform=%s AND date<=%s ORDER BY date",
+     (1, 1, _today), 'imp_benchmark', 'name_platform_date'),
+    ("Long-range benchmark history",
+     "SELECT median_runtime, bucket_start FROM imp_benchmark_rollup "
+     "WHERE name=%s AND platform=%s AND bucket=%s AND bucket_start<=%s "
+     "ORDER BY bucket_start",
+     (1, 1, 'month', _today), 'imp_benchmark_rollup',
+     'name_platform_bucket'),
+    ("Benchmark platforms for a date",
+     "SELECT DISTINCT platform FROM imp_benchmark WHERE date=%s",
+     (_today,), 'imp_benchmark', 'date_platform'),
+]
+
+
+def get_create_table_sql(name, table=None):
+    """Get the SQL to create the table of the given name made by a
+       migration (or the given per-branch copy of it) if it does not
+       already exist"""
+    for m in MIGRATIONS:
+        for op in m.operations:
+            if isinstance(op, Table) and op.table == name:
+                return op.get_sql(table or name, if_not_exists=True)
+    raise ValueError("No migration creates table %s" % name)
+
+
+class _MySQLDialect:
+    def get_grants(self, table):
+        """Get the SQL to give the web and build users access to a table"""
+        return ["GRANT SELECT ON %s TO %s" % (table, WEB_USER),
+                "GRANT SELECT, INSERT, UPDATE, DELETE, CREATE, DROP ON %s "
+                "TO %s" % (table, BUILD_USER)]
+
+    def get_tables(self, cur, pattern):
+        cur.execute("SHOW TABLES LIKE %s", (pattern.replace('_', r'\_'),))
+        return [row[0] for row in cur]
+
+    def get_indexes(self, cur, table):
+        cur.execute("SHOW INDEX FROM " + table)
+        # Key_name is the third column
+        return frozenset(row[2] for row in cur)
+
+    def get_columns(self, cur, table):
+        cur.execute("SHOW COLUMNS FROM " + table)
+        return frozenset(row[0] for row in cur)
+
+    def explain(self, cur, query, args):
+        """Return the names of the indexes used by the query"""
+        cur.execute("EXPLAIN " + query, args)
+        cols = [d[0].lower() for d in cur.description]
+        return [dict(zip(cols, row))['key'] for row in cur]
+
+
+class _SQLiteDialect:
+    def get_grants(self, table):
+        # sqlite has no users
+        return []
+
+    def get_tables(self, cur, pattern):
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' "
+                    "AND name LIKE %s ESCAPE '\\'",
+                    (pattern.replace('_', r'\_'),))
+        return [row[0] for row in cur]
+
+    def get_indexes(self, cur, table):
+        cur.execute("PRAGMA index_list(%s)" % table)
+        return frozenset(row[1] for row in cur)
+
+    def get_columns(self, cur, table):
+        cur.execute("PRAGMA table_info(%s)" % table)
+        return frozenset(row[1] for row in cur)
+
+    def explain(self, cur, query, args):
+        cur.execute("EXPLAIN QUERY PLAN " + query, args)
+        r = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+        keys = []
+        for row in cur:
+            m = r.search(row[-1])
+            keys.append(m.group(1) if m else None)
+        return keys
+
+
+dialects = {'mysql': _MySQLDialect, 'sqlite': _SQLiteDialect}
+
+
+class Schema:
+    """Apply and check migrations on a database connection"""
+
+    def __init__(self, conn, dialect='mysql', branches=None, dryrun=False,
+                 verbose=True):
+        self.conn = conn
+        self.dialect = dialects[dialect]()
+        self.dryrun = dryrun
+        self.verbose = verbose
+        self._branches = branches
+
+    def log(self, msg):
+        if self.verbose:
+            print(msg)
+
+    def get_tables(self, pattern):
+        return self.dialect.get_tables(self.conn.cursor(), pattern)
+
+    def get_indexes(self, table):
+        return self.dialect.get_indexes(self.conn.cursor(), table)
+
+    def get_columns(self, table):
+        return self.dialect.get_columns(self.conn.cursor(), table)
+
+    def get_branch_suffixes(self):
+        """Get the table suffixes for every branch other than develop,
+           by looking for per-branch copies of the imp_test_reporev table"""
+        if self._branches is not None:
+            return [b.replace('/', '_').replace('.', '_')
+                    for b in self._branches if b != 'develop']
+        prefix = 'imp_test_reporev_'
+        # Skip the temporary tables made by check_build.py --dry-run
+        return [t[len(prefix):] for t in self.get_tables(prefix + '%')
+                if t[len(prefix):] != 'temp' and not t.endswith('_temp')]
+
+    def get_all_tables(self, table):
+        """Get the names of a table and all of its per-branch copies"""
+        if table in PER_BRANCH_TABLES:
+            return [table] + [table + '_' + suffix
+                              for suffix in self.get_branch_suffixes()]
+        else:
+            return [table]
+
+    def get_version(self):
+        """Get the version of the last migration applied, or 0"""
+        if not self.get_tables('imp_schema_version'):
+            return 0
+        c = self.conn.cursor()
+        c.execute("SELECT MAX(version) FROM imp_schema_version")
+        return c.fetchone()[0] or 0
+
+    def get_missing(self):
+        """Get all missing operations as (migration, table, SQL) tuples"""
+        missing = []
+        for m in MIGRATIONS:
+            for op in m.operations:
+                for table in self.get_all_tables(op.table):
+                    if not op.is_applied(self, table):
+                        missing.append((m, table, op.get_sql(table)))
+                        # New tables need the same access as the others
+                        if isinstance(op, Table):
+                            missing.extend(
+                                (m, table, sql)
+                                for sql in self.dialect.get_grants(table))
+        return missing
+
+    def get_grants(self):
+        """Get the SQL to give the web and build users access to every
+           table created by a migration, including existing ones"""
+        return [sql for m in MIGRATIONS for op in m.operations
+                if isinstance(op, Table)
+                for table in self.get_all_tables(op.table)
+                for sql in self.dialect.get_grants(table)]
+
+    def upgrade(self):
+        """Apply all missing tables and indexes, and update the version.
+           Return the number of operations applied."""
+        c = self.conn.cursor()
+        missing = self.get_missing()
+        for m, table, sql in missing:
+            self.log("Migration %d (%s): %s" % (m.version, m.description, sql))
+            if not self.dryrun:
+                c.execute(sql)
+        version = self.get_version()
+        if not self.dryrun:
+            if version == 0:
+                c.execute("CREATE TABLE imp_schema_version "
+                          "(version INT NOT NULL, description VARCHAR(200), "
+                          "applied DATE)")
+            for m in MIGRATIONS:
+                if m.version > version:
+                    c.execute("INSERT INTO imp_schema_version (version, "
+                              "description, applied) VALUES (%s, %s, %s)",
+                              (m.version, m.description,
+                               datetime.date.today()))
+            self.conn.commit()
+        return len(missing)
+
+    def check(self):
+        """Check that the schema is up to date and that common queries use
+           the expected indexes. Return a list of problems found."""
+        problems = ["Missing %s (migration %d)" % (sql, m.version)
+                    for m, table, sql in self.get_missing()]
+        c = self.conn.cursor()
+        for desc, query, args, table, indexes in CHECK_QUERIES:
+            if not isinstance(indexes, tuple):
+                indexes = (indexes,)
+            for t in self.get_all_tables(table):
+                q = query.replace(table, t)
+                keys = self.dialect.explain(c, q, args)
+                expected = indexes + tuple(i + t[len(table):]
+                                           for i in indexes)
+                self.log("%s on %s: uses %s" % (desc, t, keys[0]))
+                if not any(k in expected for k in keys):
+                    problems.append("%s on %s does not use index %s"
+                                    % (desc, t, " or ".join(expected)))
+        return problems
+
+
+def connect_mysql():
+    import MySQLdb
+    d = os.path.dirname(sys.argv[0])
+    with open(os.path.join(d, 'imp-sql-args.pck'), 'rb') as fh:
+        args = pickle.load(fh)
+    return MySQLdb.connect(**args)
+
+
+def get_options():
+    parser = ArgumentParser(
+        description="Add any missing tables and indexes to the IMP build "
+                    "results database")
+    parser.add_argument("--dry-run", dest="dryrun", default=False,
+                        action="store_true",
+                        help="Only print the SQL that would be run")
+    parser.add_argument("--check", default=False, action="store_true",
+                        help="Don't change anything; just report missing "
+                             "indexes and check query plans with EXPLAIN")
+    parser.add_argument("--branch", dest="branches", action="append",
+                        help="Only handle tables for the given branch "
+                             "(can be repeated; default is every branch "
+                             "that has tables in the database)")
+    parser.add_argument("--grants", default=False, action="store_true",
+                        help="Don't change anything; just print the GRANT "
+                             "commands needed for the web and build users "
+                             "to access every table made by a migration "
+                             "(pipe them to mysql -u root -p impusers)")
+    return parser.parse_args()
+
+
+def main():
+    opts = get_options()
+    schema = Schema(connect_mysql(), branches=opts.branches,
+                    dryrun=opts.dryrun)
+    if opts.grants:
+        for sql in schema.get_grants():
+            print(sql + ";")
+    elif opts.check:
+        problems = schema.check()
+        for p in problems:
+            print("PROBLEM: " + p)
+        sys.exit(1 if problems else 0)
+    else:
+        schema.upgrade()
+
+
+if __name__ == '__main__':
+    main()
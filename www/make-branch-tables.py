@@ -22,6 +22,15 @@ def rename_tables(lines, branch):
               "`impusers`.`%s` TO 'impusers'@'localhost';" % table)
 
 
+def register_branch(branch):
+    # Make the new branch show up in the web interface
+    print("GRANT SELECT ON `impusers`.`imp_branch` TO 'imp_www'@'localhost';")
+    print("GRANT SELECT, INSERT, UPDATE, DELETE, CREATE, DROP ON "
+          "`impusers`.`imp_branch` TO 'impusers'@'localhost';")
+    print("INSERT IGNORE INTO `impusers`.`imp_branch` (name) VALUES ('%s');"
+          % branch)
+
+
 if len(sys.argv) != 2:
     print("Usage: %s branch" % sys.argv[0], file=sys.stderr)
     print("""
@@ -29,15 +38,23 @@ This script will dump out a set of MySQL commands to create the necessary
 tables for a given IMP branch (it will prompt you for the MySQL root password).
 It is suggested that you pipe the output to a file or directly to
 mysql -u root -p impusers
+
+Afterwards, run imp_schema.py to add any indexes that are missing on the
+new tables.
 """, file=sys.stderr)
     sys.exit(1)
 
 branch = sys.argv[1]
 p = subprocess.Popen(['mysqldump', '-d', 'impusers', '-u', 'root', '-p',
                       '--skip-add-drop-table', 'imp_test_unit_result',
+                      'imp_test_rollup',
                       'imp_test_reporev', 'imp_test_other_reporev',
-                      'imp_benchmark', 'imp_build_summary', 'imp_test',
-                      'imp_doc'],
+                      'imp_benchmark', 'imp_benchmark_rollup',
+                      'imp_benchmark_regression',
+                      'imp_build_summary', 'imp_test', 'imp_doc',
+                      'imp_test_slowdown', 'imp_test_history',
+                      'imp_test_flaky', 'imp_test_signature'],
                      universal_newlines=True,
                      stdout=subprocess.PIPE)
 rename_tables(p.stdout, branch.replace('/', '_').replace('.', '_'))
+register_branch(branch)
@@ -1,7 +1,8 @@
 import logging.handlers
+import time
 import MySQLdb
 from flask import Flask, g, request
-from . import index
+from . import index, instrument
 
 app = Flask(__name__, instance_relative_config=True)
 app.config.from_pyfile('imp-results.cfg')
@@ -19,7 +20,8 @@ def _connect_db():
     conn = MySQLdb.connect(host=app.config['HOST'], user=app.config['USER'],
                            passwd=app.config['PASSWORD'],
                            db=app.config['DATABASE'])
-    return conn
+    return instrument.Connection(
+        conn, app.config.get('SLOW_QUERY_THRESHOLD', 0.5))
 
 
 def get_db():
@@ -29,6 +31,57 @@ def get_db():
     return g.db_conn
 
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    if hasattr(g, 'db_conn'):
+        g.db_conn.stats.reset()
+
+
+def _log_request(stats, render_time, url, status, size):
+    slow = instrument.get_slow_log_lines(
+        stats, render_time, url,
+        app.config.get('SLOW_REQUEST_THRESHOLD', 2.0))
+    if slow and 'SLOW_LOG' in app.config:
+        with open(app.config['SLOW_LOG'], 'a') as fh:
+            for line in slow:
+                fh.write(line + '\n')
+    else:
+        for line in slow:
+            app.logger.warning(line)
+    if 'METRICS_FILE' in app.config:
+        with open(app.config['METRICS_FILE'], 'a') as fh:
+            fh.write(instrument.get_metrics_sample(
+                stats, render_time, url, status, size) + '\n')
+
+
+@app.after_request
+def record_timing(response):
+    if not hasattr(g, 'request_start'):
+        return response
+    start = g.request_start
+    if hasattr(g, 'db_conn'):
+        stats = g.db_conn.stats
+    else:
+        stats = instrument.Stats()
+    url = request.full_path
+    # For streamed responses this only covers the time before the first
+    # part of the page is sent
+    response.headers['Server-Timing'] = instrument.get_server_timing(
+        stats, time.perf_counter() - start)
+    if response.is_streamed:
+        # Log once the entire response has been sent
+        sizer = instrument.ResponseSize()
+        response.response = sizer.wrap(response.response)
+        response.call_on_close(
+            lambda: _log_request(stats, time.perf_counter() - start, url,
+                                 response.status_code, sizer.size))
+    else:
+        _log_request(stats, time.perf_counter() - start, url,
+                     response.status_code, response.content_length)
+    return response
+
+
 @app.teardown_appcontext
 def close_db(error):
     if hasattr(g, 'db_conn'):
@@ -75,6 +128,12 @@ def all_failed_tests():
     return p.display()
 
 
+@app.route('/all-fail/grouped')
+def grouped_failures():
+    p = index.TestPage(get_db(), app.config, page='grouped')
+    return p.display()
+
+
 @app.route('/new-fail')
 def new_failed_tests():
     p = index.TestPage(get_db(), app.config, page='new')
@@ -87,6 +146,30 @@ def long_tests():
     return p.display()
 
 
+@app.route('/slower')
+def slower_tests():
+    p = index.TestPage(get_db(), app.config, page='slow')
+    return p.display()
+
+
+@app.route('/flaky')
+def flaky_tests():
+    p = index.TestPage(get_db(), app.config, page='flaky')
+    return p.display()
+
+
+@app.route('/diff')
+def build_diff():
+    p = index.TestPage(get_db(), app.config, page='diff')
+    return p.display()
+
+
+@app.route('/search')
+def search():
+    p = index.TestPage(get_db(), app.config, page='search')
+    return p.display()
+
+
 @app.route('/platform/<int:plat>/comp/<int:comp>')
 def platform_component_tests(plat, comp):
     p = index.TestPage(get_db(), app.config, page='compplattest',
@@ -101,12 +184,25 @@ def one_test(plat, test):
     return p.display()
 
 
+@app.route('/platform/<int:plat>/test/<int:test>/detail')
+def test_detail(plat, test):
+    p = index.TestPage(get_db(), app.config, page='results',
+                       platform=plat, test=test)
+    return p.display_test_detail()
+
+
 @app.route('/test/<int:test>/runtime')
 def test_runtime(test):
     p = index.TestPage(get_db(), app.config, page='runtime', test=test)
     return p.display()
 
 
+@app.route('/test/<int:test>/runtime/series')
+def test_runtime_series(test):
+    p = index.TestPage(get_db(), app.config, page='runtime', test=test)
+    return p.display_test_runtime_series()
+
+
 @app.route('/platform/<int:plat>/benchmark/<int:bench>')
 def benchmark_file(plat, bench):
     p = index.TestPage(get_db(), app.config, page='benchfile',
@@ -114,6 +210,13 @@ def benchmark_file(plat, bench):
     return p.display()
 
 
+@app.route('/platform/<int:plat>/benchmark/<int:bench>/series/<int:name>')
+def benchmark_series(plat, bench, name):
+    p = index.TestPage(get_db(), app.config, page='benchfile',
+                       platform=plat, bench=bench)
+    return p.display_benchmark_series(name)
+
+
 @app.route('/platform/<int:plat>/benchmark')
 def benchmark_platform(plat):
     p = index.TestPage(get_db(), app.config, page='bench',
@@ -127,13 +230,29 @@ def benchmark_default_platform():
     return p.display()
 
 
+@app.route('/benchmark/regressions')
+def benchmark_regressions():
+    p = index.TestPage(get_db(), app.config, page='benchreg')
+    return p.display()
+
+
 @app.route('/badge.svg')
 def stat():
-    p = index.TestPage(get_db(), app.config, page='stat')
-    return p.display_build_status_badge()
+    if 'version' in request.args:
+        # Mapping version to date needs the database
+        p = index.TestPage(get_db(), app.config, page='stat')
+        return p.display_build_status_badge()
+    else:
+        return index.display_build_status_badge(get_db)
 
 
 @app.route('/doc')
 def doc():
     p = index.TestPage(get_db(), app.config, page='doc')
     return p.display()
+
+
+@app.route('/rawlog/<path:name>')
+def raw_log(name):
+    p = index.TestPage(get_db(), app.config, page='rawlog')
+    return p.display_raw_log(name, lab_only=bool(_get_arg_int('lab')))
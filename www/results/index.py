@@ -1,7 +1,11 @@
 import flask
 from flask import request, render_template, url_for
+from werkzeug.security import safe_join
 import html
 import io
+import itertools
+import inspect
+import gzip
 import sys
 import re
 import os
@@ -9,17 +13,39 @@ import glob
 import MySQLdb
 import time
 import datetime
+import functools
 sys.path.append('/home/ben/imp_nightly_builds')
 from imp_build_utils import BuildDatabase, get_topdir  # noqa: E402
 from imp_build_utils import lab_only_topdir  # noqa: E402
 from imp_build_utils import platforms_dict, OK_STATES  # noqa: E402
 from imp_build_utils import results_url, lab_only_results_url  # noqa: E402
 from imp_build_utils import SPECIAL_COMPONENTS  # noqa: E402
+from imp_build_utils import open_log  # noqa: E402
+from imp_build_utils import get_branch_table  # noqa: E402
+from imp_build_utils import BENCHMARK_ROLLUP_BUCKETS  # noqa: E402
+from imp_build_utils import get_bucket_range  # noqa: E402
+from imp_build_utils import summarize_benchmarks  # noqa: E402
+from imp_build_utils import get_commit_range_url  # noqa: E402
+from imp_build_utils import search_index  # noqa: E402
+from imp_build_utils import get_summary_stamp  # noqa: E402
+import imp_build_analysis  # noqa: E402
+import imp_build_search  # noqa: E402
 
 imp_github = 'https://github.com/salilab/imp'
 rmf_github = 'https://github.com/salilab/rmf'
 pmi_github = 'https://github.com/salilab/pmi'
 
+# When streaming large pages, send output to the client after this many
+# test results or log file lines
+STREAM_ROWS = 200
+STREAM_LINES = 2000
+
+# Number of lines to show before and after each error line in build logs,
+# and at the end of the log, unless the full log is requested
+LOG_LINES_BEFORE = 10
+LOG_LINES_AFTER = 200
+LOG_LINES_TAIL = 50
+
 
 def set_cache_headers(headers):
     """Cache results for 1 hour"""
@@ -32,6 +58,133 @@ def set_cache_headers(headers):
     headers["Expires"] = get_time(t + 3600)
 
 
+# Time ranges that charts can show, as the number of days back from the
+# build date (or None for the entire history)
+CHART_WINDOWS = {'90d': 90, '1y': 365, 'all': None}
+DEFAULT_CHART_WINDOW = '1y'
+
+# Number of days of detected benchmark regressions to show
+REGRESSION_DAYS = 90
+
+# Build status badge text and color for each build summary state
+# (builds with no summary yet are shown as passing)
+BADGE_STATES = {'OK': ('passing', '#4c1'), 'TEST': ('passing', '#4c1'),
+                None: ('passing', '#4c1')}
+BADGE_FAILING = ('failing', '#e05d44')
+BADGE_LABEL = 'nightly build'
+
+# Rendered build status badges, keyed by branch, date, lab_only and
+# the time the last build summary was stored
+_badge_cache = {}
+MAX_BADGE_CACHE = 100
+
+# Date of the first build of each branch (which never changes)
+_first_build_dates = {}
+
+# Number of search results to show on each page
+SEARCH_RESULTS = 50
+
+# Number of days of pass/fail history to show for a test
+HISTORY_DAYS = 30
+
+# Number of days of test slowdowns to show
+SLOWDOWN_DAYS = 7
+
+# Approximate length of each benchmark rollup bucket, in days
+ROLLUP_BUCKET_DAYS = {'week': 7, 'month': 30}
+
+# Longer chart series are downsampled to this many points by default
+MAX_CHART_POINTS = 500
+
+# Platform and component names rarely change (at most once a night), so
+# are cached in memory for this many seconds
+DIMENSION_CACHE_TTL = 3600
+
+# The list of branches (from the imp_branch table) is cached in memory
+# for this many seconds
+BRANCH_CACHE_TTL = 600
+
+# Switch to the branch selected in the branch list, keeping the rest of
+# the current URL. This is the same for every page, so is not generated
+# by get_link.
+BRANCH_SCRIPT = '''<script type="text/javascript">
+function change_branch()
+{
+var sel=document.getElementById("branchlist");
+var url=new URL(window.location.href);
+var branch=sel.options[sel.selectedIndex].value;
+if (branch == "develop") {
+  url.searchParams.delete("branch");
+} else {
+  url.searchParams.set("branch", branch);
+}
+url.searchParams.delete("version");
+window.location.assign(url.href);
+}
+</script>'''
+
+
+def get_lttb_indices(xs, ys, max_points):
+    """Choose up to max_points indices into the data (xs, ys) using the
+       Largest-Triangle-Three-Buckets algorithm, which keeps the peaks and
+       troughs that determine the visual shape of the series"""
+    n = len(xs)
+    if max_points >= n or max_points < 3:
+        return list(range(n))
+    # The first and last points are always kept; the others are split into
+    # buckets, and from each we choose the point that makes the largest
+    # triangle with the previously chosen point and the mean of the next
+    # bucket
+    bucket_size = (n - 2) / (max_points - 2)
+    indices = [0]
+    a = 0
+    for i in range(max_points - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_x = xs[end:next_end]
+        next_y = ys[end:next_end]
+        avg_x = sum(next_x) / len(next_x)
+        avg_y = sum(next_y) / len(next_y)
+        a = max(range(start, end),
+                key=lambda j: abs((xs[a] - avg_x) * (ys[j] - ys[a])
+                                  - (xs[a] - xs[j]) * (avg_y - ys[a])))
+        indices.append(a)
+    indices.append(n - 1)
+    return indices
+
+
+def get_json_response(obj):
+    """Return obj as a JSON response that can be cached by the client"""
+    resp = flask.jsonify(obj)
+    set_cache_headers(resp.headers)
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
+def get_chart_series(dates, columns, columnar, max_points=None):
+    """Get data for a chart, given a list of dates and a dict of lists
+       of values (one per date). If columnar, the dates and each list of
+       values are returned as-is; otherwise, each list of values is
+       converted to [date, value] pairs, as jqplot expects.
+       If max_points is given, longer series are downsampled (choosing
+       the same dates for every column, based on the first one)."""
+    if max_points is not None and len(dates) > max_points:
+        first = next(iter(columns.values()))
+        ind = get_lttb_indices([d.toordinal() for d in dates], first,
+                               max_points)
+        dates = [dates[i] for i in ind]
+        columns = dict((k, [v[i] for i in ind]) for k, v in columns.items())
+    dates = [str(d) for d in dates]
+    if columnar:
+        series = {'dates': dates}
+        series.update(columns)
+        return series
+    else:
+        return dict((k, [list(x) for x in zip(dates, v)])
+                    for k, v in columns.items())
+
+
 def get_platform_td(platform, fmt="%s"):
     val = platforms_dict.get(platform, None)
     if val:
@@ -78,6 +231,17 @@ def get_date_link(date):
     return date.strftime('%Y%m%d')
 
 
+def parse_date_link(date):
+    """Parse a date in the format used in links (YYYYMMDD), or return None"""
+    m = re.match(r'(\d{4})(\d{2})(\d{2})$', date or '')
+    if m:
+        try:
+            return datetime.date(year=int(m.group(1)), month=int(m.group(2)),
+                                 day=int(m.group(3)))
+        except ValueError:
+            return None
+
+
 def get_coverage_link(date, covtyp, component, pct, lab_only, branch,
                       nightly_url):
     fpct = float(pct)
@@ -97,14 +261,198 @@ def get_coverage_link(date, covtyp, component, pct, lab_only, branch,
            % (cls, prefix, branch, get_date_link(date), covtyp, component, pct)
 
 
+def get_last_build_date(branch):
+    """Get date of most recent nightly build"""
+    s = os.readlink(os.path.join(get_topdir(branch), '.last'))
+    return datetime.date(year=int(s[:4]), month=int(s[4:6]),
+                         day=int(s[6:8]))
+
+
+def get_badge_text_width(text):
+    """Approximate width in pixels of badge text (11px Verdana)"""
+    return 7 * len(text) + 10
+
+
+def get_build_status_badge(get_db, branch, date, lab_only):
+    """Get a response containing an SVG badge showing the status of the
+       build. Badges are cached in memory until a new build summary is
+       stored, so the database (returned by get_db()) is rarely needed."""
+    try:
+        stamp = os.stat(get_summary_stamp(branch)).st_mtime
+    except OSError:
+        stamp = None
+    key = (branch, date, lab_only, stamp)
+    svg = _badge_cache.get(key)
+    if svg is None:
+        db = BuildDatabase(get_db(), date, lab_only, branch)
+        state = db.get_build_summary(missing=None)
+        message, color = BADGE_STATES.get(state, BADGE_FAILING)
+        svg = render_template(
+            'badge.svg', label=BADGE_LABEL, message=message, color=color,
+            label_width=get_badge_text_width(BADGE_LABEL),
+            message_width=get_badge_text_width(message))
+        # The summary may not have been stored yet for a new build
+        if state is not None:
+            if len(_badge_cache) >= MAX_BADGE_CACHE:
+                _badge_cache.clear()
+            _badge_cache[key] = svg
+    resp = flask.Response(svg, mimetype='image/svg+xml')
+    set_cache_headers(resp.headers)
+    resp.add_etag()
+    return resp.make_conditional(request)
+
+
+def display_build_status_badge(get_db):
+    """Show the build status badge. Unlike other pages, this does not
+       make a TestPage, since that always queries the database."""
+    branch = get_branch(get_db, request.args.get('branch'))
+    lab_only = (branch == 'develop' and request.scheme == 'https'
+                and request.environ.get('REMOTE_USER') is not None)
+    date = (parse_date_link(request.args.get('date'))
+            or get_last_build_date(branch))
+    return get_build_status_badge(get_db, branch, date, lab_only)
+
+
+def get_log_windows(loglines, num_lines):
+    """Get the (start, end) ranges of lines (counting from zero) to show
+       around each error line (counting from one) in a log file with
+       num_lines lines, plus the end of the file. Overlapping ranges
+       are merged."""
+    windows = sorted([(max(n - 1 - LOG_LINES_BEFORE, 0),
+                       min(n + LOG_LINES_AFTER, num_lines))
+                      for n in loglines]
+                     + [(max(num_lines - LOG_LINES_TAIL, 0), num_lines)])
+    merged = [list(windows[0])]
+    for start, end in windows[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(w) for w in merged]
+
+
+def parse_log_range(lines):
+    """Parse a range of log lines given as 'first-last' (counting from one,
+       inclusive) to a (start, end) range counting from zero, or None"""
+    m = re.match(r'(\d+)-(\d+)$', lines or '')
+    if m:
+        first, last = int(m.group(1)), int(m.group(2))
+        if 1 <= first <= last:
+            return first - 1, last
+
+
+def rollup_benchmark_daily(rows, bucket):
+    """Summarize daily benchmark results, sorted by date, by week or month,
+       in the same way as the benchmark rollup table"""
+    summary = summarize_benchmarks(
+        (get_bucket_range(r['date'], bucket)[0], None, r['runtime'],
+         r['checkval']) for r in rows)
+    return [{'date': s[0], 'runtime': s[4], 'checkval': s[7]}
+            for s in summary]
+
+
+class _DimensionCache(object):
+    """In-process cache of the small imp_test_archs and imp_test_units
+       tables, so that pages can map platform and component IDs to names
+       without a query. The tables are reloaded after DIMENSION_CACHE_TTL
+       seconds, or when an unknown ID is looked up (e.g. a platform or
+       component was added by the last build)."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._loaded = None
+        self._tables = ({}, {})
+
+    def _get(self, conn, table, keys):
+        if (self._loaded is None
+                or time.monotonic() - self._loaded > DIMENSION_CACHE_TTL
+                or any(k not in self._tables[table] for k in keys)):
+            c = conn.cursor()
+            c.execute("SELECT id, name FROM imp_test_archs")
+            archs = dict(c.fetchall())
+            c.execute("SELECT id, name, lab_only FROM imp_test_units")
+            units = dict((row[0], (row[1], bool(row[2]))) for row in c)
+            # Replace both tables at once, for other threads
+            self._tables = (archs, units)
+            self._loaded = time.monotonic()
+        return self._tables[table]
+
+    def get_archs(self, conn, *archs):
+        """Get a dict of platform names keyed by ID. Any IDs given are
+           included if they are in the database."""
+        return self._get(conn, 0, archs)
+
+    def get_units(self, conn, *units):
+        """Get a dict of (name, lab_only) component tuples keyed by ID.
+           Any IDs given are included if they are in the database."""
+        return self._get(conn, 1, units)
+
+
+_dimensions = _DimensionCache()
+
+
+def get_branch_sort_key(branch):
+    """Sort develop and main first, then other branches in version order"""
+    if branch in ('develop', 'main'):
+        return (0 if branch == 'develop' else 1, [])
+    return (2, [(int(p), '') if p.isdigit() else (-1, p)
+                for p in re.split(r'[/.]', branch)])
+
+
+class _BranchCache(object):
+    """In-process cache of the branches listed in the imp_branch table,
+       and the HTML branch list shown on each page. These are regenerated
+       after BRANCH_CACHE_TTL seconds."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._loaded = None
+        self._branches = ('develop',)
+        self._select_html = {}
+
+    def get(self, get_db):
+        """Get a tuple of all branch names. get_db is called to get a
+           database connection only if the cache has expired."""
+        if (self._loaded is None
+                or time.monotonic() - self._loaded > BRANCH_CACHE_TTL):
+            c = get_db().cursor()
+            c.execute("SELECT name FROM imp_branch")
+            branches = set(row[0] for row in c)
+            branches.add('develop')
+            self._select_html = {}
+            self._branches = tuple(sorted(branches, key=get_branch_sort_key))
+            self._loaded = time.monotonic()
+        return self._branches
+
+    def get_select_html(self, get_db, selected):
+        """Get the HTML list to choose a branch, with the given branch
+           selected"""
+        branches = self.get(get_db)
+        select_html = self._select_html
+        if selected not in select_html:
+            select_html[selected] = "\n".join(
+                '<option value="%s"%s>Branch: %s</option>'
+                % (html_escape(b),
+                   ' selected="selected"' if b == selected else '',
+                   html_escape(b)) for b in branches)
+        return select_html[selected]
+
+
+_branches = _BranchCache()
+
+
+def get_branch(get_db, branch):
+    """Get the named branch, or develop if it is not known"""
+    if branch and branch in _branches.get(get_db):
+        return branch
+    return 'develop'
+
+
 class TestPage(object):
-    all_branches = ['develop', 'main', 'release/2.10.1',
-                    'release/2.11.0', 'release/2.11.1', 'release/2.12.0',
-                    'release/2.13.0', 'release/2.14.0', 'release/2.15.0',
-                    'release/2.16.0', 'release/2.17.0', 'release/2.18.0',
-                    'release/2.19.0', 'release/2.20.0', 'release/2.20.1',
-                    'release/2.20.2', 'release/2.21.0', 'release/2.22.0',
-                    'release/2.23.0', 'release/2.24.0']
 
     def __init__(self, db, config, page=None, platform=None, component=None,
                  test=None, bench=None):
@@ -119,14 +467,12 @@ class TestPage(object):
             self.nightly_url = '/imp/nightly'
         else:
             self.nightly_url = '/nightly'
-        self.branch = request.args.get('branch', 'develop')
-        if self.branch not in self.all_branches:
-            self.branch = 'develop'
+        self.branch = get_branch(self.get_db, request.args.get('branch'))
+        # Only the main branch has versions
+        if request.args.get('version', None):
+            self.branch = 'main'
         if self.branch != 'develop':
             self.lab_only = False
-        (self.date, self.last_build_date, self.version,
-         self.last_build_version) = self.get_date_and_version()
-        self.revision = self.get_revision()
         self.test, self.platform, self.component = test, platform, component
         self.bench, self.page = bench, page
         self.default_page = 'build'
@@ -138,10 +484,16 @@ class TestPage(object):
                       'compplattest': self.display_comp_plat_tests,
                       'new': self.display_new_failures,
                       'long': self.display_long_tests,
+                      'slow': self.display_slower_tests,
+                      'flaky': self.display_flaky_tests,
+                      'search': self.display_search,
+                      'grouped': self.display_grouped_failures,
+                      'diff': self.display_diff,
                       'doc': self.display_doc_build_summary,
                       'bench': self.display_benchmarks,
                       'platform': self.display_platform,
                       'benchfile': self.display_benchmark_file,
+                      'benchreg': self.display_benchmark_regressions,
                       'stat': self.display_build_status_badge,
                       'all': self.display_all_failures}
         if self.test and self.platform:
@@ -162,11 +514,15 @@ class TestPage(object):
                or self.page not in self.pages:
                 self.page = self.default_page
 
+    def get_db(self):
+        return self.db
+
+    @property
+    def all_branches(self):
+        return _branches.get(self.get_db)
+
     def get_branch_table(self, name):
-        if self.branch == 'develop':
-            return name
-        else:
-            return name + '_' + self.branch.replace('/', '_').replace('.', '_')
+        return get_branch_table(name, self.branch)
 
     def get_build_id(self):
         id = str(self.date)
@@ -176,21 +532,51 @@ class TestPage(object):
             id += ' (%s)' % self.version
         return id
 
-    def get_revision(self):
-        conn = self.db
-        query = ('SELECT rev from ' + self.get_branch_table('imp_test_reporev')
-                 + ' where date=%s')
-        c = conn.cursor()
-        c.execute(query, (self.date,))
-        res = c.fetchone()
-        if res:
-            return res[0]
+    # Build date, version and revisions are looked up only when a page
+    # first needs them, so cheap routes don't pay for these queries
+
+    @functools.cached_property
+    def last_build_date(self):
+        return self.get_last_build_date()
+
+    @functools.cached_property
+    def _build_reporev(self):
+        """(date, revision, version) of the build to show"""
+        # Map version to date, if given
+        version = request.args.get('version', None)
+        if version:
+            res = self.get_reporev(version=version)
+            if res:
+                return res
+        date = (parse_date_link(request.args.get('date', None))
+                or self.last_build_date)
+        return self.get_reporev(date=date) or (date, None, None)
+
+    @functools.cached_property
+    def date(self):
+        return self._build_reporev[0]
+
+    @functools.cached_property
+    def revision(self):
+        return self._build_reporev[1]
+
+    @functools.cached_property
+    def version(self):
+        return self._build_reporev[2]
+
+    @functools.cached_property
+    def last_build_version(self):
+        if self.date == self.last_build_date:
+            return self.version
+        else:
+            return self.get_version(self.last_build_date)
 
-    def get_other_repo_revs(self):
+    @functools.cached_property
+    def other_repo_revs(self):
         conn = self.db
         query = 'SELECT repo,rev from ' \
-                + self.get_branch_table('imp_test_other_reporev') \
-                + ' where date=%s'
+            + self.get_branch_table('imp_test_other_reporev') \
+            + ' where date=%s'
         c = conn.cursor()
         c.execute(query, (self.date,))
         revs = {}
@@ -198,65 +584,81 @@ class TestPage(object):
             revs[res[0]] = res[1]
         return revs
 
+    def get_reporev(self, date=None, version=None):
+        """Get (date, revision, version) of the build on the given date, or
+           with the given version, or None if there is no such build"""
+        # Only the main branch has versions
+        version_col = 'version' if self.branch == 'main' else 'NULL'
+        query = ('SELECT date, rev, ' + version_col + ' FROM '
+                 + self.get_branch_table('imp_test_reporev'))
+        if version:
+            query += ' WHERE version=%s'
+            args = (version,)
+        else:
+            query += ' WHERE date=%s'
+            args = (date,)
+        c = self.db.cursor()
+        c.execute(query, args)
+        return c.fetchone()
+
     def get_last_build_date(self):
         """Get date of most recent nightly build"""
-        s = os.readlink(os.path.join(get_topdir(self.branch), '.last'))
-        return datetime.date(year=int(s[:4]), month=int(s[4:6]),
-                             day=int(s[6:8]))
+        return get_last_build_date(self.branch)
+
+    def get_first_build_date(self):
+        """Get date of the first nightly build, or None"""
+        date = _first_build_dates.get(self.branch)
+        if date is None:
+            c = self.db.cursor()
+            c.execute("SELECT date FROM "
+                      + self.get_branch_table('imp_test_reporev')
+                      + " ORDER BY date LIMIT 1")
+            row = c.fetchone()
+            if row:
+                date = _first_build_dates[self.branch] = row[0]
+        return date
 
     def get_version(self, date):
         """Map date to version"""
         if self.branch == 'main':
-            conn = self.db
-            c = conn.cursor()
-            table = self.get_branch_table('imp_test_reporev')
-            query = 'SELECT version FROM ' + table + ' WHERE date=%s'
-            c.execute(query, (date,))
-            res = c.fetchone()
+            res = self.get_reporev(date=date)
             if res:
-                return res[0]
-
-    def get_date_and_version(self):
-        # Map version to date, if given
-        version = request.args.get('version', None)
-        if version:
-            self.branch = 'main'
-            last_build_date = self.get_last_build_date()
-            conn = self.db
-            c = conn.cursor()
-            table = self.get_branch_table('imp_test_reporev')
-            query = 'SELECT date FROM ' + table + ' WHERE version=%s'
-            c.execute(query, (version,))
-            res = c.fetchone()
-            if res:
-                return (res[0], last_build_date, version,
-                        self.get_version(last_build_date))
-
-        last_build_date = self.get_last_build_date()
-        date = request.args.get('date', None)
-        if date:
-            m = re.match(r'(\d{4})(\d{2})(\d{2})$', date)
-            if m:
-                date = datetime.date(year=int(m.group(1)),
-                                     month=int(m.group(2)),
-                                     day=int(m.group(3)))
-                return (date, last_build_date, self.get_version(date),
-                        self.get_version(last_build_date))
-        last_build_version = self.get_version(last_build_date)
-        return (last_build_date, last_build_date,
-                last_build_version, last_build_version)
+                return res[2]
 
     def display(self):
         if self.page == 'stat':
             return self.display_build_status_badge()
+        elif inspect.isgeneratorfunction(self.pages[self.page]):
+            # Potentially large pages are sent to the client as they
+            # are generated, rather than all at once at the end
+            return flask.Response(
+                flask.stream_with_context(self._stream_page()),
+                mimetype='text/html')
         else:
-            self.display_page()
+            for _ in self.display_page():
+                pass
             body = self._output.getvalue()
             return render_template(
                 'layout.html', build_id=self.get_build_id(), body=body,
                 include_charts=self.bench is not None
                 or self.page == 'runtime')
 
+    def _stream_page(self):
+        yield render_template(
+            'header.html', build_id=self.get_build_id(),
+            include_charts=self.bench is not None or self.page == 'runtime')
+        for _ in self.display_page():
+            yield self._flush()
+        yield self._flush()
+        yield render_template('footer.html')
+
+    def _flush(self):
+        """Return and clear the contents of our internal output buffer"""
+        out = self._output.getvalue()
+        self._output.seek(0)
+        self._output.truncate()
+        return out
+
     def p(self, *args, sep=' ', end='\n'):
         """Print to our internal output buffer"""
         print(*args, sep=sep, end=end, file=self._output)
@@ -269,27 +671,26 @@ class TestPage(object):
         else:
             return " AND imp_test_units.lab_only=false"
 
+    def get_visible_units(self, *units):
+        """Get a dict of (name, lab_only) tuples for all components the
+           user can see, keyed by ID. Any IDs given are looked up in the
+           database if they are not cached."""
+        return dict((i, u) for i, u
+                    in _dimensions.get_units(self.db, *units).items()
+                    if self.lab_only or not u[1])
+
     def get_component_from_id(self, conn, component):
-        query = 'SELECT name, lab_only from imp_test_units WHERE id=%s' \
-                + self.get_sql_lab_only()
-        c = conn.cursor()
-        c.execute(query, (component,))
-        res = c.fetchone()
-        if res:
-            name = res[0]
-            # Hack to map 'IMP' to kernel
-            if name.startswith('IMP ') or name == 'IMP':
-                name = ('IMP.kernel ' + name[4:]).rstrip()
-            return name, res[1]
-        return None, False
+        name, lab_only = _dimensions.get_units(conn, component).get(
+            component, (None, False))
+        if name is None or (lab_only and not self.lab_only):
+            return None, False
+        # Hack to map 'IMP' to kernel
+        if name.startswith('IMP ') or name == 'IMP':
+            name = ('IMP.kernel ' + name[4:]).rstrip()
+        return name, lab_only
 
     def get_platform_name_from_id(self, conn, platform):
-        c = conn.cursor()
-        c.execute('SELECT name from imp_test_archs WHERE id=%s',
-                  (platform,))
-        res = c.fetchone()
-        if res:
-            return res[0]
+        return _dimensions.get_archs(conn, platform).get(platform)
 
     def display_comp_plat_tests(self):
         def loglinks(plat, comp, lab_only):
@@ -337,9 +738,9 @@ class TestPage(object):
                '<b>all</b> platforms</a></li>' % self.get_link(page='comp'))
         self.p('%s</ul>' % loglinks(platform_name, component_name, lab_only))
         db = BuildDatabase(conn, self.date, self.lab_only, self.branch)
-        self.display_tests(db.get_all_component_tests(self.component,
-                                                      self.platform),
-                           include_component=False, include_platform=False)
+        yield from self.display_tests(
+            db.get_all_component_tests(self.component, self.platform),
+            include_component=False, include_platform=False)
 
     def display_component(self):
         conn = self.db
@@ -352,29 +753,156 @@ class TestPage(object):
         self.p("<h1>All %s test results for build on %s</h1>"
                % (component_name, self.get_build_id()))
         db = BuildDatabase(conn, self.date, self.lab_only, self.branch)
-        self.display_tests(db.get_all_component_tests(self.component),
-                           include_component=False)
+        yield from self.display_tests(
+            db.get_all_component_tests(self.component),
+            include_component=False)
 
     def display_build_status_badge(self):
-        imgroot = "https://img.shields.io/badge/"
-        db = BuildDatabase(self.db, self.date, self.lab_only,
-                           self.branch)
-        s = db.get_build_summary()
-        if s in ("OK", "TEST"):
-            imgurl = imgroot + "nightly build-passing-brightgreen.svg"
-        else:
-            imgurl = imgroot + "nightly build-failing-red.svg"
-        resp = flask.make_response("", 302)
-        set_cache_headers(resp.headers)
-        resp.headers['Location'] = imgurl
-        return resp
+        return get_build_status_badge(lambda: self.db, self.branch,
+                                      self.date, self.lab_only)
 
     def display_all_failures(self):
         self.p("<h1>All test failures for build on %s</h1>"
                % self.get_build_id())
+        self.p('<p>See also <a href="%s">failures grouped by error</a>.</p>'
+               % self.get_link(page='grouped'))
         db = BuildDatabase(self.db, self.date, self.lab_only,
                            self.branch)
-        self.display_tests(db.get_all_failed_tests())
+        yield from self.display_tests(db.get_all_failed_tests())
+
+    def display_grouped_failures(self):
+        self.p("<h1>Test failures grouped by error for build on %s</h1>"
+               % self.get_build_id())
+        self.p("<p>Failures with the same output (ignoring file paths, "
+               "line numbers, addresses, timings and floating-point values) "
+               "are grouped together, most common first.</p>")
+        db = BuildDatabase(self.db, self.date, self.lab_only, self.branch)
+        groups = db.get_failure_groups()
+        if not groups:
+            self.p("<p><i>No tests failed.</i></p>")
+            return
+        self.p("<table class=\"sortable\">\n<thead>")
+        self.p("<tr><th>Failures</th> <th>Platforms</th> <th>Tests</th> "
+               "<th>First seen</th> <th>Error</th></tr></thead><tbody>")
+        for g in groups:
+            first = g['first_date']
+            self.p('<tr><td>%d</td> <td>%s</td> <td>%s</td> <td>%s</td> '
+                   '<td><pre>%s</pre></td></tr>'
+                   % (len(g['tests']), self.get_group_platforms(g['tests']),
+                      self.get_group_tests(g['tests']),
+                      '<a href="%s">%s</a>'
+                      % (self.get_link(page='all', date=first), first)
+                      if first else '', html_escape(g['summary'])))
+        self.p("</tbody></table>")
+
+    def get_diff_builds(self):
+        """Get BuildDatabase objects for the two builds to compare on the
+           diff page. The 'to' build defaults to this build, and the 'from'
+           build to the build before it. Each can be on a different branch
+           (the 'from' branch defaults to the same branch)."""
+        to_date = parse_date_link(request.args.get('to')) or self.date
+        to_db = BuildDatabase(self.db, to_date, self.lab_only, self.branch)
+        from_branch = request.args.get('from_branch', self.branch)
+        if from_branch not in self.all_branches:
+            from_branch = self.branch
+        from_date = parse_date_link(request.args.get('from'))
+        if from_date is None:
+            if from_branch == self.branch:
+                from_date = to_db.get_previous_build_date()
+            else:
+                from_date = to_date
+        if from_date is None:
+            return None, to_db
+        return (BuildDatabase(self.db, from_date, self.lab_only, from_branch),
+                to_db)
+
+    def display_diff(self):
+        from_db, to_db = self.get_diff_builds()
+        if from_db is None:
+            self.p("<p><i>No previous build to compare with.</i></p>")
+            return
+        self.p("<h1>Changes from %s build on %s to %s build on %s</h1>"
+               % (html_escape(from_db.branch), from_db.date,
+                  html_escape(to_db.branch), to_db.date))
+        sections = [('newfail', 'Newly failing tests'),
+                    ('newok', 'Newly passing tests'),
+                    ('added', 'Added tests'),
+                    ('removed', 'Removed tests')]
+        self.p("<ul>%s<li><a href=\"#units\">Component build "
+               "changes</a></li></ul>"
+               % "".join('<li><a href="#%s">%s</a></li>' % (kind, title)
+                         for kind, title in sections))
+        self.p('<h2 id="units">Component build changes</h2>')
+        rows = to_db.get_unit_diff(from_db)
+        yield from self.display_diff_rows(rows, from_db, to_db, unit=True)
+        for kind, title in sections:
+            self.p('<h2 id="%s">%s</h2>' % (kind, title))
+            rows = to_db.get_test_diff(from_db, kind)
+            yield from self.display_diff_rows(rows, from_db, to_db)
+
+    def display_diff_rows(self, cur, from_db, to_db, unit=False):
+        """Show a table of tests (or components) compared between two
+           builds by display_diff"""
+        def state_td(state):
+            if not state:
+                return "<td></td>"
+            elif unit:
+                return "<td>%s</td>" % state
+            else:
+                return get_state_td(state)
+        n = -1
+        for n, row in enumerate(cur):
+            if n % STREAM_ROWS == 0:
+                yield
+            if n == 0:
+                self.p("<table class=\"sortable\">\n<thead><tr>"
+                       "<th>Component</th> <th>Platform</th>%s "
+                       "<th>%s</th> <th>%s</th></tr></thead><tbody>"
+                       % ("" if unit else " <th>Name</th>",
+                          from_db.date, to_db.date))
+            if unit:
+                name = ""
+            else:
+                # Link to the test in the build in which it ran
+                db = from_db if row['to_state'] is None else to_db
+                name = ' <td><a href="%s">%s</a></td>' % (
+                    self.get_link(page='results', test=row['name'],
+                                  platform=row['arch'], date=db.date,
+                                  branch=db.branch), row['test_name'])
+            self.p("<tr><td>%s</td> %s%s %s %s</tr>"
+                   % (self.get_component_link(row['unit_name'],
+                                              row['unit_id']),
+                      get_platform_td(row['arch_name']), name,
+                      state_td(row['from_state']), state_td(row['to_state'])))
+        if n == -1:
+            self.p("<p><i>None.</i></p>")
+        else:
+            self.p("</tbody></table>")
+
+    def get_group_platforms(self, tests):
+        """Get the platforms affected by a group of failed tests"""
+        names = sorted(frozenset(t['arch_name'] for t in tests))
+        return ", ".join('<span title="%s">%s</span>'
+                         % (platforms_dict[n].long, platforms_dict[n].short)
+                         if n in platforms_dict else n for n in names)
+
+    def get_group_tests(self, tests):
+        """Get the names of a group of failed tests, with a link to each
+           platform it failed on"""
+        by_name = {}
+        for t in tests:
+            by_name.setdefault((t['name'], t['test_name']), []).append(t)
+
+        def get_platform_link(t):
+            p = platforms_dict.get(t['arch_name'])
+            return '<a href="%s">%s</a>' % (
+                self.get_link(page='results', test=t['name'],
+                              platform=t['arch']),
+                p.very_short if p else t['arch_name'])
+        return "<br>".join("%s (%s)" % (html_escape(name),
+                                        ", ".join(get_platform_link(t)
+                                                  for t in ts))
+                           for (test, name), ts in by_name.items())
 
     def display_new_failures(self):
         self.p("<h1>New test failures for build on %s</h1>"
@@ -387,20 +915,200 @@ class TestPage(object):
                    "failures.</i></p>")
         else:
             self.p("<p>All tests that failed on %s but passed on %s "
-                   "are shown below.</p>" % (self.date, prev_build))
-            self.display_tests(db.get_new_failed_tests())
+                   "are shown below. Some of these may be "
+                   "<a href=\"%s\">flaky tests</a>. See also <a href=\"%s\">"
+                   "all changes since the previous build</a>.</p>"
+                   % (self.date, prev_build, self.get_link(page='flaky'),
+                      self.get_link(page='diff')))
+            yield from self.display_tests(db.get_new_failed_tests())
 
     def display_long_tests(self):
         self.p("<h1>Long-running tests for build on %s</h1>"
                % self.get_build_id())
-        self.p("<p>All tests that ran for more than 20 seconds are shown.</p>")
+        self.p("<p>All tests that ran for more than 20 seconds are shown. "
+               "See also <a href=\"%s\">tests that got slower</a>.</p>"
+               % self.get_link(page='slow'))
         db = BuildDatabase(self.db, self.date, self.lab_only,
                            self.branch)
-        self.display_tests(db.get_long_tests())
+        yield from self.display_tests(db.get_long_tests())
+
+    def display_slower_tests(self):
+        self.p("<h1>Slower tests for build on %s</h1>" % self.get_build_id())
+        self.p("<p>Tests whose runtime jumped (compared with their median "
+               "runtime on the same platform over the previous %d days) in "
+               "the %d days up to this build are shown, most recent "
+               "first. Only tests that ran for at least %d seconds are "
+               "considered.</p>"
+               % (imp_build_analysis.TEST_BASELINE_DAYS, SLOWDOWN_DAYS,
+                  imp_build_analysis.MIN_TEST_RUNTIME))
+        db = BuildDatabase(self.db, self.date, self.lab_only, self.branch)
+        slow = db.get_test_slowdowns(days=SLOWDOWN_DAYS)
+        if not slow:
+            self.p("<p><i>No tests got slower.</i></p>")
+            return
+        self.p("<table class=\"sortable\">\n<thead>")
+        self.p("<tr><th>Detected</th> <th>Component</th> <th>Name</th> "
+               "<th>Platform</th> <th>Before (s)</th> <th>After (s)</th> "
+               "<th>Change</th></tr></thead><tbody>")
+        for s in slow:
+            self.p('<tr><td>%s</td> <td>%s</td> <td><a href="%s">%s</a> '
+                   '<a href="%s">[runtime]</a></td> %s <td>%.1f</td> '
+                   '<td>%.1f</td> <td>+%.0f%%</td></tr>'
+                   % (s['date'], s['unit_name'],
+                      self.get_link(page='results', test=s['name'],
+                                    platform=s['arch'], date=s['date']),
+                      s['test_name'],
+                      self.get_link(page='runtime', test=s['name'],
+                                    date=s['date']),
+                      get_platform_td(s['arch_name']), s['baseline'],
+                      s['runtime'], s['effect'] * 100.))
+        self.p("</tbody></table>")
+
+    def display_flaky_tests(self):
+        self.p("<h1>Flaky tests for build on %s</h1>" % self.get_build_id())
+        self.p("<p>Tests that flip between passing and failing on the same "
+               "platform are shown, flakiest first. The score is the "
+               "fraction of consecutive runs over the last %d days in which "
+               "the test changed state.</p>" % imp_build_analysis.FLAKY_DAYS)
+        db = BuildDatabase(self.db, self.date, self.lab_only, self.branch)
+        flaky = db.get_flaky_tests()
+        if not flaky:
+            self.p("<p><i>No flaky tests were found.</i></p>")
+            return
+        self.p("<table class=\"sortable\">\n<thead>")
+        self.p("<tr><th>Component</th> <th>Name</th> <th>Platform</th> "
+               "<th>Runs</th> <th>Flips</th> <th>Score</th></tr>"
+               "</thead><tbody>")
+        for f in flaky:
+            self.p('<tr><td>%s</td> <td><a href="%s">%s</a></td> %s '
+                   '<td>%d</td> <td>%d</td> <td>%.2f</td></tr>'
+                   % (self.get_component_link(f['unit_name'], f['unit_id']),
+                      self.get_link(page='results', test=f['name'],
+                                    platform=f['arch']),
+                      f['test_name'], get_platform_td(f['arch_name']),
+                      f['runs'], f['flips'], f['score']))
+        self.p("</tbody></table>")
+
+    def get_search_url(self, **kwargs):
+        """Get a link to the search page, keeping the current search
+           parameters unless overridden"""
+        args = dict((k, request.args[k])
+                    for k in ('q', 'from', 'to', 'plat', 'comp')
+                    if request.args.get(k))
+        if self.branch != 'develop':
+            args['branch'] = self.branch
+        args.update(kwargs)
+        return url_for('search', **args)
+
+    def show_search_form(self, text, arch, unit):
+        archs = [(i, platforms_dict[name].short
+                  if name in platforms_dict else name)
+                 for i, name in sorted(_dimensions.get_archs(self.db).items(),
+                                       key=lambda a: a[1])]
+        units = [(i, u[0]) for i, u in sorted(self.get_visible_units().items(),
+                                              key=lambda u: u[1][0])]
+
+        def select(name, title, options, selected):
+            return ('<select name="%s"><option value="">%s</option>%s'
+                    '</select>'
+                    % (name, title, "".join(
+                        '<option value="%d"%s>%s</option>'
+                        % (i, ' selected' if i == selected else '',
+                           html_escape(n)) for i, n in options)))
+        self.p('<form action="%s" method="get" class="search">'
+               % url_for('search'))
+        if self.branch != 'develop':
+            self.p('<input type="hidden" name="branch" value="%s">'
+                   % html_escape(self.branch))
+        self.p('<input type="text" name="q" size="60" value="%s"> '
+               % html_escape(text))
+        self.p('from <input type="text" name="from" size="8" '
+               'placeholder="YYYYMMDD" value="%s"> to '
+               '<input type="text" name="to" size="8" placeholder="YYYYMMDD" '
+               'value="%s">'
+               % (html_escape(request.args.get('from', '')),
+                  html_escape(request.args.get('to', ''))))
+        self.p(select('plat', 'All platforms', archs, arch))
+        self.p(select('comp', 'All components', units, unit))
+        self.p('<input type="submit" value="Search"></form>')
+
+    def display_search(self):
+        self.p("<h1>Search failed tests, %s branch</h1>"
+               % html_escape(self.branch))
+        c = self.db.cursor(MySQLdb.cursors.DictCursor)
+        text = request.args.get('q', '').strip()
+        # Platform and component are not passed to the constructor, since
+        # that would select a different page
+        arch = request.args.get('plat', type=int)
+        unit = request.args.get('comp', type=int)
+        self.show_search_form(text, arch, unit)
+        if not text:
+            self.p('<p>Search the names and output of failed tests in all '
+                   'builds. Every word, or "quoted phrase", must match.</p>')
+            return
+        index = imp_build_search.SearchIndex.open(
+            self.config.get('SEARCH_INDEX', search_index))
+        if index is None:
+            self.p("<p><i>The search index is not available.</i></p>")
+            return
+        offset = max(0, request.args.get('start', 0, type=int))
+        # Get one more result than needed, to see if there is another page
+        res = index.search(
+            text, self.branch, self.lab_only,
+            start_date=parse_date_link(request.args.get('from')),
+            end_date=parse_date_link(request.args.get('to')),
+            arch=arch, unit=unit, offset=offset,
+            limit=SEARCH_RESULTS + 1)
+        more = len(res) > SEARCH_RESULTS
+        res = res[:SEARCH_RESULTS]
+        if not res:
+            self.p("<p><i>No failed tests matched.</i></p>")
+            return
+        # Get names of all tests, components and platforms in the results
+        tests = {}
+        query = "SELECT id, name, unit FROM imp_test_names WHERE id IN (%s)" \
+                % ", ".join(["%s"] * len(res))
+        c.execute(query, [r['test'] for r in res])
+        for row in c:
+            tests[row['id']] = row
+        archs = _dimensions.get_archs(self.db, *set(r['arch'] for r in res))
+        units = _dimensions.get_units(
+            self.db, *set(t['unit'] for t in tests.values()))
+        self.p("<p>Showing results %d to %d, most recent first.</p>"
+               % (offset + 1, offset + len(res)))
+        self.p("<table class=\"sortable\">\n<thead>")
+        self.p("<tr><th>Date</th> <th>Component</th> <th>Name</th> "
+               "<th>Platform</th> <th>Match</th></tr></thead><tbody>")
+        for r in res:
+            t = tests.get(r['test'])
+            if t is None:
+                continue
+            snippet = html_escape(r['snippet']).replace(
+                imp_build_search.MATCH_START, '<b>').replace(
+                imp_build_search.MATCH_END, '</b>')
+            self.p('<tr><td>%s</td> <td>%s</td> <td><a href="%s">%s</a></td> '
+                   '%s <td><pre>%s</pre></td></tr>'
+                   % (r['date'],
+                      self.get_component_link(
+                          units.get(t['unit'], ('', False))[0], t['unit']),
+                      self.get_link(page='results', test=r['test'],
+                                    platform=r['arch'], date=r['date']),
+                      t['name'], get_platform_td(archs.get(r['arch'], '')),
+                      snippet))
+        self.p("</tbody></table>")
+        links = []
+        if offset > 0:
+            links.append('<a href="%s">&laquo; Newer</a>' % html_escape(
+                self.get_search_url(start=max(0, offset - SEARCH_RESULTS))))
+        if more:
+            links.append('<a href="%s">Older &raquo;</a>' % html_escape(
+                self.get_search_url(start=offset + SEARCH_RESULTS)))
+        if links:
+            self.p('<p class="pages">%s</p>' % " | ".join(links))
 
     def display_benchmark_file(self):
         conn = self.db
-        c = MySQLdb.cursors.DictCursor(conn)
+        c = conn.cursor(MySQLdb.cursors.DictCursor)
         plats = self.get_benchmark_platforms(c)
         thisplat = self.show_benchmark_platform_links(plats)
         c.execute('SELECT imp_benchmark_files.name AS file_name, '
@@ -427,18 +1135,23 @@ class TestPage(object):
 
         self.p("<p><i>Click and drag on a plot to zoom in; double click "
                "to reset the zoom.</i></p>")
+        self.show_chart_window_links()
 
+        # Only list benchmarks that ran on this date; the history of each
+        # is loaded by the browser when its plot is scrolled into view
         table = self.get_branch_table('imp_benchmark')
         query = 'SELECT imp_benchmark_names.name, ' \
-                'imp_benchmark_names.id, ' \
-                'imp_benchmark_names.algorithm, imp_benchmark.date, ' \
-                'imp_benchmark.runtime, imp_benchmark.checkval ' \
+                'imp_benchmark_names.id, imp_benchmark_names.algorithm ' \
                 'FROM ' + table + ' imp_benchmark, imp_benchmark_names ' \
                 'WHERE imp_benchmark_names.file=%s AND ' \
                 'imp_benchmark.name=imp_benchmark_names.id AND ' \
                 'imp_benchmark.platform=%s ' \
-                'AND date<=%s ORDER BY imp_benchmark_names.id,date'
+                'AND date=%s ORDER BY imp_benchmark_names.id'
         c.execute(query, (self.bench, self.platform, self.date))
+        self.p("<ul>")
+        for row in c:
+            self.display_benchmark(row)
+        self.p("</ul>")
         self.p('<script type="text/javascript">')
         self.p("""function plot_bench(chartid, values) {
   return $.jqplot(chartid, values, {
@@ -474,60 +1187,129 @@ class TestPage(object):
        showTooltip:true
     }
   });
-}""")
+}
+
+$(document).ready(function() {
+  lazy_charts('benchmark', function(div, data) {
+    plot_bench(div.id, [data.runtime, data.checkval]);
+  });
+});""")
         self.p('</script>')
-        self.p("<ul>")
-        bench = {'id': None}
-        for row in c:
-            if row['id'] != bench['id']:
-                if bench['id'] is not None:
-                    self.display_benchmark(bench)
-                bench = {'id': row['id'],
-                         'name': row['name'],
-                         'algorithm': row['algorithm'],
-                         'dates': [],
-                         'runtimes': [],
-                         'checkvals': []}
-            bench['dates'].append(row['date'])
-            bench['runtimes'].append(row['runtime'] or 0)
-            bench['checkvals'].append(row['checkval'] or 0)
-        if bench['id'] is not None:
-            self.display_benchmark(bench)
-        self.p("</ul>")
 
     def display_benchmark(self, bench):
-        def get_check(val):
-            if val[1] is None:
-                return (val[0], 0.0)
-            else:
-                return val
-        # Exclude benchmarks that didn't run today
-        if len(bench['dates']) > 0 and bench['dates'][-1] != self.date:
-            return
         self.p('<li><a name="%d">%s %s</a> '
                '<a class="permalink" href="#%d">[link]</a>'
                % (bench['id'], bench['name'], bench['algorithm'], bench['id']))
-        self.p('<div id="bench_%d" class="benchmark">' % bench['id'])
-        self.p('</div>')
-        self.p('<script type="text/javascript">')
-        self.p("""$(document).ready(function() {
-  var plot%d = plot_bench('bench_%d', [[%s], [%s]]);
-});""" % (bench['id'], bench['id'],
-          ",".join("['%s', %f]" % x
-                   for x in zip(bench['dates'], bench['runtimes'])),
-          ",".join("['%s', %f]" % get_check(x)
-                   for x in zip(bench['dates'], bench['checkvals']))))
-        self.p('</script>')
+        self.p('<div id="bench_%d" class="benchmark" data-url="%s"></div>'
+               % (bench['id'],
+                  self.get_chart_url('benchmark_series', plat=self.platform,
+                                     bench=self.bench, name=bench['id'])))
         self.p('</li>')
 
+    def display_benchmark_series(self, name):
+        """Get the history of a single benchmark on this platform, as JSON.
+           Long histories are read from the weekly or monthly rollups."""
+        c = self.db.cursor(MySQLdb.cursors.DictCursor)
+        start = self.get_chart_window()[1]
+        max_points = self.get_chart_max_points()
+        bucket = self.get_benchmark_bucket(c, name, start, max_points)
+        rows = None
+        if bucket != 'day':
+            rows = self.get_benchmark_rollup(c, name, start, bucket)
+        if rows and (start is None
+                     or get_bucket_range(start, bucket)[0] < rows[0]['date']):
+            # The rollup may only have been backfilled for recent builds,
+            # so summarize any older daily results in the window
+            daily = self.get_benchmark_daily(c, name, start,
+                                             end=rows[0]['date'])
+            rows = rollup_benchmark_daily(daily, bucket) + list(rows)
+        if not rows:
+            # Fall back to daily results if there is no rollup (e.g. it
+            # has not been backfilled for old builds)
+            bucket = 'day'
+            rows = self.get_benchmark_daily(c, name, start)
+        if not rows:
+            flask.abort(404)
+        series = get_chart_series(
+            [r['date'] for r in rows],
+            {'runtime': [r['runtime'] or 0. for r in rows],
+             'checkval': [r['checkval'] or 0. for r in rows]},
+            columnar=bool(request.args.get('columnar')),
+            max_points=max_points)
+        series['bucket'] = bucket
+        return get_json_response(series)
+
+    def get_benchmark_bucket(self, c, name, start, max_points):
+        """Get the finest granularity ('day', 'week' or 'month') for which
+           the benchmark history from start (or from the first result,
+           if None) fits in max_points points"""
+        if start is None:
+            table = self.get_branch_table('imp_benchmark')
+            c.execute('SELECT date FROM ' + table
+                      + ' WHERE name=%s AND platform=%s AND date<=%s '
+                      'ORDER BY date LIMIT 1',
+                      (name, self.platform, self.date))
+            row = c.fetchone()
+            if row is None:
+                return 'day'
+            start = row['date']
+        days = (self.date - start).days + 1
+        if days <= max_points:
+            return 'day'
+        for bucket in BENCHMARK_ROLLUP_BUCKETS:
+            if days <= max_points * ROLLUP_BUCKET_DAYS[bucket]:
+                return bucket
+        return BENCHMARK_ROLLUP_BUCKETS[-1]
+
+    def _get_benchmark_series_query(self, name, table, fields, date_field,
+                                    start):
+        query = 'SELECT ' + fields + ' FROM ' + table + ' imp_benchmark, ' \
+                'imp_benchmark_names, imp_benchmark_files, imp_test_units ' \
+                'WHERE imp_benchmark.name=%s AND ' \
+                'imp_benchmark_names.id=imp_benchmark.name AND ' \
+                'imp_benchmark_names.file=%s AND ' \
+                'imp_benchmark_files.id=imp_benchmark_names.file AND ' \
+                'imp_benchmark_files.unit=imp_test_units.id AND ' \
+                'imp_benchmark.platform=%s AND ' + date_field + '<=%s' \
+                + self.get_sql_lab_only()
+        args = [name, self.bench, self.platform, self.date]
+        if start is not None:
+            query += ' AND ' + date_field + '>=%s'
+            args.append(start)
+        return query, args
+
+    def get_benchmark_daily(self, c, name, start, end=None):
+        query, args = self._get_benchmark_series_query(
+            name, self.get_branch_table('imp_benchmark'),
+            'imp_benchmark.date, imp_benchmark.runtime, '
+            'imp_benchmark.checkval', 'date', start)
+        if end is not None:
+            query += ' AND date<%s'
+            args.append(end)
+        c.execute(query + ' ORDER BY date', args)
+        return c.fetchall()
+
+    def get_benchmark_rollup(self, c, name, start, bucket):
+        if start is not None:
+            start = get_bucket_range(start, bucket)[0]
+        query, args = self._get_benchmark_series_query(
+            name, self.get_branch_table('imp_benchmark_rollup'),
+            'imp_benchmark.bucket_start AS date, '
+            'imp_benchmark.median_runtime AS runtime, '
+            'imp_benchmark.median_checkval AS checkval', 'bucket_start',
+            start)
+        c.execute(query + ' AND imp_benchmark.bucket=%s ORDER BY bucket_start',
+                  args + [bucket])
+        return c.fetchall()
+
     def get_benchmark_platforms(self, c):
         table = self.get_branch_table('imp_benchmark')
-        query = 'SELECT DISTINCT imp_test_archs.id, imp_test_archs.name ' \
-                'FROM ' + table + ' imp_benchmark,imp_test_archs ' \
-                'WHERE date=%s AND imp_test_archs.id=imp_benchmark.platform ' \
-                'ORDER BY imp_test_archs.id DESC'
+        query = 'SELECT DISTINCT platform FROM ' + table + \
+                ' WHERE date=%s ORDER BY platform DESC'
         c.execute(query, (self.date,))
-        return c.fetchall()
+        plats = [row['platform'] for row in c]
+        archs = _dimensions.get_archs(self.db, *plats)
+        return [{'id': p, 'name': archs[p]} for p in plats if p in archs]
 
     def show_benchmark_platform_links(self, plats):
         thisplat = None
@@ -588,7 +1370,7 @@ class TestPage(object):
 
     def display_benchmarks(self):
         conn = self.db
-        c = MySQLdb.cursors.DictCursor(conn)
+        c = conn.cursor(MySQLdb.cursors.DictCursor)
         plats = self.get_benchmark_platforms(c)
         if self.platform is None and len(plats) > 0:
             self.platform = plats[0]['id']
@@ -626,12 +1408,50 @@ class TestPage(object):
                    % (row['unit_name'], link, row['file_name'],
                       row['n_benchmarks']))
         self.p("</tbody></table>")
+        self.p('<p>See also <a href="%s">recent benchmark regressions</a> '
+               'on all platforms.</p>' % self.get_link(page='benchreg'))
+
+    def display_benchmark_regressions(self):
+        self.p("<h1>Benchmark regressions for build on %s</h1>"
+               % self.get_build_id())
+        self.p("<p>Benchmarks whose runtime increased significantly "
+               "(compared with the previous %d days) in the %d days up to "
+               "this build are shown, most recent first.</p>"
+               % (imp_build_analysis.BASELINE_DAYS, REGRESSION_DAYS))
+        db = BuildDatabase(self.db, self.date, self.lab_only, self.branch)
+        regs = db.get_benchmark_regressions(days=REGRESSION_DAYS)
+        if not regs:
+            self.p("<p><i>No regressions were found.</i></p>")
+            return
+        self.p("<table class=\"sortable\">\n<thead>")
+        self.p("<tr><th>Detected</th> <th>Changed</th> <th>Component</th> "
+               "<th>Benchmark</th> <th>Platform</th> <th>Before (s)</th> "
+               "<th>After (s)</th> <th>Change</th> <th>Commits</th>"
+               "</tr></thead><tbody>")
+        for r in regs:
+            link = self.get_link(page='benchfile', bench=r['file_id'],
+                                 platform=r['platform'], date=r['date'])
+            url = get_commit_range_url(r['rev_from'], r['rev_to'])
+            self.p('<tr><td>%s</td> <td>%s</td> <td>%s</td> '
+                   '<td><a href="%s#%d">%s %s</a></td> %s '
+                   '<td>%.2f</td> <td>%.2f</td> <td>+%.0f%%</td> <td>%s</td>'
+                   '</tr>'
+                   % (r['date'], r['change_date'], r['unit_name'],
+                      html_escape(link), r['name'], r['bench_name'],
+                      r['algorithm'], get_platform_td(r['arch_name']),
+                      r['baseline'], r['runtime'], r['effect'] * 100.,
+                      '<a href="%s">view</a>' % url if url else ''))
+        self.p("</tbody></table>")
 
     def get_link(self, page=None, test=None, platform=None, date=None,
-                 component=None, bench=None, branch=None):
+                 component=None, bench=None, branch=None, window=None):
         route = 'summary'
         route_map = {'all': 'all_failed_tests', 'new': 'new_failed_tests',
-                     'long': 'long_tests', 'doc': 'doc'}
+                     'long': 'long_tests', 'doc': 'doc',
+                     'benchreg': 'benchmark_regressions',
+                     'slow': 'slower_tests', 'flaky': 'flaky_tests',
+                     'search': 'search', 'grouped': 'grouped_failures',
+                     'diff': 'build_diff'}
         if page is None:
             page = self.page
         if test is None:
@@ -686,8 +1506,49 @@ class TestPage(object):
             kwargs['date'] = get_date_link(date)
         if branch != 'develop':
             kwargs['branch'] = branch
+        if window is not None:
+            kwargs['window'] = window
         return url_for(route, **kwargs)
 
+    def get_chart_window(self):
+        """Get the time range to show in charts, as a CHART_WINDOWS key
+           and the first date in the range (or None for no limit)"""
+        window = request.args.get('window', DEFAULT_CHART_WINDOW)
+        if window not in CHART_WINDOWS:
+            window = DEFAULT_CHART_WINDOW
+        days = CHART_WINDOWS[window]
+        if days is None:
+            return window, None
+        else:
+            return window, self.date - datetime.timedelta(days=days)
+
+    def get_chart_max_points(self):
+        return max(3, request.args.get('max_points', MAX_CHART_POINTS,
+                                       type=int))
+
+    def get_chart_url(self, route, **kwargs):
+        """Get the URL to get JSON data for a chart shown on this page"""
+        kwargs['date'] = get_date_link(self.date)
+        kwargs['window'] = self.get_chart_window()[0]
+        if 'max_points' in request.args:
+            kwargs['max_points'] = self.get_chart_max_points()
+        if self.branch != 'develop':
+            kwargs['branch'] = self.branch
+        return url_for(route, **kwargs).replace('&', '&amp;')
+
+    def show_chart_window_links(self):
+        window = self.get_chart_window()[0]
+        links = []
+        for w, title in (('90d', '90 days'), ('1y', '1 year'),
+                         ('all', 'all')):
+            if w == window:
+                links.append('<b>%s</b>' % title)
+            else:
+                links.append('<a href="%s">%s</a>'
+                             % (self.get_link(window=w)
+                                .replace('&', '&amp;'), title))
+        self.p("<p>Show history for: %s</p>" % " | ".join(links))
+
     def format_build_summary(self, summary, unit, arch, arch_id, unit_id):
         def make_cmake_loglink(cls, title, build_type, data, numfails=0,
                                numnewfails=0):
@@ -925,13 +1786,11 @@ class TestPage(object):
         if show_failures:
             return ("<a title=\"Show only components or platforms that have "
                     "at least one failure\" "
-                    "onclick=\"toggle_visibility('failmap', "
-                    "'fullmap', 'faillink', 'fulllink'); "
+                    "onclick=\"toggle_failmap(true); "
                     "return false;\" href=\"#\">%s</a>" % caption)
         else:
             return ("<a title=\"Show all components and platforms\" "
-                    "onclick=\"toggle_visibility('fullmap', 'failmap', "
-                    "'fulllink', 'faillink'); "
+                    "onclick=\"toggle_failmap(false); "
                     "return false;\" href=\"#\">%s</a>" % caption)
 
     def display_build_summary(self):
@@ -978,7 +1837,7 @@ class TestPage(object):
                        'http://svn.salilab.org/imp/trunk imp</tt>" (or, if '
                        'you have an existing SVN checkout, use "<tt>svn up '
                        '-%s</tt>").' % (self.revision, self.revision))
-            revs = self.get_other_repo_revs()
+            revs = self.other_repo_revs
             rmf_rev = revs.get('rmf', '')
             if rmf_rev:
                 self.p('This includes <a href="%s">RMF</a> revision '
@@ -1030,18 +1889,10 @@ class TestPage(object):
                     self.p('<li><a href="%s">%s</a>%s</li>' % (url, comp, rev))
                 self.p('</ul>')
 
-        self.p('<div id="fullmap" style="display:none">')
-        self.print_summary_table(summary, build_info,
-                                 'All components and platforms are shown',
-                                 show_failures=True)
-        self.p("</div>")
-
-        self.p('<div id="failmap" style="display:block">')
-        summary.make_only_failed()
-        self.print_summary_table(summary, build_info,
-                                 'Only components or platforms that have at '
-                                 'least one failure are shown',
-                                 show_failures=False)
+        # Components and platforms with no failures are hidden by CSS
+        # unless the user asks to see all of them
+        self.p('<div id="summarymap" class="onlyfailed">')
+        self.print_summary_table(summary, build_info)
         self.p("</div>")
         self.print_misc_errors(build_info[0], False)
         if self.lab_only:
@@ -1101,14 +1952,64 @@ class TestPage(object):
             dest = logfile.split('/')[-1]
         else:
             dest = logfile
+        if dest.endswith('.gz'):
+            dest = dest[:-3]
         if caption is None:
             caption = dest
+        if dest.endswith('/'):
+            # Directory listings are served directly by the web server
+            if lab_only:
+                prefix = '/internal/imp/nightly/logs/'
+            else:
+                prefix = '%s/logs/%s/' % (self.nightly_url, self.branch)
+            url = prefix + get_date_link(self.date) + '/' + dest
+        else:
+            # Log files may be compressed, so are served by raw_log()
+            kwargs = {'name': dest, 'date': get_date_link(self.date)}
+            if lab_only:
+                kwargs['lab'] = 1
+            if self.branch != 'develop':
+                kwargs['branch'] = self.branch
+            url = url_for('raw_log', **kwargs).replace('&', '&amp;')
+        return '<a %shref="%s">%s</a>' % (tags, url, caption)
+
+    def display_raw_log(self, name, lab_only):
+        """Send a raw log file, which may be stored compressed"""
         if lab_only:
-            prefix = '/internal/imp/nightly/logs/'
+            if not self.lab_only:
+                flask.abort(404)
+            logdir = os.path.join(lab_only_topdir,
+                                  get_date_link(self.date) + '-*',
+                                  'build', 'logs', 'imp-salilab')
         else:
-            prefix = '%s/logs/%s/' % (self.nightly_url, self.branch)
-        dest = prefix + get_date_link(self.date) + '/' + dest
-        return '<a %shref="%s">%s</a>' % (tags, dest, caption)
+            logdir = os.path.join(get_topdir(self.branch),
+                                  get_date_link(self.date) + '-*', 'build',
+                                  'logs', 'imp')
+        logdirs = glob.glob(logdir)
+        logfile = safe_join(logdirs[0], name) if logdirs else None
+        if logfile is None:
+            flask.abort(404)
+        if os.path.isfile(logfile):
+            return flask.send_file(logfile, mimetype='text/plain')
+        elif os.path.isfile(logfile + '.gz'):
+            if 'gzip' in request.accept_encodings:
+                resp = flask.send_file(logfile + '.gz',
+                                       mimetype='text/plain')
+                resp.headers['Content-Encoding'] = 'gzip'
+                resp.headers['Vary'] = 'Accept-Encoding'
+                return resp
+            else:
+                def decompress():
+                    with gzip.open(logfile + '.gz', 'rb') as fh:
+                        while True:
+                            data = fh.read(65536)
+                            if not data:
+                                break
+                            yield data
+                return flask.Response(decompress(), mimetype='text/plain',
+                                      headers={'Vary': 'Accept-Encoding'})
+        else:
+            flask.abort(404)
 
     def get_raw_build_files_link(self, platname, lab_only, caption):
         """Get a link to the directory containing raw build files"""
@@ -1130,7 +2031,7 @@ class TestPage(object):
                    + ': ' + err['text'])
         self.p('<li>%s</li>' % txt)
 
-    def print_summary_table(self, summary, build_info, caption, show_failures):
+    def print_summary_table(self, summary, build_info):
         def get_row_header(component, component_id):
             special = SPECIAL_COMPONENTS.get(component, None)
             if special:
@@ -1139,29 +2040,29 @@ class TestPage(object):
             else:
                 return '<td class="comptype">%s</td>' \
                        % self.get_component_link(row, summary.unit_ids[row])
+
+        def get_col_class(arch):
+            return '' if arch in summary.failed_archs else ' class="okcol"'
         self.p("<table class=\"modules\">")
-        self.p('<caption>%s; '
-               'mouseover or click for more details. %s</caption>'
-               % (caption,
-                  self.toggle_failmap(
-                      show_failures,
-                      "[show only failures]"
-                      if show_failures else "[show all]")))
+        self.p('<caption><span class="failcaption">Only components or '
+               'platforms that have at least one failure are shown; '
+               'mouseover or click for more details. %s</span>'
+               '<span class="fullcaption">All components and platforms are '
+               'shown; mouseover or click for more details. %s</span>'
+               '</caption>'
+               % (self.toggle_failmap(False, "[show all]"),
+                  self.toggle_failmap(True, "[show only failures]")))
         self.p("<thead><tr><th></th>")
         for x in summary.all_archs:
             p = platforms_dict[x]
             if x in summary.cmake_archs:
-                self.p('<th title="%s"><a href="%s">%s</a></th>'
-                       % (p.long,
-                          self.get_link(page='platform',
-                                        platform=summary.arch_ids[x]),
-                          p.short))
+                page = 'platform'
             else:
-                self.p('<th title="%s"><a href="%s">%s</a></th>'
-                       % (p.long,
-                          self.get_link(page='log',
-                                        platform=summary.arch_ids[x]),
-                          p.short))
+                page = 'log'
+            self.p('<th%s title="%s"><a href="%s">%s</a></th>'
+                   % (get_col_class(x), p.long,
+                      self.get_link(page=page, platform=summary.arch_ids[x]),
+                      p.short))
         if build_info[0]:
             self.p('<th title="Percentage of all executable lines of Python '
                    'code in this component that were executed by its '
@@ -1178,13 +2079,19 @@ class TestPage(object):
                 for m in build_info[1]['modules']:
                     if 'pycov' in m:
                         coverage[m['name']] = (m['pycov'], m['cppcov'], True)
+        col_classes = [get_col_class(col) for col in summary.all_archs]
         for row in summary.all_units:
             unit_id = summary.unit_ids[row]
-            self.p("<tr>" + get_row_header(row, unit_id))
-            for col in summary.all_archs:
-                self.p(self.format_build_summary(summary.data, row, col,
+            if row in summary.failed_units:
+                self.p("<tr>" + get_row_header(row, unit_id))
+            else:
+                self.p('<tr class="okrow">' + get_row_header(row, unit_id))
+            for col, col_class in zip(summary.all_archs, col_classes):
+                cell = self.format_build_summary(summary.data, row, col,
                                                  summary.arch_ids[col],
-                                                 unit_id))
+                                                 unit_id)
+                # Every cell starts with a bare <td>
+                self.p('<td' + col_class + cell[3:])
             if build_info[0]:
                 if row.startswith('IMP.'):
                     subdir = row[4:]
@@ -1217,13 +2124,14 @@ class TestPage(object):
             g = os.path.join(get_topdir(self.branch),
                              get_date_link(self.date) + '-*', 'build',
                              'logs', 'imp', fname)
-        g = glob.glob(g)
+        # Old logs may have been compressed
+        g = glob.glob(g) or glob.glob(g + '.gz')
         if len(g) > 0:
             return g[0]
 
     def display_log(self):
         conn = self.db
-        c = MySQLdb.cursors.DictCursor(conn)
+        c = conn.cursor(MySQLdb.cursors.DictCursor)
         arch_name = self.get_platform_name_from_id(conn, self.platform)
         if not arch_name:
             self.p("<p><b>Invalid platform requested</b></p>")
@@ -1235,21 +2143,22 @@ class TestPage(object):
                    "available.</b></p>")
             return
         table = self.get_branch_table('imp_test_unit_result')
-        query = ('SELECT imp_test_units.name as unit_name, '
-                 'imp_test_units.lab_only, imp_test_unit_result.state, '
-                 'imp_test_unit_result.logline from imp_test_units, '
-                 + table + ' imp_test_unit_result '
-                 'where imp_test_units.id=imp_test_unit_result.unit and '
-                 'date=%s and imp_test_unit_result.arch=%s and '
-                 'imp_test_unit_result.logline is not null '
-                 + self.get_sql_lab_only()
-                 + ' order by imp_test_unit_result.logline')
+        query = ('SELECT unit, state, logline FROM ' + table
+                 + ' WHERE date=%s AND arch=%s AND logline IS NOT NULL '
+                 'ORDER BY logline')
         self.p('<div class="loglinks">')
         self.p('<p>The build on %s gave the following errors on %s:</p>'
                % (self.date, platforms_dict[arch_name].long))
         self.p('<ul>')
         c.execute(query, (self.date, self.platform))
-        rows = c.fetchall()
+        allrows = c.fetchall()
+        units = self.get_visible_units(*set(r['unit'] for r in allrows))
+        rows = []
+        for r in allrows:
+            if r['unit'] in units:
+                r = dict(r)
+                r['unit_name'], r['lab_only'] = units[r['unit']]
+                rows.append(r)
         loglines = []
         lab_only_loglines = []
         for r in rows:
@@ -1277,34 +2186,26 @@ class TestPage(object):
         self.p('</div>')
 
         self.p('<div class="log">')
-        self.print_log(logfile, loglines, 'n')
+        yield from self.print_log(logfile, loglines, 'n')
         if self.lab_only and lab_only_logfile:
-            self.print_log(lab_only_logfile, lab_only_loglines, 'l')
+            yield from self.print_log(lab_only_logfile, lab_only_loglines, 'l')
         self.p('</div>')
 
     def print_log(self, logfile, loglines, prefix):
-        build_complete = False
-
-        def get_next_link():
-            if len(loglines) > 0:
-                return loglines.pop(0)
-            else:
-                return 0
-        next_link = get_next_link()
-        self.p("<pre>")
-        for n, line in enumerate(open(logfile)):
-            if 'BUILD COMPLETED' in line:
-                build_complete = True
-            if n + 1 == next_link:
-                self.p('</pre>')
-                self.p('<a name="%s_%d"></a><pre class="errorline">'
-                       % (prefix, next_link))
-                self.p(html.escape(line), end='')
-                self.p("</pre><pre>")
-                next_link = get_next_link()
-            else:
-                self.p(html.escape(line), end='')
-        self.p("</pre>")
+        index = open_log(logfile)
+        lines = parse_log_range(request.args.get('lines'))
+        if index is not None and lines:
+            # Only show the requested part of one log
+            if request.args.get('log', 'n') == prefix:
+                yield from self.print_log_range(index, loglines, prefix,
+                                                *lines)
+            return
+        if index is None or request.args.get('full'):
+            build_complete = yield from self.print_full_log(
+                index or open(logfile), loglines, prefix)
+        else:
+            yield from self.print_log_windows(index, loglines, prefix)
+            build_complete = 'BUILD COMPLETED' in index.get_tail()
         if not build_complete:
             b = os.path.basename(logfile)
             if b.startswith('bin') or b.startswith('package') \
@@ -1312,6 +2213,68 @@ class TestPage(object):
                 self.p('<pre class="incomplete">...\n[ Build appears to '
                        'be incomplete ]</pre>')
 
+    def print_log_line(self, line, n, errorlines, prefix):
+        """Print line n (counting from 1) of a log file"""
+        if n in errorlines:
+            self.p('</pre>')
+            self.p('<a name="%s_%d"></a><pre class="errorline">'
+                   % (prefix, n))
+            self.p(html.escape(line), end='')
+            self.p("</pre><pre>")
+        else:
+            self.p(html.escape(line), end='')
+
+    def print_full_log(self, lines, loglines, prefix):
+        """Print every line of a log file, and return True if it shows
+           the build completed"""
+        build_complete = False
+        errorlines = frozenset(loglines)
+        self.p("<pre>")
+        for n, line in enumerate(lines):
+            if n % STREAM_LINES == 0:
+                yield
+            if 'BUILD COMPLETED' in line:
+                build_complete = True
+            self.print_log_line(line, n + 1, errorlines, prefix)
+        self.p("</pre>")
+        return build_complete
+
+    def print_log_range(self, index, loglines, prefix, start, end):
+        """Print only the given range of lines of a log file"""
+        end = min(end, index.num_lines)
+        self.p('<p class="loggap">Lines %d to %d of the log. '
+               '<a href="%s">[show errors only]</a> '
+               '<a href="%s&amp;full=1">[show full log]</a></p>'
+               % (start + 1, end, self.get_link(page='log'),
+                  self.get_link(page='log')))
+        errorlines = frozenset(loglines)
+        self.p("<pre>")
+        for n, line in enumerate(index.get_lines(start, end), start + 1):
+            if n % STREAM_LINES == 0:
+                yield
+            self.print_log_line(line, n, errorlines, prefix)
+        self.p("</pre>")
+
+    def print_log_windows(self, index, loglines, prefix):
+        """Print only the parts of a log file around each error line,
+           plus the end of the log, with links to the lines not shown"""
+        errorlines = frozenset(loglines)
+        prev_end = 0
+        for start, end in get_log_windows(loglines, index.num_lines):
+            if start > prev_end:
+                # Link to just the lines in the gap
+                self.p('<p class="loggap"><a href="%s&amp;log=%s&amp;'
+                       'lines=%d-%d">[%d %s not shown; show them]</a></p>'
+                       % ((self.get_link(page='log'), prefix, prev_end + 1,
+                           start)
+                          + handle_plural(start - prev_end, "line")))
+            self.p("<pre>")
+            for n, line in enumerate(index.get_lines(start, end), start + 1):
+                self.print_log_line(line, n, errorlines, prefix)
+            self.p("</pre>")
+            prev_end = end
+            yield
+
     def print_log_link(self, sql, prefix):
         state_msg = {'TEST': 'test failure',
                      'BUILD': 'failed to build',
@@ -1347,6 +2310,8 @@ class TestPage(object):
                'run in the previous build">Delta</th></tr>')
         self.p("<tbody>")
         for n, row in enumerate(cur):
+            if n % STREAM_ROWS == 0:
+                yield
             self.p("<tr>")
             if include_component:
                 self.p("<td>%s</td>"
@@ -1354,17 +2319,19 @@ class TestPage(object):
                                                  row['unit_id']))
             if include_platform:
                 self.p(get_platform_td(row['arch_name']))
-            detail = row['detail']
-            if detail is None or detail == '':
-                detail = ''
-                self.p("<td></td>")
-            else:
+            if row['has_detail']:
                 self.p('<td><a title="Show/hide output" '
                        'onclick="toggle_detail(%d); return false;" '
                        'id="dettog%d" class="dettog" '
                        'href="#">[+]</a></td>' % (n, n))
-                detail = ' <div id="detail%d" class="detail">' \
-                         '<pre>%s</pre></div>' % (n, html_escape(detail))
+                # Detail is fetched by toggle_detail() when first shown
+                detail = (' <div id="detail%d" class="detail" '
+                          'data-url="%s"><pre></pre></div>'
+                          % (n, self.get_test_detail_link(row['name'],
+                                                          row['arch'])))
+            else:
+                detail = ''
+                self.p("<td></td>")
             testlink = self.get_link(page='results', test=row['name'],
                                      platform=row['arch'])
             test_name = row['test_name']
@@ -1445,12 +2412,9 @@ class TestPage(object):
                % (self.get_link(page='comp', component=component_id),
                   component)
 
-    def get_arch_id_map(self, c):
-        map = {}
-        c.execute("SELECT * FROM imp_test_archs")
-        for row in c:
-            map[row['id']] = platforms_dict[row['name']]
-        return map
+    def get_arch_id_map(self, *archs):
+        return dict((i, platforms_dict[name]) for i, name
+                    in _dimensions.get_archs(self.db, *archs).items())
 
     def display_test_runtime(self):
         self.p("<h1>Test runtime, %s</h1>" % self.get_build_id())
@@ -1463,7 +2427,7 @@ class TestPage(object):
                  "imp_test.name=imp_test_names.id AND "
                  "imp_test_names.unit=imp_test_units.id"
                  + self.get_sql_lab_only())
-        c = MySQLdb.cursors.DictCursor(conn)
+        c = conn.cursor(MySQLdb.cursors.DictCursor)
         c.execute(query, (self.date, self.test))
         row = c.fetchone()
         if row is None:
@@ -1484,44 +2448,23 @@ class TestPage(object):
                "IMP's performance. For that, please see the "
                "<a href=\"%s\">benchmarks</a>.</p>"
                % self.get_link(page='bench'))
-        self.p('<div id="runtime" class="benchmark"></div>')
-
-        arch_id_map = self.get_arch_id_map(c)
-
-        query = "SELECT runtime, date, arch FROM " + table \
-                + " WHERE date<=%s AND name=%s AND state='OK' " \
-                "ORDER BY arch, date"
-        c.execute(query, (self.date, self.test))
-        arch = None
-        data = []
-        arch_ids = []
+        self.show_chart_window_links()
+        self.p('<div id="runtime" class="benchmark" data-url="%s"></div>'
+               % self.get_chart_url('test_runtime_series', test=self.test))
         self.p("""<script type="text/javascript">
 $(document).ready(function() {
-  var plot = $.jqplot('runtime', [""")
-
-        def print_series(d, suffix=''):
-            self.p("[" + ",".join("['%s', %f]" % x for x in d) + "]" + suffix)
-        for row in c:
-            if arch != row['arch']:
-                if arch is not None and data:
-                    print_series(data, suffix=',')
-                    arch_ids.append(arch)
-                arch = row['arch']
-                data = []
-            data.append((row['date'], row['runtime']))
-        if arch and data:
-            print_series(data)
-            arch_ids.append(arch)
-        self.p("""],
+  lazy_charts('benchmark', function(div, data) {
+    if (data.series.length == 0) {
+      return;
+    }
+    $.jqplot(div.id, $.map(data.series, function(s) { return [s.runtime]; }),
  {
-    series:[
-%s
-    ],
+    series: $.map(data.series, function(s) { return {label: s.label}; }),
     legend: {show:true, location: 'sw'},
     axes: {
       xaxis: {
         renderer: $.jqplot.DateAxisRenderer,
-        tickOptions: {formatString: '%%F', showGridline: false}
+        tickOptions: {formatString: '%F', showGridline: false}
       },
       yaxis: {
         label: 'Runtime (s)',
@@ -1539,31 +2482,79 @@ $(document).ready(function() {
        showTooltip:true
     }
   });
-});""" % ",\n".join("      {label: '%s'}" % arch_id_map[x].short
-                    for x in arch_ids))
-
+  });
+});""")
         self.p('</script>')
 
+    def display_test_runtime_series(self):
+        """Get the runtime of a test on each platform, as JSON"""
+        c = self.db.cursor(MySQLdb.cursors.DictCursor)
+        table = self.get_branch_table('imp_test')
+        query = "SELECT imp_test.runtime, imp_test.date, imp_test.arch " \
+                "FROM " + table + " imp_test, imp_test_names, " \
+                "imp_test_units WHERE imp_test.date<=%s " \
+                "AND imp_test.name=%s AND imp_test.state='OK' " \
+                "AND imp_test.runtime IS NOT NULL " \
+                "AND imp_test.name=imp_test_names.id " \
+                "AND imp_test_names.unit=imp_test_units.id" \
+                + self.get_sql_lab_only()
+        args = [self.date, self.test]
+        start = self.get_chart_window()[1]
+        if start is not None:
+            query += " AND imp_test.date>=%s"
+            args.append(start)
+        c.execute(query + " ORDER BY imp_test.arch, imp_test.date", args)
+        allrows = c.fetchall()
+        arch_id_map = self.get_arch_id_map(*set(r['arch'] for r in allrows))
+        columnar = bool(request.args.get('columnar'))
+        max_points = self.get_chart_max_points()
+        series = []
+        for arch, rows in itertools.groupby(allrows,
+                                            key=lambda r: r['arch']):
+            rows = list(rows)
+            s = get_chart_series([r['date'] for r in rows],
+                                 {'runtime': [r['runtime'] for r in rows]},
+                                 columnar, max_points)
+            s['label'] = arch_id_map[arch].short
+            series.append(s)
+        return get_json_response({'series': series})
+
+    def get_test_detail_link(self, test, platform):
+        kwargs = {'test': test, 'plat': platform,
+                  'date': get_date_link(self.date)}
+        if self.branch != 'develop':
+            kwargs['branch'] = self.branch
+        return url_for('test_detail', **kwargs).replace('&', '&amp;')
+
+    def display_test_detail(self):
+        """Get the detailed output of a single test, as JSON"""
+        db = BuildDatabase(self.db, self.date, self.lab_only, self.branch)
+        detail = db.get_test_detail(self.test, self.platform)
+        if detail is None:
+            flask.abort(404)
+        return get_json_response({'detail': detail})
+
     def display_test(self):
         self.p("<h1>Test results, %s</h1>" % self.get_build_id())
         conn = self.db
         table = self.get_branch_table('imp_test')
         query = ("SELECT imp_test_names.name as test_name, imp_test.name, "
-                 "imp_test_names.unit, imp_test.arch, imp_test_units.name "
-                 "as unit_name, imp_test_archs.name as arch_name, "
+                 "imp_test_names.unit, imp_test.arch, "
                  "imp_test.runtime, imp_test.date, imp_test.state, "
                  "imp_test.detail from " + table
-                 + " imp_test, imp_test_names, imp_test_units, imp_test_archs "
+                 + " imp_test, imp_test_names "
                  "where imp_test.date=%s and imp_test.name=%s and "
-                 "imp_test.arch=%s and imp_test.name=imp_test_names.id and "
-                 "imp_test_names.unit=imp_test_units.id and "
-                 "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only())
-        c = MySQLdb.cursors.DictCursor(conn)
+                 "imp_test.arch=%s and imp_test.name=imp_test_names.id")
+        c = conn.cursor(MySQLdb.cursors.DictCursor)
         c.execute(query, (self.date, self.test, self.platform))
         row = c.fetchone()
-        if row is None:
+        unit = row and self.get_visible_units(row['unit']).get(row['unit'])
+        if row is None or unit is None:
             self.p("<b>No results for this test on this date</b>")
             return
+        row = dict(row)
+        row['unit_name'] = unit[0]
+        row['arch_name'] = self.get_platform_name_from_id(conn, row['arch'])
         self.p('<table class="testres"><tbody>')
         self.p("<tr><td>Name</td> <td>%s</td></tr>" % row['test_name'])
         self.p("<tr><td>State</td> %s</tr>" % get_state_td(row['state']))
@@ -1578,84 +2569,115 @@ $(document).ready(function() {
                "href=\"%s\">plot</a>)</td></tr>"
                % (row['runtime'], self.get_link(page='runtime')))
         self.p("<tr><td>Date</td> <td>%s</td></tr>" % row['date'])
+        db = BuildDatabase(conn, self.date, self.lab_only, self.branch)
+        history = db.get_test_history(self.test, self.platform)
         if row['state'] in OK_STATES:
             self.p("<tr><td>Previously failed on</td> <td>%s</td></tr>"
                    % self.get_previous_test_link(conn, self.test,
-                                                 self.platform, False))
+                                                 self.platform, False,
+                                                 history))
         else:
             self.p("<tr><td>Previously passed on</td> <td>%s</td></tr>"
                    % self.get_previous_test_link(conn, self.test,
-                                                 self.platform, True))
+                                                 self.platform, True,
+                                                 history))
+        if history:
+            self.print_test_history(history)
         self.p("</tbody></table>")
         self.display_test_other_platforms(conn, self.test, self.platform)
 
     def display_test_other_platforms(self, conn, test, arch):
         self.p("<h2>Summary of results on all platforms</h2>")
         table = self.get_branch_table('imp_test')
-        query = ("SELECT imp_test_archs.name as arch_name, imp_test.arch, "
+        query = ("SELECT imp_test.arch, "
                  "imp_test.runtime, imp_test.state from " + table
-                 + " imp_test, imp_test_names, imp_test_units, imp_test_archs "
+                 + " imp_test, imp_test_names, imp_test_units "
                  "where imp_test.date=%s and imp_test.name=%s and "
                  "imp_test.name=imp_test_names.id and "
-                 "imp_test_names.unit=imp_test_units.id and "
-                 "imp_test.arch=imp_test_archs.id" + self.get_sql_lab_only())
-        c = MySQLdb.cursors.DictCursor(conn)
+                 "imp_test_names.unit=imp_test_units.id"
+                 + self.get_sql_lab_only())
+        c = conn.cursor(MySQLdb.cursors.DictCursor)
         c.execute(query, (self.date, test))
+        rows = c.fetchall()
+        archs = _dimensions.get_archs(conn, *set(r['arch'] for r in rows))
         self.p("<table class=\"sortable\"><thead><tr><th>Platform</th>")
         self.p("<th>State</th><th>Runtime (s)</th></tr></thead><tbody>")
-        for row in c:
+        for row in rows:
             link = self.get_link(page='results', test=test,
                                  platform=row['arch'])
             self.p("<tr>%s"
-                   % get_platform_td(row['arch_name'],
+                   % get_platform_td(archs.get(row['arch'], ''),
                                      fmt="<a href=\"" + link + "\">%s</a>"))
             self.p("%s <td>%.2f</td></tr>"
                    % (get_state_td(row['state']), row['runtime']))
         self.p("</tbody></table>")
 
-    def get_previous_test_link(self, conn, test, arch, previous_success):
-        if previous_success:
-            state_op = 'in'
-        else:
-            state_op = 'not in'
-        table = self.get_branch_table('imp_test')
-        query = "SELECT date from " + table + " where name=%s and arch=%s " \
-                "and state " + state_op + " " + str(OK_STATES) \
-                + " and date<%s order by date desc limit 1"
-        c = MySQLdb.cursors.DictCursor(conn)
-        c.execute(query, (test, arch, self.date))
-        row = c.fetchone()
-        if row:
+    def print_test_history(self, history):
+        """Show the current pass/fail streak of a test, and its results
+           over the last few weeks"""
+        streak = history.get_streak(self.date)
+        if streak:
+            state, length, since = streak
+            self.p("<tr><td>Streak</td> <td>%s for %d run%s (since "
+                   "<a href=\"%s\">%s</a>)</td></tr>"
+                   % ('passed' if state == history.PASS else 'failed',
+                      length, '' if length == 1 else 's',
+                      self.get_link(page='results', date=since), since))
+        cls = {history.PASS: 'sparkok', history.FAIL: 'sparkfail',
+               history.NOT_RUN: 'sparknone'}
+        title = {history.PASS: 'passed', history.FAIL: 'failed',
+                 history.NOT_RUN: 'not run'}
+        self.p('<tr><td>Last %d days</td> <td class="sparkline">%s</td></tr>'
+               % (HISTORY_DAYS, "".join(
+                   '<span class="%s" title="%s: %s"></span>'
+                   % (cls[state], date, title[state])
+                   for date, state in history.get_states(self.date,
+                                                         HISTORY_DAYS))))
+
+    def get_previous_test_link(self, conn, test, arch, previous_success,
+                               history=None):
+        date = None
+        before = self.date
+        if history:
+            date = history.get_previous_date(self.date, previous_success)
+            # Only results older than the history need to be searched
+            before = min(before, history.covered_from or history.first_date)
+        first_build = self.get_first_build_date()
+        if date is None and (first_build is None or before > first_build):
+            if previous_success:
+                state_op = 'in'
+            else:
+                state_op = 'not in'
+            table = self.get_branch_table('imp_test')
+            query = "SELECT date from " + table + " where name=%s and " \
+                    "arch=%s and state " + state_op + " " + str(OK_STATES) \
+                    + " and date<%s order by date desc limit 1"
+            c = conn.cursor(MySQLdb.cursors.DictCursor)
+            c.execute(query, (test, arch, before))
+            row = c.fetchone()
+            if row:
+                date = row['date']
+        if date:
             return "<a href=\"%s\">%s</a>" \
                    % (self.get_link(page='results', test=test, platform=arch,
-                                    date=row['date']),
-                      row['date'])
+                                    date=date), date)
         else:
             return "never"
 
     def display_page(self):
+        """Display the page. Pages that can be large are generators, which
+           yield at points where the output so far can be sent to the
+           client; this is also a generator for that reason."""
         self.display_navigation()
-        self.pages[self.page]()
+        page = self.pages[self.page]()
+        if page is not None:
+            yield from page
 
     def display_branch_link(self):
-        branch_links = [self.get_link(branch=x).replace('&amp;', '&')
-                        for x in self.all_branches]
-        self.p('<script type="text/javascript">')
-        self.p('function change_branch()')
-        self.p('{')
-        self.p('var sel=document.getElementById("branchlist");')
-        self.p('var branches=' + repr(branch_links) + ';')
-        self.p('window.location.assign(branches[sel.selectedIndex]);')
-        self.p('}')
-        self.p('</script>')
+        self.p(BRANCH_SCRIPT)
         self.p('<div class="branchlink">')
         self.p('<select id="branchlist" onchange="change_branch()">')
-        for branch in self.all_branches:
-            if branch == self.branch:
-                sel = ' selected="selected"'
-            else:
-                sel = ''
-            self.p('<option%s>Branch: %s</option>' % (sel, branch))
+        self.p(_branches.get_select_html(self.get_db, self.branch))
         self.p('</select></div>')
 
     def display_lab_only_link(self):
@@ -1689,9 +2711,10 @@ $(document).ready(function() {
         self.p('  <ul>')
         links = []
         if self.page in ('results', 'runtime', 'log', 'comp', 'compplattest',
-                         'benchfile', 'doc'):
+                         'benchfile', 'benchreg', 'doc', 'grouped', 'diff'):
             links.append(self.page)
-        links.extend(('build', 'new', 'all', 'long', 'bench'))
+        links.extend(('build', 'new', 'all', 'long', 'slow', 'flaky',
+                      'bench', 'search'))
         linktext = {'results': 'Test results',
                     'runtime': 'Test runtime',
                     'log': 'Log file',
@@ -1700,9 +2723,15 @@ $(document).ready(function() {
                     'comp': 'Component summary',
                     'new': 'New test failures',
                     'all': 'All test failures',
+                    'grouped': 'Grouped failures',
+                    'diff': 'Build changes',
                     'long': 'Long-running tests',
+                    'slow': 'Slower tests',
+                    'flaky': 'Flaky tests',
+                    'search': 'Search',
                     'doc': 'Doc summary',
                     'benchfile': 'File benchmarks',
+                    'benchreg': 'Benchmark regressions',
                     'platform': 'Platform',
                     'bench': 'Benchmarks'}
         for link in links:
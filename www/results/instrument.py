@@ -0,0 +1,130 @@
+"""Record how many database queries each request makes and how long they
+   take, for the Server-Timing header, the slow log and the metrics file."""
+
+import time
+import json
+
+
+class Stats:
+    """Per-request database statistics"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.db_time = 0.
+        self.rows = 0
+        self.slow_queries = []
+
+
+class Cursor:
+    """Wrap a database cursor, recording each statement and the rows
+       fetched in the connection's Stats"""
+    def __init__(self, cursor, conn):
+        self._cursor, self._conn = cursor, conn
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _add_time(self, start):
+        t = time.perf_counter() - start
+        self._conn.stats.db_time += t
+        return t
+
+    def execute(self, statement, args=()):
+        return self._execute(self._cursor.execute, statement, args)
+
+    def executemany(self, statement, args):
+        return self._execute(self._cursor.executemany, statement, args)
+
+    def _execute(self, method, statement, args):
+        start = time.perf_counter()
+        ret = method(statement, args)
+        t = self._add_time(start)
+        self._conn.stats.queries += 1
+        if t >= self._conn.slow_query_threshold:
+            self._conn.stats.slow_queries.append((t, statement))
+        return ret
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._add_time(start)
+        if row is not None:
+            self._conn.stats.rows += 1
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._add_time(start)
+        self._conn.stats.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+class Connection:
+    """Wrap a database connection so that all cursors are instrumented"""
+    def __init__(self, conn, slow_query_threshold):
+        self._conn = conn
+        self.slow_query_threshold = slow_query_threshold
+        self.stats = Stats()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, cursorclass=None):
+        if cursorclass is None:
+            c = self._conn.cursor()
+        else:
+            c = self._conn.cursor(cursorclass)
+        return Cursor(c, self)
+
+
+class ResponseSize:
+    """Count the size of a streamed response as it is sent"""
+    def __init__(self):
+        self.size = 0
+
+    def wrap(self, iterable):
+        try:
+            for chunk in iterable:
+                if isinstance(chunk, str):
+                    self.size += len(chunk.encode('utf-8'))
+                else:
+                    self.size += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+
+def get_server_timing(stats, render_time):
+    """Get the value of the Server-Timing header"""
+    return ('db;dur=%.1f;desc="%d queries, %d rows", render;dur=%.1f'
+            % (stats.db_time * 1000., stats.queries, stats.rows,
+               render_time * 1000.))
+
+
+def get_slow_log_lines(stats, render_time, url, threshold):
+    """Get lines to add to the slow log for this request, if any"""
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    lines = ["%s query %.3fs %s: %s" % (now, t, url, " ".join(sql.split()))
+             for t, sql in stats.slow_queries]
+    if render_time >= threshold:
+        lines.append("%s request %.3fs %s: %d queries, %.3fs in database, "
+                     "%d rows" % (now, render_time, url, stats.queries,
+                                  stats.db_time, stats.rows))
+    return lines
+
+
+def get_metrics_sample(stats, render_time, url, status, size):
+    """Get a line (in JSON format) for the metrics file"""
+    return json.dumps({'time': int(time.time()), 'url': url,
+                       'status': status, 'size': size,
+                       'queries': stats.queries,
+                       'db_time': round(stats.db_time, 6),
+                       'rows': stats.rows,
+                       'render_time': round(render_time, 6)})
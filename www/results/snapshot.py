@@ -0,0 +1,186 @@
+"""Export the results pages for a night's build as static HTML.
+
+   The results for a finished build never change, so after check_build.py
+   has stored them, every page for that build can be rendered once (with
+   the Flask test client, in several worker processes) and written to a
+   directory that Apache serves directly. Pages whose content has not
+   changed since the last export are not rewritten.
+
+   Run with "python3 -m results.snapshot" from the directory the web app
+   is installed in.
+"""
+
+import os
+import sys
+import hashlib
+import multiprocessing
+from argparse import ArgumentParser
+from . import app, get_db, index
+from .index import get_branch_table
+
+# Pages that exist for every build
+BUILD_PAGES = ['/', '/all-fail', '/all-fail/grouped', '/new-fail', '/long',
+               '/slower', '/flaky', '/doc', '/benchmark',
+               '/benchmark/regressions']
+
+# URL path the live results pages are served from, used for links and
+# assets in exported pages unless set by SNAPSHOT_SCRIPT_NAME
+DEFAULT_SCRIPT_NAME = '/nightly/results'
+
+# Test client for this worker process
+_client = None
+
+
+def get_snapshot_paths(conn, date, branch):
+    """Get the path of every page to export for the build on the given date:
+       the pages in BUILD_PAGES, plus one for each public component and
+       platform, each component on each platform, and each benchmark file
+       on each platform"""
+    paths = list(BUILD_PAGES)
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT r.arch, r.unit FROM "
+              + get_branch_table('imp_test_unit_result', branch)
+              + " r, imp_test_units u WHERE r.unit=u.id AND u.lab_only=false "
+              "AND r.date=%s ORDER BY r.arch, r.unit", (date,))
+    arch_units = c.fetchall()
+    paths.extend('/platform/%d' % a
+                 for a in sorted(set(a for a, u in arch_units)))
+    paths.extend('/comp/%d' % u
+                 for u in sorted(set(u for a, u in arch_units)))
+    paths.extend('/platform/%d/comp/%d' % au for au in arch_units)
+    c.execute("SELECT DISTINCT b.platform, n.file FROM "
+              + get_branch_table('imp_benchmark', branch)
+              + " b, imp_benchmark_names n WHERE b.name=n.id AND b.date=%s "
+              "ORDER BY b.platform, n.file", (date,))
+    bench = c.fetchall()
+    paths.extend('/platform/%d/benchmark' % p
+                 for p in sorted(set(p for p, f in bench)))
+    paths.extend('/platform/%d/benchmark/%d' % pf for pf in bench)
+    return paths
+
+
+def get_build_dates(conn, branch, start, end):
+    """Get the dates of all builds between start and end inclusive"""
+    c = conn.cursor()
+    c.execute("SELECT date FROM " + get_branch_table('imp_test_reporev',
+                                                     branch)
+              + " WHERE date>=%s AND date<=%s ORDER BY date", (start, end))
+    return [row[0] for row in c]
+
+
+def get_output_file(outdir, branch, date, path):
+    """Get the file to write the page at the given path to"""
+    return os.path.join(outdir, branch, index.get_date_link(date),
+                        path.strip('/'), 'index.html')
+
+
+def get_base_url():
+    """Get the URL to render pages at, so that they link to the live site"""
+    return 'http://localhost' + app.config.get('SNAPSHOT_SCRIPT_NAME',
+                                               DEFAULT_SCRIPT_NAME)
+
+
+def _init_worker():
+    global _client
+    # Keep one app context (and so one database connection) for all pages
+    # rendered by this process
+    app.app_context().push()
+    _client = app.test_client()
+
+
+def export_page(args):
+    """Render a single page and write it to fname, unless the file already
+       has the same content. Return 'written', 'unchanged' or 'failed'."""
+    path, query, fname = args
+    client = _client or app.test_client()
+    try:
+        rv = client.get(path, query_string=query, base_url=get_base_url())
+        try:
+            if rv.status_code != 200:
+                raise ValueError("returned status %d" % rv.status_code)
+            data = rv.get_data()
+        finally:
+            rv.close()
+    except Exception as exc:
+        print("%s failed: %s" % (path, exc), file=sys.stderr)
+        return 'failed'
+    try:
+        with open(fname, 'rb') as fh:
+            old = hashlib.sha256(fh.read()).digest()
+        if old == hashlib.sha256(data).digest():
+            return 'unchanged'
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname + '.tmp', 'wb') as fh:
+        fh.write(data)
+    os.replace(fname + '.tmp', fname)
+    return 'written'
+
+
+def export_build(date, branch, outdir, jobs=1):
+    """Export every page for the build on the given date. This must be
+       called in a Flask app context. Return a dict of the number of pages
+       written, unchanged and failed."""
+    paths = get_snapshot_paths(get_db(), date, branch)
+    query = {'date': index.get_date_link(date)}
+    if branch != 'develop':
+        query['branch'] = branch
+    tasks = [(path, query, get_output_file(outdir, branch, date, path))
+             for path in paths]
+    counts = {'written': 0, 'unchanged': 0, 'failed': 0}
+    if jobs == 1:
+        for task in tasks:
+            counts[export_page(task)] += 1
+    else:
+        with multiprocessing.Pool(jobs, initializer=_init_worker) as pool:
+            for result in pool.imap_unordered(export_page, tasks):
+                counts[result] += 1
+    return counts
+
+
+def parse_options():
+    parser = ArgumentParser(
+        description="Export the results pages for a build as static HTML")
+    parser.add_argument("--branch", default="develop",
+                        help="IMP branch (default develop)")
+    parser.add_argument("--date", type=index.parse_date_link,
+                        help="Date of the build to export, as YYYYMMDD "
+                             "(default: the most recent build)")
+    parser.add_argument("--backfill", nargs=2, metavar=("START", "END"),
+                        type=index.parse_date_link,
+                        help="Export every build between START and END "
+                             "inclusive, as YYYYMMDD")
+    parser.add_argument("--output", default=app.config.get('SNAPSHOT_DIR'),
+                        help="Directory to write pages to (default: the "
+                             "SNAPSHOT_DIR config setting)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of pages to render in parallel "
+                             "(default: number of CPUs)")
+    args = parser.parse_args()
+    if not args.output:
+        parser.error("No output directory given")
+    return args
+
+
+def main():
+    args = parse_options()
+    failed = 0
+    with app.app_context():
+        if args.backfill:
+            dates = get_build_dates(get_db(), args.branch, *args.backfill)
+        else:
+            dates = [args.date or index.get_last_build_date(args.branch)]
+        for date in dates:
+            counts = export_build(date, args.branch, args.output, args.jobs)
+            print("%s: %d pages written, %d unchanged, %d failed"
+                  % (date, counts['written'], counts['unchanged'],
+                     counts['failed']))
+            failed += counts['failed']
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
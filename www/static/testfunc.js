@@ -1,12 +1,10 @@
-function toggle_visibility(onid, offid, onlinkid, offlinkid) {
-  var one = document.getElementById(onid);
-  var offe = document.getElementById(offid);
-  var linkone = document.getElementById(onlinkid);
-  var linkoffe = document.getElementById(offlinkid);
-  one.style.display = 'block';
-  offe.style.display = 'none';
-  linkone.className = 'thispage';
-  linkoffe.className = '';
+function toggle_failmap(only_failed) {
+  var map = document.getElementById('summarymap');
+  var faillink = document.getElementById('faillink');
+  var fulllink = document.getElementById('fulllink');
+  map.className = only_failed ? 'onlyfailed' : 'showall';
+  faillink.className = only_failed ? 'thispage' : '';
+  fulllink.className = only_failed ? '' : 'thispage';
 }
 
 function show_conda() {
@@ -18,6 +16,23 @@ function show_conda() {
   }
 }
 
+/* Fetch the output of a test, if we don't have it already */
+function load_detail(detail) {
+  var url = detail.getAttribute('data-url');
+  if (url && !detail.getAttribute('data-loaded')) {
+    detail.setAttribute('data-loaded', '1');
+    detail.firstChild.textContent = 'Loading...';
+    fetch(url).then(function(response) {
+      return response.json();
+    }).then(function(data) {
+      detail.firstChild.textContent = data.detail;
+    }).catch(function() {
+      detail.firstChild.textContent = 'Could not load test output';
+      detail.removeAttribute('data-loaded');
+    });
+  }
+}
+
 function toggle_detail(num) {
   var detail = document.getElementById("detail" + num);
   var dettog = document.getElementById("dettog" + num);
@@ -25,6 +40,7 @@ function toggle_detail(num) {
     detail.style.display = 'none';
     dettog.innerHTML = '[+]';
   } else {
+    load_detail(detail);
     detail.style.display = 'block';
     dettog.innerHTML = '[-]';
   }
@@ -45,6 +61,9 @@ function toggle_all_detail() {
     newtog = '[+]'
   }
   for (var i = 0; i < details.length; ++i) {
+    if (disp == 'block') {
+      load_detail(details[i]);
+    }
     details[i].style.display = disp;
   }
   for (var i = 0; i < dettogs.length; ++i) {
@@ -52,6 +71,36 @@ function toggle_all_detail() {
   }
 }
 
+/* For each element with the given class, fetch JSON chart data from its
+   data-url once it is scrolled into view, and call plot(element, data) */
+function lazy_charts(cls, plot) {
+  var divs = document.getElementsByClassName(cls);
+  var load = function(div) {
+    fetch(div.getAttribute('data-url')).then(function(response) {
+      return response.json();
+    }).then(function(data) {
+      plot(div, data);
+    });
+  };
+  if (!('IntersectionObserver' in window)) {
+    for (var i = 0; i < divs.length; ++i) {
+      load(divs[i]);
+    }
+    return;
+  }
+  var observer = new IntersectionObserver(function(entries) {
+    for (var i = 0; i < entries.length; ++i) {
+      if (entries[i].isIntersecting) {
+        observer.unobserve(entries[i].target);
+        load(entries[i].target);
+      }
+    }
+  }, {rootMargin: '200px'});
+  for (var i = 0; i < divs.length; ++i) {
+    observer.observe(divs[i]);
+  }
+}
+
 /* e-mail obfuscation adapted from code by Jason Johnston:
    http://lojjic.net/blog/20030828-142754.rdf.html
 */
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""Measure how long each page of the results site takes to render with
+   a synthetic database of a given size, and compare with a baseline.
+
+   The database is sqlite (via the mock MySQLdb module used by the tests)
+   so this can be run anywhere; timings are only comparable between runs
+   on the same machine, but query counts and response sizes are not
+   machine dependent.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import datetime
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import utils  # noqa: E402
+
+utils.set_search_paths(os.path.abspath(__file__))
+
+# Start synthetic ids well above those used by utils.set_up_database
+FIRST_ID = 1000
+
+
+class Sizes:
+    """The size of the synthetic database"""
+    def __init__(self, platforms=10, units=40, tests=20, days=30,
+                 benchmarks=5):
+        self.platforms, self.units, self.tests = platforms, units, tests
+        self.days, self.benchmarks = days, benchmarks
+
+
+def make_synthetic_database(db, sizes, seed=42):
+    """Fill the database with synthetic build results ending on
+       utils.DEFAULT_DATE. Return a dict of ids to use in page URLs."""
+    import imp_build_utils
+    rng = random.Random(seed)
+    utils.set_up_database(db)
+    c = db.cursor()
+    archs = [FIRST_ID + i for i in range(sizes.platforms)]
+    names = [p[0] for p in imp_build_utils.all_platforms]
+    c.executemany("INSERT INTO imp_test_archs (id, name) VALUES (%s,%s)",
+                  [(a, names[i % len(names)]) for i, a in enumerate(archs)])
+    units = [FIRST_ID + i for i in range(sizes.units)]
+    c.executemany("INSERT INTO imp_test_units (id, name, lab_only) "
+                  "VALUES (%s,%s,%s)",
+                  [(u, 'IMP.unit%d' % u, 0) for u in units])
+    tests = {}
+    for u in units:
+        tests[u] = [FIRST_ID + len(tests) * sizes.tests + i
+                    for i in range(sizes.tests)]
+        c.executemany("INSERT INTO imp_test_names (id, name, unit) "
+                      "VALUES (%s,%s,%s)",
+                      [(t, 'unit%d-test%d' % (u, t), u) for t in tests[u]])
+    benchfiles = [FIRST_ID + i for i in range(sizes.benchmarks)]
+    c.executemany("INSERT INTO imp_benchmark_files (id, unit, name) "
+                  "VALUES (%s,%s,%s)",
+                  [(f, units[0], 'benchmark_%d' % f) for f in benchfiles])
+    c.executemany("INSERT INTO imp_benchmark_names (id, file, name, "
+                  "algorithm) VALUES (%s,%s,%s,%s)",
+                  [(f, f, 'bench %d' % f, 'alg') for f in benchfiles])
+
+    # Tests that currently fail, and those that are slow
+    failing = set()
+    for day in range(sizes.days):
+        date = utils.DEFAULT_DATE - datetime.timedelta(
+            days=sizes.days - day - 1)
+        if date != utils.DEFAULT_DATE:
+            c.execute("INSERT INTO imp_test_reporev (rev, date) "
+                      "VALUES (%s,%s)", ('rev%d' % day, date))
+        c.execute("INSERT INTO imp_build_summary (state, date, lab_only) "
+                  "VALUES (%s,%s,%s)", ('TEST', date, 0))
+        c.execute("INSERT INTO imp_doc (date, nbroken_tutorial, "
+                  "nbroken_manual, nbroken_rmf_manual) VALUES "
+                  "(%s,%s,%s,%s)", (date, 0, 1, 0))
+        test_rows, unit_rows, rollup_rows = [], [], []
+        for a in archs:
+            for u in units:
+                numfails = numnewfails = 0
+                for t in tests[u]:
+                    key = (a, t)
+                    newfail = False
+                    if key in failing:
+                        if rng.random() < 0.2:
+                            failing.discard(key)
+                    elif rng.random() < 0.01:
+                        failing.add(key)
+                        newfail = True
+                    state = 'FAIL' if key in failing else 'OK'
+                    if state == 'FAIL':
+                        numfails += 1
+                        numnewfails += newfail
+                    runtime = rng.lognormvariate(0., 1.5)
+                    test_rows.append((t, a, state, "", runtime, date,
+                                      'NEWFAIL' if newfail else None))
+                ustate = 'TEST' if numfails else 'OK'
+                unit_rows.append((a, u, ustate, 1, date))
+                rollup_rows.append((date, a, u, ustate, numfails,
+                                    numnewfails, 1))
+        c.executemany("INSERT INTO imp_test (name, arch, state, detail, "
+                      "runtime, date, delta) VALUES "
+                      "(%s,%s,%s,%s,%s,%s,%s)", test_rows)
+        c.executemany("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                      "logline, date) VALUES (%s,%s,%s,%s,%s)", unit_rows)
+        c.executemany("INSERT INTO imp_test_rollup (date, arch, unit, state, "
+                      "numfails, numnewfails, logline) VALUES "
+                      "(%s,%s,%s,%s,%s,%s,%s)", rollup_rows)
+        c.executemany("INSERT INTO imp_benchmark (name, runtime, checkval, "
+                      "date, platform) VALUES (%s,%s,%s,%s,%s)",
+                      [(f, rng.uniform(1., 2.), 1., date, a)
+                       for f in benchfiles for a in archs])
+    return {'plat': archs[0], 'comp': units[0], 'test': tests[units[0]][0],
+            'bench': benchfiles[0]}
+
+
+def get_routes(ids):
+    """Get the URLs of every page to benchmark"""
+    return ['/', '/all-fail', '/all-fail/grouped', '/new-fail', '/long',
+            '/slower', '/flaky', '/diff', '/doc', '/badge.svg',
+            '/platform/%(plat)d' % ids, '/comp/%(comp)d' % ids,
+            '/platform/%(plat)d/comp/%(comp)d' % ids,
+            '/platform/%(plat)d/test/%(test)d' % ids,
+            '/test/%(test)d/runtime' % ids,
+            '/test/%(test)d/runtime/series' % ids,
+            '/platform/%(plat)d/benchmark/%(bench)d' % ids,
+            '/platform/%(plat)d/benchmark/%(bench)d/series/%(bench)d' % ids,
+            '/platform/%(plat)d/benchmark' % ids, '/benchmark',
+            '/benchmark/regressions']
+
+
+def percentile(values, pct):
+    """Get the given percentile (0-100) of a list of values"""
+    values = sorted(values)
+    ind = min(len(values) - 1, int(round(pct / 100. * (len(values) - 1))))
+    return values[ind]
+
+
+def run_benchmark(results, routes, repeats):
+    """Get each page repeats times, and return a dict of statistics
+       keyed by URL"""
+    client = results.app.test_client()
+    stats = {}
+    for url in routes:
+        times = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            rv = client.get(url)
+            # Make sure that streamed responses are completely generated
+            size = len(rv.get_data())
+            rv.close()
+            times.append(time.perf_counter() - start)
+            if rv.status_code >= 400:
+                raise ValueError("%s returned status %d"
+                                 % (url, rv.status_code))
+        stats[url] = {'p50': percentile(times, 50),
+                      'p95': percentile(times, 95),
+                      'queries': results.get_db().stats.queries,
+                      'size': size}
+    return stats
+
+
+def compare_baseline(stats, baseline, tolerance):
+    """Compare statistics with a baseline. Return a list of regressions."""
+    regressions = []
+    for url, s in stats.items():
+        b = baseline.get(url)
+        if b is None:
+            continue
+        if s['p95'] > b['p95'] * (1. + tolerance):
+            regressions.append("%s: p95 %.1fms > baseline %.1fms"
+                               % (url, s['p95'] * 1000., b['p95'] * 1000.))
+        if s['queries'] > b['queries']:
+            regressions.append("%s: %d queries > baseline %d"
+                               % (url, s['queries'], b['queries']))
+    return regressions
+
+
+def print_report(stats, out=sys.stdout):
+    out.write("%-40s %9s %9s %8s %9s\n"
+              % ("URL", "p50 (ms)", "p95 (ms)", "queries", "bytes"))
+    for url, s in stats.items():
+        out.write("%-40s %9.1f %9.1f %8d %9d\n"
+                  % (url, s['p50'] * 1000., s['p95'] * 1000., s['queries'],
+                     s['size']))
+
+
+def get_options():
+    parser = ArgumentParser(
+        description="Benchmark results pages with a synthetic database")
+    for name, default, desc in (('platforms', 10, 'platforms'),
+                                ('units', 40, 'IMP components'),
+                                ('tests', 20, 'tests per component'),
+                                ('days', 30, 'days of build history'),
+                                ('benchmarks', 5, 'benchmark files')):
+        parser.add_argument("--" + name, type=int, default=default,
+                            help="Number of %s (default %d)"
+                                 % (desc, default))
+    parser.add_argument("--repeats", type=int, default=10,
+                        help="Number of times to get each page")
+    parser.add_argument("--indexes", default=False, action="store_true",
+                        help="Add indexes with imp_schema.py first")
+    parser.add_argument("--baseline",
+                        help="JSON file of baseline statistics. If it does "
+                             "not exist, it is created; otherwise, exit "
+                             "with an error on any regression")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Fractional increase in p95 latency allowed "
+                             "over the baseline (default 0.5)")
+    return parser.parse_args()
+
+
+def main():
+    opts = get_options()
+    results, tempdir = utils.import_mocked()
+    sizes = Sizes(opts.platforms, opts.units, opts.tests, opts.days,
+                  opts.benchmarks)
+    with results.app.app_context():
+        db = results.get_db()
+        ids = make_synthetic_database(db, sizes)
+        if opts.indexes:
+            import imp_schema
+            imp_schema.Schema(db, 'sqlite', verbose=False).upgrade()
+        stats = run_benchmark(results, get_routes(ids), opts.repeats)
+    print_report(stats)
+    if opts.baseline:
+        if os.path.exists(opts.baseline):
+            with open(opts.baseline) as fh:
+                baseline = json.load(fh)
+            regressions = compare_baseline(stats, baseline, opts.tolerance)
+            for r in regressions:
+                print("REGRESSION: " + r)
+            if regressions:
+                sys.exit(1)
+        else:
+            with open(opts.baseline, 'w') as fh:
+                json.dump(stats, fh, indent=2)
+            print("Wrote baseline to " + opts.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,9 @@ import datetime
 
 # Don't use deprecated default date adapter
 sqlite3.register_adapter(datetime.date, lambda x: x.isoformat())
+# Return DATE columns as datetime.date, like MySQL does
+sqlite3.register_converter(
+    "DATE", lambda x: datetime.date.fromisoformat(x.decode()))
 
 
 class MockCursor:
@@ -18,6 +21,10 @@ class MockCursor:
         # sqlite uses ? as a placeholder; MySQL uses %s
         self.dbcursor.execute(statement.replace('%s', '?'), args)
 
+    def executemany(self, statement, args):
+        self.sql.append(statement)
+        self.dbcursor.executemany(statement.replace('%s', '?'), args)
+
     def fetchone(self):
         return self.dbcursor.fetchone()
 
@@ -44,11 +51,15 @@ class MockConnection:
     def __init__(self, db, *args, **keys):
         self.args = args
         self.keys = keys
-        self.db = sqlite3.connect(":memory:")
+        self.db = sqlite3.connect(":memory:",
+                                  detect_types=sqlite3.PARSE_DECLTYPES)
         self.sql = []
 
-    def cursor(self):
-        return MockCursor(self)
+    def cursor(self, cursorclass=None):
+        return (cursorclass or MockCursor)(self)
+
+    def commit(self):
+        self.db.commit()
 
     def close(self):
         self.db.close()
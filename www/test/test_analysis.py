@@ -0,0 +1,138 @@
+import utils
+import datetime
+
+utils.set_search_paths(__file__)
+
+import imp_build_analysis  # noqa: E402
+
+
+def make_rows(name, platform, runtimes, end=utils.DEFAULT_DATE):
+    start = end - datetime.timedelta(days=len(runtimes) - 1)
+    return [(name, platform, start + datetime.timedelta(days=i), r)
+            for i, r in enumerate(runtimes)]
+
+
+def test_robust_baseline():
+    """Test robust baseline estimation"""
+    median, sigma = imp_build_analysis.get_robust_baseline(
+        [1.0, 1.1, 0.9, 1.0, 100.0])
+    assert median == 1.0
+    assert abs(sigma - 0.1 * imp_build_analysis.MAD_SCALE) < 1e-6
+
+
+def test_step_change():
+    """Test detection of a step change in runtime"""
+    noise = [1.0, 1.02, 0.98, 1.01, 0.99] * 4
+    rows = make_rows(1, 3, noise + [1.5, 1.52, 1.48])
+    regs = list(imp_build_analysis.find_regressions(rows,
+                                                    utils.DEFAULT_DATE))
+    assert len(regs) == 1
+    r = regs[0]
+    assert (r.name, r.platform) == (1, 3)
+    assert r.change_date == utils.DEFAULT_DATE - datetime.timedelta(days=2)
+    assert r.baseline == 1.0
+    assert r.runtime == 1.5
+    assert abs(r.effect - 0.5) < 1e-6
+    # The change should not be reported again the next day
+    rows = make_rows(1, 3, noise + [1.5, 1.52, 1.48, 1.51])
+    assert list(imp_build_analysis.find_regressions(
+        rows, utils.DEFAULT_DATE)) == []
+
+
+def test_no_regression():
+    """Test that noise, spikes and small changes are not reported"""
+    noise = [1.0, 1.02, 0.98, 1.01, 0.99] * 4
+    for recent in ([1.5, 1.0, 1.5],       # not every recent run is slow
+                   [1.05, 1.06, 1.05],    # effect too small
+                   [0.5, 0.5, 0.5]):      # faster, not slower
+        rows = make_rows(1, 3, noise + recent)
+        assert list(imp_build_analysis.find_regressions(
+            rows, utils.DEFAULT_DATE)) == []
+    # Too few runs for a baseline
+    rows = make_rows(1, 3, [1.0, 1.0, 2.0, 2.0, 2.0])
+    assert list(imp_build_analysis.find_regressions(
+        rows, utils.DEFAULT_DATE)) == []
+
+
+def test_multiple_series():
+    """Test finding regressions in several series at once"""
+    noise = [1.0, 1.02, 0.98, 1.01, 0.99] * 4
+    rows = (make_rows(1, 3, noise + [2.0, 2.0, 2.0])
+            + make_rows(1, 4, noise + [1.0, 1.0, 1.0])
+            # Did not run on the date, so should be ignored
+            + make_rows(2, 3, noise + [2.0, 2.0, 2.0],
+                        end=utils.DEFAULT_DATE - datetime.timedelta(days=1))
+            + make_rows(3, 3, noise + [None, 3.0, 3.0, 3.0]))
+    regs = list(imp_build_analysis.find_regressions(rows,
+                                                    utils.DEFAULT_DATE))
+    assert [(r.name, r.platform) for r in regs] == [(1, 3), (3, 3)]
+
+
+def test_test_slowdowns():
+    """Test detection of tests that got slower"""
+    steady = [10.0, 10.5, 9.5, 10.2, 9.8] * 2
+    rows = (make_rows(1, 3, steady + [30.0])
+            # Jump too small
+            + make_rows(2, 3, steady + [13.0])
+            # Already slow yesterday
+            + make_rows(3, 3, steady + [30.0, 30.0])
+            # Too few previous runs
+            + make_rows(4, 3, [10.0, 10.0, 30.0])
+            # Noisy platform, so a jump of this size is expected
+            + make_rows(1, 4, [10.0, 20.0, 5.0, 15.0, 10.0] * 2 + [30.0])
+            + make_rows(2, 4, [10.0, 15.0, 5.0, 20.0, 10.0] * 2 + [10.0]))
+    slow = list(imp_build_analysis.find_test_slowdowns(rows,
+                                                       utils.DEFAULT_DATE))
+    assert len(slow) == 1
+    s = slow[0]
+    assert (s.name, s.arch) == (1, 3)
+    assert s.baseline == 10.0
+    assert s.runtime == 30.0
+    assert abs(s.effect - 2.0) < 1e-6
+
+
+def test_flaky_tests():
+    """Test detection of flaky tests"""
+    P, F = True, False
+    rows = [(1, 3, [P, F, P, P, F, P, P, P, F, P, P]),
+            # Broke once and was fixed
+            (2, 3, [P, P, P, F, F, F, F, P, P, P, P]),
+            # Too few runs
+            (3, 3, [P, F, P, F, P, F]),
+            (4, 3, [F, P] * 10)]
+    assert imp_build_analysis.get_flips(rows[1][2]) == (11, 2)
+    flaky = list(imp_build_analysis.find_flaky_tests(rows))
+    assert [(f.name, f.arch, f.runs, f.flips) for f in flaky] \
+        == [(1, 3, 11, 6), (4, 3, 20, 19)]
+    assert abs(flaky[0].score - 0.6) < 1e-6
+    assert flaky[1].score == 1.0
+
+
+def test_failure_signature():
+    """Test normalized failure signatures"""
+    def make_output(path, line, addr, time, val):
+        return ('[...] partial line\n'
+                'Traceback (most recent call last):\n'
+                '  File "%s/IMP/test/__init__.py", line %d, in run\n'
+                'ValueError: object at %s is bad (%.3f != 1.0)\n'
+                'Ran 3 tests in %.2fs' % (path, line, addr, val, time))
+    sig1, summary = imp_build_analysis.get_failure_signature(
+        'test_foo', 'FAIL',
+        make_output('/tmp/build1/lib', 42, '0x7fff0010', 1.23, 0.9995))
+    sig2, summary2 = imp_build_analysis.get_failure_signature(
+        'test_bar', 'FAIL',
+        make_output(r'C:\build\lib', 45, '0xdeadbeef', 10.2, 1.0005))
+    assert sig1 == sig2
+    assert len(sig1) == 16
+    assert summary == 'ValueError: object at 0xN is bad (F != F)'
+    sig3, summary = imp_build_analysis.get_failure_signature(
+        'test_foo', 'FAIL', 'TypeError: bad type')
+    assert sig3 != sig1
+    # Failures with no output depend only on the test and state
+    sig4, summary = imp_build_analysis.get_failure_signature(
+        'test_foo', 'TIMEOUT', None)
+    assert summary == 'test_foo TIMEOUT'
+    assert imp_build_analysis.get_failure_signature(
+        'test_foo', 'TIMEOUT', '')[0] == sig4
+    assert imp_build_analysis.get_failure_signature(
+        'test_bar', 'TIMEOUT', '')[0] != sig4
@@ -0,0 +1,32 @@
+import utils
+import benchmark
+
+utils.set_search_paths(__file__)
+
+results, tempdir = utils.import_mocked()
+
+
+def test_benchmark():
+    """Test the page benchmark harness with a small synthetic database"""
+    sizes = benchmark.Sizes(platforms=2, units=2, tests=3, days=3,
+                            benchmarks=1)
+    with results.app.app_context():
+        ids = benchmark.make_synthetic_database(results.get_db(), sizes)
+        routes = benchmark.get_routes(ids)
+        stats = benchmark.run_benchmark(results, routes, repeats=2)
+    assert sorted(stats.keys()) == sorted(routes)
+    assert stats['/']['queries'] > 0
+    assert stats['/']['size'] > 0
+    assert stats['/']['p50'] <= stats['/']['p95']
+    assert benchmark.compare_baseline(stats, stats, 0.) == []
+    baseline = {'/': {'p95': stats['/']['p95'] / 10., 'queries': 0}}
+    regressions = benchmark.compare_baseline(stats, baseline, 0.5)
+    assert len(regressions) == 2
+    assert regressions[0].startswith('/: p95 ')
+
+
+def test_percentile():
+    """Test percentile calculation"""
+    assert benchmark.percentile([3, 1, 2], 50) == 2
+    assert benchmark.percentile(list(range(101)), 95) == 95
+    assert benchmark.percentile([5], 95) == 5
@@ -1,3 +1,7 @@
+import os
+import json
+import gzip
+import datetime
 import utils
 
 utils.set_search_paths(__file__)
@@ -15,6 +19,64 @@ def test_summary():
         assert b'Summary for build on 2020-01-01' in rv.data
 
 
+def test_summary_rollup():
+    """Test the summary page using precomputed test rollups"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_rollup (date, arch, unit, state, "
+                  "numfails, numnewfails, logline) VALUES "
+                  "(%s,%s,%s,%s,%s,%s,%s)",
+                  (utils.DEFAULT_DATE, 3, 5, 'CMAKE_TEST', 7, 2, None))
+        c = results.app.test_client()
+        rv = c.get('/')
+        assert rv.status_code == 200
+        assert b'Component failed 7 test cases (2 new failures' in rv.data
+        assert b'>7, +2</a>' in rv.data
+
+
+def test_summary_no_rollup():
+    """Test the summary page falling back to raw test results"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                  "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                  (3, 5, 'CMAKE_TEST', None, utils.DEFAULT_DATE))
+        c = results.app.test_client()
+        rv = c.get('/')
+        assert rv.status_code == 200
+        assert b'>2, +1</a>' in rv.data
+
+
+def test_summary_only_failed():
+    """Test tagging of components and platforms without failures"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_archs (id, name) VALUES (%s,%s)",
+                  (4, 'mac10v4-intel'))
+        c.execute("INSERT INTO imp_test_units (id, name, lab_only) "
+                  "VALUES (%s,%s,%s)", (6, 'IMP.foo', 0))
+        for arch, unit, state in ((3, 5, 'CMAKE_TEST'), (3, 6, 'CMAKE_OK'),
+                                  (4, 5, 'CMAKE_OK'), (4, 6, 'CMAKE_OK')):
+            c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                      "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                      (arch, unit, state, None, utils.DEFAULT_DATE))
+        c = results.app.test_client()
+        rv = c.get('/')
+        assert rv.status_code == 200
+        # The table should only be rendered once
+        assert rv.data.count(b'<table class="modules">') == 1
+        assert rv.data.count(b'<tr class="okrow">') == 1
+        assert rv.data.count(b'<th class="okcol"') == 1
+        assert rv.data.count(b'<td class="okcol">') == 2
+        assert b'<div id="summarymap" class="onlyfailed">' in rv.data
+
+
 def test_invalid_platform():
     """Test the platform page with an invalid platform ID"""
     with results.app.app_context():
@@ -64,12 +126,42 @@ def test_component():
 
 def test_badge():
     """Test the status badge"""
-    with results.app.app_context():
-        utils.set_up_database(results.get_db())
-        c = results.app.test_client()
-        for url in ('/badge.svg', '/?p=stat'):
-            rv = c.get(url)
-            assert rv.status_code == 302
+    import imp_build_utils
+    results.index._badge_cache.clear()
+    stamp = imp_build_utils.get_summary_stamp('develop')
+    try:
+        with results.app.app_context():
+            db = results.get_db()
+            utils.set_up_database(db)
+            c = results.app.test_client()
+            # No summary yet, so should not be cached
+            rv = c.get('/badge.svg')
+            assert rv.status_code == 200
+            assert b'passing' in rv.data
+            assert results.index._badge_cache == {}
+            db.cursor().execute(
+                "INSERT INTO imp_build_summary (state, date, lab_only) "
+                "VALUES (%s,%s,%s)", ('BUILD', utils.DEFAULT_DATE, 0))
+            for url in ('/badge.svg', '/?p=stat'):
+                rv = c.get(url)
+                assert rv.status_code == 200
+                assert rv.mimetype == 'image/svg+xml'
+                assert b'<title>nightly build: failing</title>' in rv.data
+            etag = rv.headers['ETag']
+            rv = c.get('/badge.svg', headers={'If-None-Match': etag})
+            assert rv.status_code == 304
+            # Status is cached until a new build summary is stored
+            db.cursor().execute("UPDATE imp_build_summary SET state='OK'")
+            rv = c.get('/badge.svg')
+            assert b'failing' in rv.data
+            # Touch the stamp as check_build.py does
+            with open(stamp, 'a'):
+                os.utime(stamp)
+            rv = c.get('/badge.svg')
+            assert b'<title>nightly build: passing</title>' in rv.data
+    finally:
+        if os.path.exists(stamp):
+            os.unlink(stamp)
 
 
 def test_all_failures():
@@ -80,11 +172,177 @@ def test_all_failures():
         for url in ('/all-fail', '/?p=all'):
             rv = c.get(url)
             assert rv.status_code == 200
+            # Page should be streamed, but still be a complete document
+            assert rv.is_streamed
             assert b'All test failures for build on 2020-01-01' in rv.data
             assert b'em-goodtest' not in rv.data
             assert b'em-badtest' in rv.data
             assert b'em-newbadtest' in rv.data
             assert b'em-longtest' not in rv.data
+            assert rv.data.startswith(b'<!DOCTYPE HTML')
+            assert rv.data.endswith(b'</body></html>')
+
+
+def test_log():
+    """Test display of a platform build log"""
+    import imp_build_utils
+    logdir = (imp_build_utils.topdir / 'develop' / '20200101-abcde'
+              / 'build' / 'logs' / 'imp')
+    logdir.mkdir(parents=True, exist_ok=True)
+    nlines = results.index.STREAM_LINES * 2
+    with open(logdir / 'coverage.log', 'w') as fh:
+        for i in range(nlines):
+            fh.write('line %d <>\n' % i)
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                  "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                  (3, 5, 'BUILD', 42, utils.DEFAULT_DATE))
+        c = results.app.test_client()
+        rv = c.get('/?plat=3')
+        assert rv.status_code == 200
+        assert b'<a href="#n_42">IMP.em failed to build</a>' in rv.data
+        assert (b'<a name="n_42"></a><pre class="errorline">\nline 41 &lt;&gt;'
+                in rv.data)
+        assert b'line %d &lt;&gt;' % (nlines - 1) in rv.data
+        assert b'Build appears to be incomplete' in rv.data
+        assert rv.data.endswith(b'</body></html>')
+
+
+def test_log_index():
+    """Test display of a platform build log using a line index"""
+    import imp_build_utils
+    logdir = (imp_build_utils.topdir / 'develop' / '20200101-abcde'
+              / 'build' / 'logs' / 'imp')
+    logdir.mkdir(parents=True, exist_ok=True)
+    logfile = logdir / 'coverage.log'
+    with open(logfile, 'w') as fh:
+        for i in range(1000):
+            fh.write('line %d\n' % i)
+        fh.write('BUILD COMPLETED\n')
+    imp_build_utils.write_line_index(str(logfile))
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                  "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                  (3, 5, 'BUILD', 42, utils.DEFAULT_DATE))
+        c = results.app.test_client()
+        rv = c.get('/?plat=3')
+        assert rv.status_code == 200
+        assert (b'<a name="n_42"></a><pre class="errorline">\nline 41'
+                in rv.data)
+        assert b'line 30\n' not in rv.data
+        assert b'line 31\n' in rv.data
+        assert b'line 241\n' in rv.data
+        assert b'line 242\n' not in rv.data
+        assert b'line 999\n' in rv.data
+        assert b'>[31 lines not shown; show them]<' in rv.data
+        assert b'?plat=3&amp;log=n&amp;lines=1-31"' in rv.data
+        assert b'>[709 lines not shown; show them]<' in rv.data
+        assert b'?plat=3&amp;log=n&amp;lines=243-951"' in rv.data
+        assert b'Build appears to be incomplete' not in rv.data
+        # Show only the lines in a gap
+        rv = c.get('/?plat=3&log=n&lines=1-31')
+        assert rv.status_code == 200
+        assert b'Lines 1 to 31 of the log' in rv.data
+        assert b'line 0\n' in rv.data
+        assert b'line 30\n' in rv.data
+        assert b'line 31\n' not in rv.data
+        assert b'line 999\n' not in rv.data
+        rv = c.get('/?plat=3&log=l&lines=1-31')
+        assert rv.status_code == 200
+        assert b'line 0\n' not in rv.data
+        rv = c.get('/?plat=3&full=1')
+        assert rv.status_code == 200
+        assert b'line 30\n' in rv.data
+        assert b'not shown' not in rv.data
+    os.unlink(logfile)
+    os.unlink(str(logfile) + '.idx')
+
+
+def test_log_compressed():
+    """Test display of a compressed platform build log"""
+    import imp_build_utils
+    logdir = (imp_build_utils.topdir / 'develop' / '20200101-abcde'
+              / 'build' / 'logs' / 'imp')
+    logdir.mkdir(parents=True, exist_ok=True)
+    logfile = logdir / 'coverage.log'
+    with open(logfile, 'w') as fh:
+        for i in range(1000):
+            fh.write('line %d\n' % i)
+    imp_build_utils.compress_log(str(logfile), block_size=100)
+    assert not os.path.exists(logfile)
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                  "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                  (3, 5, 'BUILD', 42, utils.DEFAULT_DATE))
+        c = results.app.test_client()
+        rv = c.get('/?plat=3')
+        assert rv.status_code == 200
+        assert (b'<a name="n_42"></a><pre class="errorline">\nline 41'
+                in rv.data)
+        assert b'line 30\n' not in rv.data
+        assert b'line 999\n' in rv.data
+        assert b'Build appears to be incomplete' in rv.data
+        assert b'href="/rawlog/coverage.log?date=20200101">' in rv.data
+        rv = c.get('/?plat=3&full=1')
+        assert rv.status_code == 200
+        assert b'line 30\n' in rv.data
+    os.unlink(str(logfile) + '.gz')
+    os.unlink(str(logfile) + '.gz.idx')
+
+
+def test_raw_log():
+    """Test download of raw log files"""
+    import imp_build_utils
+    logdir = (imp_build_utils.topdir / 'develop' / '20200101-abcde'
+              / 'build' / 'logs' / 'imp' / 'coverage')
+    logdir.mkdir(parents=True, exist_ok=True)
+    with open(logdir / 'plain.log', 'w') as fh:
+        fh.write('plain log\n')
+    with open(logdir / 'comp.log', 'w') as fh:
+        fh.write('compressed log\n')
+    imp_build_utils.compress_log(str(logdir / 'comp.log'))
+    with results.app.app_context():
+        utils.set_up_database(results.get_db())
+        c = results.app.test_client()
+        rv = c.get('/rawlog/coverage/plain.log?date=20200101')
+        assert rv.status_code == 200
+        assert rv.data == b'plain log\n'
+        rv.close()
+        # Compressed log should be sent as-is if the client accepts gzip
+        rv = c.get('/rawlog/coverage/comp.log?date=20200101',
+                   headers={'Accept-Encoding': 'gzip, deflate'})
+        assert rv.status_code == 200
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(rv.data) == b'compressed log\n'
+        rv.close()
+        rv = c.get('/rawlog/coverage/comp.log?date=20200101')
+        assert rv.status_code == 200
+        assert 'Content-Encoding' not in rv.headers
+        assert rv.data == b'compressed log\n'
+        for url in ('/rawlog/coverage/missing.log?date=20200101',
+                    '/rawlog/coverage/plain.log?date=19900101',
+                    '/rawlog/coverage/plain.log?date=20200101&lab=1',
+                    '/rawlog/../../../.last?date=20200101'):
+            rv = c.get(url)
+            assert rv.status_code == 404
+
+
+def test_log_windows():
+    """Test choice of lines to show from a log file"""
+    get_log_windows = results.index.get_log_windows
+    assert get_log_windows([], 20) == [(0, 20)]
+    assert get_log_windows([], 1000) == [(950, 1000)]
+    assert get_log_windows([5, 100], 1000) == [(0, 300), (950, 1000)]
+    assert get_log_windows([100, 900], 1000) == [(89, 300), (889, 1000)]
 
 
 def test_new_failures():
@@ -146,6 +404,117 @@ def test_one_test():
             assert b'em-longtest' in rv.data
 
 
+def test_one_test_history():
+    """Test display of a single test using its pass/fail history"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        results.index._first_build_dates.clear()
+        c = db.cursor()
+        c.execute(
+            "INSERT INTO imp_test_history VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
+            (100, 3, datetime.date(2019, 12, 20), utils.DEFAULT_DATE,
+             '5F2-6P', utils.DEFAULT_DATE, datetime.date(2019, 12, 24), None))
+        # History of a test that first ran after the history was started
+        c.execute(
+            "INSERT INTO imp_test_history VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
+            (42, 3, utils.DEFAULT_DATE, utils.DEFAULT_DATE, '1P',
+             utils.DEFAULT_DATE, None, datetime.date(2019, 12, 1)))
+        c = results.app.test_client()
+        rv = c.get('/platform/3/test/100')
+        assert rv.status_code == 200
+        assert b'Previously failed on' in rv.data
+        assert b'>2019-12-24</a>' in rv.data
+        assert b'passed for 6 runs' in rv.data
+        assert rv.data.count(b'class="sparkok"') == 6
+        assert rv.data.count(b'class="sparkfail"') == 5
+        assert rv.data.count(b'class="sparknone"') == 19
+        # The history covers every build, so no need to search old results
+        del db.sql[:]
+        rv = c.get('/platform/3/test/42')
+        assert b'Previously failed on</td> <td>never<' in rv.data
+        assert not any('limit 1' in sql for sql in db.sql)
+        # Only results older than the history should be searched
+        old = datetime.date(2019, 11, 1)
+        db.cursor().execute(
+            "INSERT INTO imp_test_reporev (rev, date) VALUES (%s,%s)",
+            ('oldrev', old))
+        db.cursor().execute(
+            "INSERT INTO imp_test (name, arch, state, detail, runtime, "
+            "date, delta) VALUES (%s,%s,%s,%s,%s,%s,%s)",
+            (42, 3, "FAIL", "", 1.0, old, None))
+        results.index._first_build_dates.clear()
+        rv = c.get('/platform/3/test/42')
+        assert b'>2019-11-01</a>' in rv.data
+    results.index._first_build_dates.clear()
+
+
+def test_test_history():
+    """Test run-length encoding of test pass/fail history"""
+    import imp_build_utils
+    d = datetime.date
+    h = imp_build_utils.TestHistory()
+    assert h.get_streak(d(2020, 1, 1)) is None
+    assert h.get_previous_date(d(2020, 1, 1), True) is None
+    h.add(d(2020, 1, 1), True)
+    h.add(d(2020, 1, 2), True)
+    h.add(d(2020, 1, 3), False)
+    # Replace result for the same day
+    h.add(d(2020, 1, 3), True)
+    assert h.last_ok == d(2020, 1, 3)
+    assert h.last_fail is None
+    h.add(d(2020, 1, 3), False)
+    assert h.last_ok == d(2020, 1, 2)
+    assert h.last_fail == d(2020, 1, 3)
+    h.add(d(2020, 1, 3), True)
+    h.add(d(2020, 1, 4), False)
+    # Days not run are recorded as gaps
+    h.add(d(2020, 1, 7), False)
+    # Older results are ignored
+    h.add(d(2020, 1, 2), False)
+    assert h.runs == '3P1F2-1F'
+    assert h.first_date == d(2020, 1, 1)
+    assert h.last_date == d(2020, 1, 7)
+    assert h.last_ok == d(2020, 1, 3)
+    assert h.last_fail == d(2020, 1, 7)
+
+    h = imp_build_utils.TestHistory(h.first_date, h.last_date, h.runs,
+                                    h.last_ok, h.last_fail)
+    assert h.runs == '3P1F2-1F'
+    assert h.get_streak(d(2020, 1, 7)) == ('F', 2, d(2020, 1, 4))
+    assert h.get_streak(d(2020, 1, 2)) == ('P', 2, d(2020, 1, 1))
+    assert h.get_streak(d(2020, 1, 6)) is None
+    assert h.get_previous_date(d(2020, 1, 7), True) == d(2020, 1, 3)
+    assert h.get_previous_date(d(2020, 1, 7), False) == d(2020, 1, 4)
+    assert h.get_previous_date(d(2020, 1, 4), False) is None
+    assert h.get_previous_date(d(2020, 1, 3), True) == d(2020, 1, 2)
+    assert h.get_states(d(2020, 1, 5), 6) == [
+        (d(2019, 12, 31), '-'), (d(2020, 1, 1), 'P'), (d(2020, 1, 2), 'P'),
+        (d(2020, 1, 3), 'P'), (d(2020, 1, 4), 'F'), (d(2020, 1, 5), '-')]
+
+
+def test_test_detail():
+    """Test lazy loading of test output"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        db.cursor().execute("UPDATE imp_test SET detail=%s WHERE name=60",
+                            ("Traceback: badtest failed",))
+        c = results.app.test_client()
+        # Test lists should link to the detail, but not include it
+        rv = c.get('/all-fail')
+        assert rv.status_code == 200
+        assert b'data-url="/platform/3/test/60/detail?date=' in rv.data
+        assert b'badtest failed' not in rv.data
+        rv = c.get('/platform/3/test/60/detail?date=20200101')
+        assert rv.status_code == 200
+        assert rv.get_json() == {'detail': 'Traceback: badtest failed'}
+        rv = c.get('/platform/3/test/42/detail?date=20200101')
+        assert rv.get_json() == {'detail': ''}
+        rv = c.get('/platform/3/test/60/detail?date=20190101')
+        assert rv.status_code == 404
+
+
 def test_runtime():
     """Test display of test runtime"""
     with results.app.app_context():
@@ -156,6 +525,338 @@ def test_runtime():
             assert rv.status_code == 200
             assert b'Test runtime, 2020-01-01, develop testrev' in rv.data
             assert b'Runtimes on each platform are shown for this' in rv.data
+            assert rv.data.count(b'<div id="runtime"') == 1
+
+
+def test_runtime_series():
+    """Test JSON test runtime data"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        # Tests with no recorded runtime should be skipped
+        db.cursor().execute(
+            "INSERT INTO imp_test (name, arch, state, detail, runtime, "
+            "date, delta) VALUES (%s,%s,%s,%s,%s,%s,%s)",
+            (100, 3, "OK", "", None,
+             utils.DEFAULT_DATE - datetime.timedelta(days=1), None))
+        c = results.app.test_client()
+        rv = c.get('/test/100/runtime/series?date=20200101')
+        assert rv.status_code == 200
+        assert rv.get_json() == {'series': [
+            {'label': 'Coverage', 'runtime': [['2020-01-01', 100.0]]}]}
+        assert 'ETag' in rv.headers
+        rv = c.get('/test/100/runtime/series?date=20200101&columnar=1',
+                   headers={'If-None-Match': rv.headers['ETag']})
+        # Columnar data differs, so is not cached
+        assert rv.status_code == 200
+        assert rv.get_json() == {'series': [
+            {'label': 'Coverage', 'dates': ['2020-01-01'],
+             'runtime': [100.0]}]}
+        etag = rv.headers['ETag']
+        rv = c.get('/test/100/runtime/series?date=20200101&columnar=1',
+                   headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+
+
+def test_benchmark_series_rollup():
+    """Test JSON benchmark data for long histories"""
+    import imp_build_utils
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        rows = [(19, 1.0, 0.0, utils.DEFAULT_DATE - datetime.timedelta(days=d),
+                 3) for d in range(1, 700)]
+        db.cursor().executemany(
+            "INSERT INTO imp_benchmark (name, runtime, checkval, date, "
+            "platform) VALUES (%s,%s,%s,%s,%s)", rows)
+        c = results.app.test_client()
+        url = ('/platform/3/benchmark/29/series/19?date=20200101'
+               '&columnar=1&window=all&max_points=100')
+        # No rollups, so should fall back to daily data
+        data = c.get(url).get_json()
+        assert data['bucket'] == 'day'
+        assert len(data['dates']) == 100
+        rollup = []
+        for bucket in ('week', 'month'):
+            starts = sorted(set(imp_build_utils.get_bucket_range(r[3],
+                                                                 bucket)[0]
+                                for r in rows))
+            rollup.extend((bucket, s, 19, 3, 7, 1.0, 1.0, 1.0, 0., 0., 0.)
+                          for s in starts)
+        db.cursor().executemany(
+            "INSERT INTO imp_benchmark_rollup VALUES "
+            "(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", rollup)
+        data = c.get(url).get_json()
+        assert data['bucket'] == 'week'
+        assert len(data['dates']) == 100
+        assert data['dates'][-1] == '2019-12-30'
+        data = c.get(url.replace('max_points=100', 'max_points=10')) \
+            .get_json()
+        assert data['bucket'] == 'month'
+        assert data['dates'][0] == '2018-02-01'
+        # Short windows use daily data
+        data = c.get(url.replace('window=all', 'window=90d')).get_json()
+        assert data['bucket'] == 'day'
+        # Older results missing from the rollup are summarized on the fly
+        db.cursor().execute("DELETE FROM imp_benchmark_rollup "
+                            "WHERE bucket_start<%s",
+                            (datetime.date(2019, 1, 1),))
+        data = c.get(url.replace('max_points=100', 'max_points=30')) \
+            .get_json()
+        assert data['bucket'] == 'month'
+        assert data['dates'][0] == '2018-02-01'
+        assert data['dates'][11] == '2019-01-01'
+        assert len(data['dates']) == 23
+        assert data['runtime'] == [1.0] * 23
+
+
+def test_benchmark_rollup_summary():
+    """Test summarizing benchmark results by week and month"""
+    import imp_build_utils
+    d = datetime.date(2019, 12, 18)
+    assert imp_build_utils.get_bucket_range(d, 'week') == (
+        datetime.date(2019, 12, 16), datetime.date(2019, 12, 23))
+    assert imp_build_utils.get_bucket_range(d, 'month') == (
+        datetime.date(2019, 12, 1), datetime.date(2020, 1, 1))
+    assert imp_build_utils.get_bucket_range(
+        datetime.date(2020, 2, 29), 'month') == (
+        datetime.date(2020, 2, 1), datetime.date(2020, 3, 1))
+    rows = [(1, 3, 2.0, 5.0), (1, 3, 1.0, None), (1, 3, 4.0, 6.0),
+            (2, 3, None, None)]
+    assert list(imp_build_utils.summarize_benchmarks(rows)) == [
+        (1, 3, 3, 1.0, 2.0, 4.0, 5.0, 5.5, 6.0),
+        (2, 3, 1, None, None, None, None, None, None)]
+
+
+def test_slower_tests():
+    """Test display of tests that got slower"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = results.app.test_client()
+        rv = c.get('/slower')
+        assert rv.status_code == 200
+        assert b'No tests got slower' in rv.data
+        db.cursor().execute(
+            "INSERT INTO imp_test_slowdown VALUES (%s,%s,%s,%s,%s,%s)",
+            (utils.DEFAULT_DATE, 100, 3, 40.0, 100.0, 1.5))
+        for url in ('/slower', '/?p=slow'):
+            rv = c.get(url)
+            assert rv.status_code == 200
+            assert b'Slower tests for build on 2020-01-01' in rv.data
+            assert b'em-longtest' in rv.data
+            assert b'+150%' in rv.data
+            assert b'href="/test/100/runtime"' in rv.data
+        import imp_build_utils
+        bdb = imp_build_utils.BuildDatabase(db, utils.DEFAULT_DATE, False,
+                                            'develop')
+        e = imp_build_utils._PlainEmailBody(bdb, None, None, None, None,
+                                            None)
+        assert 'em-longtest on Cov: 40.0s -> 100.0s' in e.get_test_slowdowns()
+
+
+def test_flaky_tests():
+    """Test display of flaky tests"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = results.app.test_client()
+        rv = c.get('/flaky')
+        assert rv.status_code == 200
+        assert b'No flaky tests were found' in rv.data
+        db.cursor().execute(
+            "INSERT INTO imp_test_flaky VALUES (%s,%s,%s,%s,%s,%s)",
+            (utils.DEFAULT_DATE, 99, 3, 20, 8, 0.42))
+        for url in ('/flaky', '/?p=flaky'):
+            rv = c.get(url)
+            assert rv.status_code == 200
+            assert b'Flaky tests for build on 2020-01-01' in rv.data
+            assert b'<td>0.42</td>' in rv.data
+            assert b'href="/platform/3/test/99"' in rv.data
+        # New failures of flaky tests are listed separately in the email
+        import imp_build_utils
+        bdb = imp_build_utils.BuildDatabase(db, utils.DEFAULT_DATE, False,
+                                            'develop')
+        e = imp_build_utils._PlainEmailBody(bdb, None, None, None, None,
+                                            None)
+        assert e.get_failed_units() == (0, {}, 1)
+        assert '1 new test failure was of tests known to be flaky' \
+            in e.get_new_failures()
+
+
+def test_grouped_failures():
+    """Test display of failures grouped by signature"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("UPDATE imp_test SET signature='abc' WHERE name IN (60, 99)")
+        c.execute("INSERT INTO imp_test_signature VALUES (%s,%s,%s,%s)",
+                  ('abc', datetime.date(2019, 12, 1), utils.DEFAULT_DATE,
+                   'ValueError: <bad>'))
+        c = results.app.test_client()
+        rv = c.get('/all-fail')
+        assert b'href="/all-fail/grouped"' in rv.data
+        rv = c.get('/all-fail/grouped')
+        assert rv.status_code == 200
+        assert b'Test failures grouped by error' in rv.data
+        assert b'<tr><td>2</td>' in rv.data
+        assert b'em-badtest (<a href="/platform/3/test/60">' in rv.data
+        assert b'em-newbadtest (<a href="/platform/3/test/99">' in rv.data
+        assert b'>2019-12-01</a>' in rv.data
+        assert b'ValueError: &lt;bad&gt;' in rv.data
+        import imp_build_utils
+        bdb = imp_build_utils.BuildDatabase(db, utils.DEFAULT_DATE, False,
+                                            'develop')
+        groups = bdb.get_failure_groups()
+        assert len(groups) == 1
+        assert groups[0]['signature'] == 'abc'
+        assert [t['name'] for t in groups[0]['tests']] == [60, 99]
+        # Failures stored without a signature are grouped by their output
+        db.cursor().execute("UPDATE imp_test SET signature=NULL, detail=%s "
+                            "WHERE name IN (60, 99)",
+                            ("ValueError: bad object at 0x1234",))
+        db.cursor().execute("UPDATE imp_test SET detail=%s WHERE name=99",
+                            ("ValueError: bad object at 0x5678",))
+        groups = bdb.get_failure_groups()
+        assert len(groups) == 1
+        assert groups[0]['signature'] is not None
+        assert groups[0]['summary'] == 'ValueError: bad object at 0xN'
+        assert groups[0]['first_date'] is None
+        assert [t['name'] for t in groups[0]['tests']] == [60, 99]
+
+
+def test_build_diff():
+    """Test comparison of two builds"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        prev = datetime.date(2019, 12, 31)
+        c.execute("INSERT INTO imp_test_names (id, name, unit) "
+                  "VALUES (%s,%s,%s)", (101, 'em-oldtest', 5))
+        for name, state in ((42, 'FAIL'), (60, 'FAIL'), (99, 'OK'),
+                            (101, 'OK')):
+            c.execute("INSERT INTO imp_test (name, arch, state, detail, "
+                      "runtime, date, delta) VALUES (%s,%s,%s,%s,%s,%s,%s)",
+                      (name, 3, state, "", 1.0, prev, None))
+        for date, state in ((prev, 'CMAKE_OK'),
+                            (utils.DEFAULT_DATE, 'CMAKE_TEST')):
+            c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                      "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                      (3, 5, state, None, date))
+        import imp_build_utils
+        new_db = imp_build_utils.BuildDatabase(db, utils.DEFAULT_DATE,
+                                               False, 'develop')
+        old_db = imp_build_utils.BuildDatabase(db, prev, False, 'develop')
+
+        def get_names(kind):
+            return [r['name'] for r in new_db.get_test_diff(old_db, kind)]
+        assert get_names('newfail') == [99]
+        assert get_names('newok') == [42]
+        assert get_names('added') == [100]
+        assert get_names('removed') == [101]
+        assert [(r['from_state'], r['to_state'])
+                for r in new_db.get_unit_diff(old_db)] \
+            == [('CMAKE_OK', 'CMAKE_TEST')]
+
+        c = results.app.test_client()
+        for url in ('/diff', '/diff?from=20191231&to=20200101'):
+            rv = c.get(url)
+            assert rv.status_code == 200
+            assert (b'Changes from develop build on 2019-12-31 to develop '
+                    b'build on 2020-01-01' in rv.data)
+            assert b'<td>CMAKE_OK</td> <td>CMAKE_TEST</td>' in rv.data
+            assert b'href="/platform/3/test/99">em-newbadtest' in rv.data
+            # Link to removed tests in the build in which they ran
+            assert (b'href="/platform/3/test/101?date=20191231">em-oldtest'
+                    in rv.data)
+        rv = c.get('/diff?from=20191230')
+        assert rv.data.count(b'<i>None.</i>') == 4
+        # Compare with another branch; unknown branches are ignored
+        rv = c.get('/diff?from_branch=garbage')
+        assert b'from develop build on 2019-12-31' in rv.data
+
+
+def test_search():
+    """Test full-text search of failed tests"""
+    import imp_build_search
+    fname = os.path.join(tempdir.name, 'search.db')
+    index = imp_build_search.SearchIndex(fname)
+    index.add_results('develop', utils.DEFAULT_DATE,
+                      [(60, 5, 3, 0, 'em-badtest',
+                        'Traceback: ValueError: <bad> density map')])
+    results.app.config['SEARCH_INDEX'] = fname
+    try:
+        with results.app.app_context():
+            utils.set_up_database(results.get_db())
+            c = results.app.test_client()
+            rv = c.get('/search')
+            assert rv.status_code == 200
+            assert b'Search the names and output of failed tests' in rv.data
+            rv = c.get('/search?q=density+map&from=20200101&plat=3&comp=5')
+            assert rv.status_code == 200
+            assert b'Showing results 1 to 1' in rv.data
+            assert b'href="/platform/3/test/60"' in rv.data
+            assert (b'&lt;bad&gt; <b>density</b> <b>map</b>'
+                    in rv.data)
+            assert b'Older' not in rv.data
+            rv = c.get('/search?q=density&from=20200102')
+            assert b'No failed tests matched' in rv.data
+            results.app.config['SEARCH_INDEX'] = fname + '.notexist'
+            rv = c.get('/search?q=density')
+            assert b'search index is not available' in rv.data
+    finally:
+        del results.app.config['SEARCH_INDEX']
+
+
+def test_benchmark_regressions():
+    """Test display of detected benchmark regressions"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = results.app.test_client()
+        rv = c.get('/benchmark/regressions')
+        assert rv.status_code == 200
+        assert b'No regressions were found' in rv.data
+        db.cursor().execute(
+            "INSERT INTO imp_benchmark_regression VALUES "
+            "(%s,%s,%s,%s,%s,%s,%s,%s,%s)",
+            (utils.DEFAULT_DATE, datetime.date(2019, 12, 30), 19, 3,
+             0.5, 0.75, 0.5, 'abc123', 'def456'))
+        for url in ('/benchmark/regressions', '/?p=benchreg'):
+            rv = c.get(url)
+            assert rv.status_code == 200
+            assert b'2019-12-30' in rv.data
+            assert b'rmf load rmf' in rv.data
+            assert b'+50%' in rv.data
+            assert b'href="/platform/3/benchmark/29#19"' in rv.data
+            assert (b'https://github.com/salilab/imp/compare/abc123...def456'
+                    in rv.data)
+        # Regressions are also listed in the email
+        import imp_build_utils
+        bdb = imp_build_utils.BuildDatabase(db, utils.DEFAULT_DATE, False,
+                                            'develop')
+        e = imp_build_utils._PlainEmailBody(bdb, None, None, None, None,
+                                            None)
+        txt = e.get_benchmark_regressions()
+        assert 'rmf load rmf on Cov: 50.0% slower since 2019-12-30' in txt
+        assert 'compare/abc123...def456' in txt
+
+
+def test_lttb():
+    """Test downsampling of chart data"""
+    from results.index import get_lttb_indices
+    xs = list(range(100))
+    ys = [0.] * 100
+    ys[42] = 10.
+    ys[70] = -5.
+    ind = get_lttb_indices(xs, ys, 10)
+    assert len(ind) == 10
+    assert ind[0] == 0 and ind[-1] == 99
+    # Peaks should be kept
+    assert 42 in ind and 70 in ind
+    assert get_lttb_indices(xs[:5], ys[:5], 10) == [0, 1, 2, 3, 4]
 
 
 def test_benchmark_default_platform():
@@ -205,6 +906,46 @@ def test_benchmark_file():
             assert rv.status_code == 200
             assert b'File benchmarks for build on 2020-01-01' in rv.data
             assert b'file <b>benchmark_load</b> in <b>IMP.em</b>' in rv.data
+            assert (b'data-url="/platform/3/benchmark/29/series/19?'
+                    b'date=20200101&amp;window=1y"' in rv.data)
+            assert b'<b>1 year</b>' in rv.data
+
+
+def test_benchmark_series():
+    """Test JSON benchmark data"""
+    with results.app.app_context():
+        utils.set_up_database(results.get_db())
+        c = results.app.test_client()
+        rv = c.get('/platform/3/benchmark/29/series/19?date=20200101')
+        assert rv.status_code == 200
+        assert rv.get_json() == {'runtime': [['2020-01-01', 0.5]],
+                                 'checkval': [['2020-01-01', 99.0]],
+                                 'bucket': 'day'}
+        rv = c.get('/platform/3/benchmark/29/series/19?date=20200101'
+                   '&columnar=1')
+        assert rv.get_json() == {'dates': ['2020-01-01'], 'runtime': [0.5],
+                                 'checkval': [99.0], 'bucket': 'day'}
+        # Old results should be excluded by the window, and long histories
+        # downsampled
+        db = results.get_db()
+        db.cursor().executemany(
+            "INSERT INTO imp_benchmark (name, runtime, checkval, date, "
+            "platform) VALUES (%s,%s,%s,%s,%s)",
+            [(19, 1.0, 0.0, utils.DEFAULT_DATE - datetime.timedelta(days=d),
+              3) for d in range(1, 200)])
+        for window, num in (('90d', 91), ('1y', 200)):
+            rv = c.get('/platform/3/benchmark/29/series/19?date=20200101'
+                       '&columnar=1&window=' + window)
+            assert len(rv.get_json()['dates']) == num
+        rv = c.get('/platform/3/benchmark/29/series/19?date=20200101'
+                   '&columnar=1&max_points=10')
+        data = rv.get_json()
+        assert len(data['dates']) == 10
+        assert data['dates'][-1] == '2020-01-01'
+        assert data['runtime'][-1] == 0.5
+        # Benchmark not in the given file
+        rv = c.get('/platform/3/benchmark/30/series/19?date=20200101')
+        assert rv.status_code == 404
 
 
 def test_doc_summary_bad_date():
@@ -230,3 +971,148 @@ def test_doc_summary():
             assert b'Doc summary for build on 2020-01-01' in rv.data
             assert b'broken link 1' in rv.data
             assert b'broken link 2' in rv.data
+
+
+def test_server_timing():
+    """Test the Server-Timing header"""
+    with results.app.app_context():
+        utils.set_up_database(results.get_db())
+        c = results.app.test_client()
+        rv = c.get('/')
+        assert rv.status_code == 200
+        timing = rv.headers['Server-Timing']
+        assert timing.startswith('db;dur=')
+        assert ' queries, ' in timing
+        assert ', render;dur=' in timing
+        # Only queries made by this request should be counted
+        assert results.get_db().stats.queries > 0
+        assert '"0 queries' not in timing
+
+
+def test_lazy_build_info():
+    """Test that build date, version and revision are looked up lazily"""
+    with results.app.app_context():
+        utils.set_up_database(results.get_db())
+        db = results.get_db()
+        with results.app.test_request_context('/'):
+            db.stats.reset()
+            t = results.index.TestPage(db, results.app.config)
+            assert db.stats.queries == 0
+            assert t.date == utils.DEFAULT_DATE
+            assert t.revision == 'testrev'
+            assert t.version is None
+            assert t.last_build_version is None
+            assert t.get_build_id() == '2020-01-01, develop testrev'
+            # Date, revision and version come from a single query
+            assert db.stats.queries == 1
+            assert t.other_repo_revs == {'rmf': 'rmfgithash'}
+            assert t.other_repo_revs == {'rmf': 'rmfgithash'}
+            assert db.stats.queries == 2
+        with results.app.test_request_context('/?date=20190101'):
+            t = results.index.TestPage(db, results.app.config)
+            assert t.date == datetime.date(2019, 1, 1)
+            assert t.revision is None
+            assert t.last_build_date == utils.DEFAULT_DATE
+
+
+def test_branches():
+    """Test discovery of branches from the imp_branch table"""
+    cache = results.index._branches
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        cache.clear()
+        assert cache.get(results.get_db) == ('develop', 'main',
+                                             'release/2.9.0',
+                                             'release/2.10.1')
+        assert results.index.get_branch(results.get_db, 'main') == 'main'
+        assert results.index.get_branch(results.get_db,
+                                        'garbage') == 'develop'
+        assert results.index.get_branch(results.get_db, None) == 'develop'
+        # New branches are not seen until the cache expires
+        c = db.cursor()
+        c.execute("INSERT INTO imp_branch (name) VALUES (%s)",
+                  ('release/2.11.0',))
+        assert 'release/2.11.0' not in cache.get(results.get_db)
+        cache.clear()
+        assert cache.get(results.get_db)[-1] == 'release/2.11.0'
+        c = results.app.test_client()
+        rv = c.get('/')
+        assert rv.status_code == 200
+        assert b'function change_branch()' in rv.data
+        assert (b'<option value="develop" selected="selected">Branch: '
+                b'develop</option>' in rv.data)
+        assert (b'<option value="release/2.10.1">Branch: release/2.10.1'
+                b'</option>' in rv.data)
+
+
+def test_dimension_cache():
+    """Test in-memory cache of platform and component names"""
+    cache = results.index._dimensions
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        cache.clear()
+        assert cache.get_archs(db) == {3: 'coverage'}
+        assert cache.get_units(db) == {5: ('IMP.em', False)}
+        db.stats.reset()
+        assert cache.get_archs(db, 3) == {3: 'coverage'}
+        assert db.stats.queries == 0
+        # Unknown IDs should cause a reload
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_archs (id, name) VALUES (%s,%s)",
+                  (4, 'mac10v4-intel'))
+        db.stats.reset()
+        assert cache.get_archs(db, 4) == {3: 'coverage', 4: 'mac10v4-intel'}
+        assert db.stats.queries == 2
+        # Lab-only components should only be visible to lab members
+        c.execute("INSERT INTO imp_test_units (id, name, lab_only) "
+                  "VALUES (%s,%s,%s)", (6, 'IMP.secret', 1))
+        with results.app.test_request_context('/'):
+            t = results.index.TestPage(db, results.app.config)
+            assert t.get_component_from_id(db, 6) == (None, False)
+            assert t.get_component_from_id(db, 5) == ('IMP.em', False)
+            assert t.get_visible_units() == {5: ('IMP.em', False)}
+            c.execute("INSERT INTO imp_test_units (id, name, lab_only) "
+                      "VALUES (%s,%s,%s)", (7, 'IMP.new', 0))
+            assert t.get_visible_units(7) == {5: ('IMP.em', False),
+                                              7: ('IMP.new', False)}
+        # Lists of results should also pick up new platforms
+        c.execute("INSERT INTO imp_test_archs (id, name) VALUES (%s,%s)",
+                  (8, 'mac10v4-intel'))
+        c.execute("INSERT INTO imp_test (name, arch, state, detail, runtime, "
+                  "date, delta) VALUES (%s,%s,%s,%s,%s,%s,%s)",
+                  (100, 8, "OK", "", 1.0, utils.DEFAULT_DATE, None))
+        rv = results.app.test_client().get('/platform/3/test/100')
+        assert b'href="/platform/8/test/100">Mac 10.4</a>' in rv.data
+
+
+def test_slow_log_metrics():
+    """Test the slow log and metrics file"""
+    slow_log = os.path.join(tempdir.name, 'slow.log')
+    metrics = os.path.join(tempdir.name, 'metrics.json')
+    config = {'SLOW_LOG': slow_log, 'METRICS_FILE': metrics,
+              'SLOW_REQUEST_THRESHOLD': 0., 'SLOW_QUERY_THRESHOLD': 0.}
+    results.app.config.update(config)
+    try:
+        with results.app.app_context():
+            utils.set_up_database(results.get_db())
+            c = results.app.test_client()
+            rv = c.get('/long')
+            assert rv.status_code == 200
+            # The page is streamed, so is only logged once it is closed
+            data = rv.get_data()
+            rv.close()
+    finally:
+        for key in config:
+            del results.app.config[key]
+    with open(slow_log) as fh:
+        lines = fh.readlines()
+    assert any(' query ' in line and 'imp_test' in line for line in lines)
+    assert ' request ' in lines[-1]
+    assert '/long?' in lines[-1]
+    with open(metrics) as fh:
+        sample = json.loads(fh.readline())
+    assert sample['status'] == 200
+    assert sample['queries'] > 0
+    assert sample['size'] == len(data)
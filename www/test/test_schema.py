@@ -0,0 +1,169 @@
+import utils
+import datetime
+
+utils.set_search_paths(__file__)
+
+results, tempdir = utils.import_mocked()
+
+import MySQLdb  # noqa: E402
+import imp_schema  # noqa: E402
+
+
+def make_database(branches=()):
+    conn = MySQLdb.connect(None)
+    utils.set_up_database(conn)
+    c = conn.cursor()
+    for branch in branches:
+        for table in imp_schema.PER_BRANCH_TABLES:
+            c.execute("CREATE TABLE %s_%s AS SELECT * FROM %s WHERE 0"
+                      % (table, branch, table))
+    return conn
+
+
+def test_upgrade():
+    """Test adding missing indexes"""
+    conn = make_database()
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    assert schema.get_version() == 0
+    assert 'date_state' not in schema.get_indexes('imp_test')
+    assert schema.upgrade() > 0
+    assert 'date_state' in schema.get_indexes('imp_test')
+    assert schema.get_version() == len(imp_schema.MIGRATIONS)
+    assert schema.get_missing() == []
+    # Nothing more to do on a second run
+    assert schema.upgrade() == 0
+
+
+def test_upgrade_column():
+    """Test adding missing columns"""
+    conn = make_database()
+    c = conn.cursor()
+    c.execute("ALTER TABLE imp_test DROP COLUMN signature")
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    assert 'signature' not in schema.get_columns('imp_test')
+    schema.upgrade()
+    assert 'signature' in schema.get_columns('imp_test')
+    assert 'date_signature' in schema.get_indexes('imp_test')
+
+
+def test_upgrade_dry_run():
+    """Test that a dry run does not change the database"""
+    conn = make_database()
+    schema = imp_schema.Schema(conn, 'sqlite', dryrun=True, verbose=False)
+    n = len(schema.get_missing())
+    assert schema.upgrade() == n
+    assert len(schema.get_missing()) == n
+    assert schema.get_version() == 0
+
+
+def test_upgrade_branches():
+    """Test adding indexes to per-branch tables"""
+    conn = make_database(branches=['main'])
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    assert schema.get_branch_suffixes() == ['main']
+    schema.upgrade()
+    assert 'date_state_main' in schema.get_indexes('imp_test_main')
+    assert 'date_arch_unit_main' in schema.get_indexes('imp_test_rollup_main')
+    # Explicitly given branches
+    schema = imp_schema.Schema(conn, 'sqlite', branches=['develop', 'main'],
+                               verbose=False)
+    assert schema.get_branch_suffixes() == ['main']
+
+
+def test_check():
+    """Test checking of query plans"""
+    conn = make_database(branches=['main'])
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    problems = schema.check()
+    assert any(p.startswith('Missing CREATE INDEX date_state ON imp_test ')
+               for p in problems)
+    assert any('on imp_test_main does not use index' in p for p in problems)
+    schema.upgrade()
+    assert schema.check() == []
+
+
+def test_check_queries_dates():
+    """Check queries should use typical date arguments"""
+    for desc, query, args, table, index in imp_schema.CHECK_QUERIES:
+        assert query.count('%s') == len(args)
+        assert table in imp_schema.PER_BRANCH_TABLES
+        assert any(isinstance(a, datetime.date) for a in args)
+
+
+def test_branch_suffixes_skip_temp():
+    """Dry-run temporary tables should not be treated as branches"""
+    conn = make_database(branches=['main'])
+    c = conn.cursor()
+    c.execute("CREATE TABLE imp_test_reporev_temp AS "
+              "SELECT * FROM imp_test_reporev WHERE 0")
+    c.execute("CREATE TABLE imp_test_reporev_main_temp AS "
+              "SELECT * FROM imp_test_reporev WHERE 0")
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    assert schema.get_branch_suffixes() == ['main']
+
+
+def test_grants():
+    """Test access grants for tables made by migrations"""
+    dialect = imp_schema._MySQLDialect()
+    grants = dialect.get_grants('imp_test_flaky')
+    assert grants[0] == ("GRANT SELECT ON imp_test_flaky TO "
+                         "'imp_www'@'localhost'")
+    assert 'impusers' in grants[1]
+    # Every new table is granted alongside its CREATE TABLE
+    conn = make_database(branches=['main'])
+    c = conn.cursor()
+    c.execute("DROP TABLE imp_test_flaky_main")
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    # Use the MySQL GRANT syntax with sqlite queries
+    schema.dialect.get_grants = dialect.get_grants
+    missing = [sql for m, table, sql in schema.get_missing()
+               if table == 'imp_test_flaky_main']
+    assert missing[0].startswith('CREATE TABLE imp_test_flaky_main ')
+    assert missing[1:3] == dialect.get_grants('imp_test_flaky_main')
+    grants = schema.get_grants()
+    assert dialect.get_grants('imp_test_flaky')[0] in grants
+    assert dialect.get_grants('imp_test_flaky_main')[0] in grants
+
+
+def test_initial_branches():
+    """Test filling the branch registry with the previously shown branches"""
+    conn = make_database()
+    c = conn.cursor()
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    # Branches already in the table are kept
+    schema.upgrade()
+    c.execute("SELECT name FROM imp_branch")
+    names = [row[0] for row in c]
+    assert len(names) == len(set(names))
+    assert set(names) == set(imp_schema.INITIAL_BRANCHES) | {'release/2.9.0'}
+    # A new table is created, granted, then filled
+    c.execute("DROP TABLE imp_branch")
+    dialect = imp_schema._MySQLDialect()
+    schema.dialect.get_grants = dialect.get_grants
+    missing = [sql for m, table, sql in schema.get_missing()
+               if table == 'imp_branch']
+    assert missing[0].startswith('CREATE TABLE imp_branch ')
+    assert missing[1:3] == dialect.get_grants('imp_branch')
+    assert missing[3] == "INSERT INTO imp_branch (name) VALUES ('develop')"
+    assert len(missing) == 3 + len(imp_schema.INITIAL_BRANCHES)
+
+
+def test_create_table_sql():
+    """Test creating tables made by migrations outside of an upgrade"""
+    conn = make_database()
+    c = conn.cursor()
+    c.execute("DROP TABLE imp_test_rollup")
+    sql = imp_schema.get_create_table_sql('imp_test_rollup',
+                                          'imp_test_rollup_main')
+    assert sql.startswith('CREATE TABLE IF NOT EXISTS imp_test_rollup_main ')
+    c.execute(imp_schema.get_create_table_sql('imp_test_rollup'))
+    # Existing tables are left alone
+    c.execute(imp_schema.get_create_table_sql('imp_test_rollup'))
+    schema = imp_schema.Schema(conn, 'sqlite', verbose=False)
+    assert 'numnewfails' in schema.get_columns('imp_test_rollup')
+    try:
+        imp_schema.get_create_table_sql('imp_test')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("ValueError not raised")
@@ -0,0 +1,71 @@
+import utils
+import datetime
+import os
+import tempfile
+
+utils.set_search_paths(__file__)
+
+import imp_build_search  # noqa: E402
+
+
+def make_index(tmpdir):
+    index = imp_build_search.SearchIndex(os.path.join(tmpdir, 'search.db'))
+    d = utils.DEFAULT_DATE
+    index.add_results('develop', d - datetime.timedelta(days=1),
+                      [(60, 5, 3, 0, 'em-badtest',
+                        'Traceback: ValueError: bad density map'),
+                       (61, 6, 4, 1, 'lab-test', 'ValueError: secret')])
+    index.add_results('develop', d,
+                      [(60, 5, 3, 0, 'em-badtest', 'something else'),
+                       (99, 5, 4, 0, 'em-newbadtest',
+                        'ValueError: bad density map')])
+    index.add_results('main', d,
+                      [(60, 5, 3, 0, 'em-badtest', 'ValueError')])
+    return index
+
+
+def test_fts_query():
+    """Test conversion of search text to FTS5 queries"""
+    q = imp_build_search.get_fts_query
+    assert q('') == ''
+    assert q('foo bar') == '"foo" "bar"'
+    assert q('"bad density" map') == '"bad density" "map"'
+    assert q('IMP.core AND x"y') == '"IMP.core" "AND" "x""y"'
+
+
+def test_search():
+    """Test searching the index"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        index = make_index(tmpdir)
+        d = utils.DEFAULT_DATE
+        res = index.search('"bad density"', 'develop', False)
+        assert [(r['date'], r['test']) for r in res] \
+            == [(d, 99), (d - datetime.timedelta(days=1), 60)]
+        assert res[0]['snippet'] == 'ValueError: \x02bad density\x03 map'
+        # Lab-only results are only shown if requested
+        assert len(index.search('ValueError', 'develop', False)) == 2
+        assert len(index.search('ValueError', 'develop', True)) == 3
+        # Test names are also indexed
+        res = index.search('newbadtest', 'develop', False)
+        assert [r['test'] for r in res] == [99]
+        # Filters
+        assert [r['test'] for r in index.search(
+            'ValueError', 'develop', False, start_date=d)] == [99]
+        assert [r['test'] for r in index.search(
+            'ValueError', 'develop', False,
+            end_date=d - datetime.timedelta(days=1))] == [60]
+        assert [r['test'] for r in index.search(
+            'ValueError', 'develop', False, arch=3)] == [60]
+        assert [r['test'] for r in index.search(
+            'ValueError', 'develop', True, unit=6)] == [61]
+        assert [r['test'] for r in index.search(
+            'ValueError', 'main', False)] == [60]
+        assert [r['test'] for r in index.search(
+            'ValueError', 'develop', False, offset=1, limit=1)] == [60]
+        # Replacing a build's results
+        index.add_results('develop', d, [])
+        assert [r['test'] for r in index.search(
+            'ValueError', 'develop', False)] == [60]
+        assert index.search('', 'develop', False) == []
+        assert imp_build_search.SearchIndex.open(
+            os.path.join(tmpdir, 'notexist.db')) is None
@@ -0,0 +1,108 @@
+import os
+import datetime
+import tempfile
+import utils
+
+utils.set_search_paths(__file__)
+
+results, tempdir = utils.import_mocked()
+
+from results import snapshot  # noqa: E402
+
+
+def test_snapshot_paths():
+    """Test getting the pages to export for a build"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_units (id, name, lab_only) "
+                  "VALUES (%s,%s,%s)", (6, 'IMP.secret', 1))
+        for unit in (5, 6):
+            c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                      "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                      (3, unit, 'CMAKE_OK', None, utils.DEFAULT_DATE))
+        paths = snapshot.get_snapshot_paths(db, utils.DEFAULT_DATE, 'develop')
+        assert paths == snapshot.BUILD_PAGES + [
+            '/platform/3', '/comp/5', '/platform/3/comp/5',
+            '/platform/3/benchmark', '/platform/3/benchmark/29']
+        # Nothing for other dates
+        paths = snapshot.get_snapshot_paths(db, datetime.date(2019, 1, 1),
+                                            'develop')
+        assert paths == snapshot.BUILD_PAGES
+
+
+def test_build_dates():
+    """Test getting the dates of builds to backfill"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        assert snapshot.get_build_dates(
+            db, 'develop', datetime.date(2019, 1, 1),
+            datetime.date(2021, 1, 1)) == [utils.DEFAULT_DATE]
+        assert snapshot.get_build_dates(
+            db, 'develop', datetime.date(2019, 1, 1),
+            datetime.date(2019, 2, 1)) == []
+
+
+def test_output_file():
+    """Test the files that pages are exported to"""
+    d = utils.DEFAULT_DATE
+    assert (snapshot.get_output_file('/out', 'develop', d, '/')
+            == '/out/develop/20200101/index.html')
+    assert (snapshot.get_output_file('/out', 'release/2.9.0', d, '/comp/5')
+            == '/out/release/2.9.0/20200101/comp/5/index.html')
+
+
+def test_export_build():
+    """Test exporting all pages for a build"""
+    with results.app.app_context():
+        db = results.get_db()
+        utils.set_up_database(db)
+        c = db.cursor()
+        c.execute("INSERT INTO imp_test_unit_result (arch, unit, state, "
+                  "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                  (3, 5, 'CMAKE_OK', None, utils.DEFAULT_DATE))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            npages = len(snapshot.get_snapshot_paths(db, utils.DEFAULT_DATE,
+                                                     'develop'))
+            counts = snapshot.export_build(utils.DEFAULT_DATE, 'develop',
+                                           tmpdir)
+            assert counts == {'written': npages, 'unchanged': 0, 'failed': 0}
+            top = os.path.join(tmpdir, 'develop', '20200101')
+            with open(os.path.join(top, 'index.html')) as fh:
+                contents = fh.read()
+            assert 'Summary for build on 2020-01-01' in contents
+            # Links and assets should point to the live site
+            assert 'src="/nightly/results/static/testfunc.js"' in contents
+            assert 'href="/nightly/results/all-fail' in contents
+            with open(os.path.join(top, 'platform', '3', 'comp', '5',
+                                   'index.html')) as fh:
+                assert 'IMP.em test results for build on' in fh.read()
+            # Pages that have not changed are not written again
+            counts = snapshot.export_build(utils.DEFAULT_DATE, 'develop',
+                                           tmpdir)
+            assert counts == {'written': 0, 'unchanged': npages, 'failed': 0}
+
+
+def test_export_script_name():
+    """Test exporting pages for a site served from another path"""
+    results.app.config['SNAPSHOT_SCRIPT_NAME'] = '/imp/nightly/results'
+    try:
+        with results.app.app_context():
+            db = results.get_db()
+            utils.set_up_database(db)
+            db.cursor().execute(
+                "INSERT INTO imp_test_unit_result (arch, unit, state, "
+                "logline, date) VALUES (%s,%s,%s,%s,%s)",
+                (3, 5, 'OK', None, utils.DEFAULT_DATE))
+            with tempfile.TemporaryDirectory() as tmpdir:
+                fname = os.path.join(tmpdir, 'index.html')
+                assert snapshot.export_page(
+                    ('/', {'date': '20200101'}, fname)) == 'written'
+                with open(fname) as fh:
+                    contents = fh.read()
+        assert 'src="/imp/nightly/results/static/testfunc.js"' in contents
+        assert 'src="/imp/nightly/images/moduleok.png"' in contents
+    finally:
+        del results.app.config['SNAPSHOT_SCRIPT_NAME']
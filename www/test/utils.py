@@ -58,6 +58,10 @@ def set_up_database(db):
               'date DATE NOT NULL PRIMARY KEY )')
     c.execute('INSERT INTO imp_test_reporev (rev, date) VALUES (%s,%s)',
               ('testrev', DEFAULT_DATE))
+    c.execute('CREATE TABLE imp_branch ( name VARCHAR(40) NOT NULL '
+              'PRIMARY KEY )')
+    for branch in ('develop', 'main', 'release/2.9.0', 'release/2.10.1'):
+        c.execute('INSERT INTO imp_branch (name) VALUES (%s)', (branch,))
     c.execute('CREATE TABLE imp_test_other_reporev ( rev VARCHAR(40), '
               'repo TEXT, date DATE)')
     c.execute('INSERT INTO imp_test_other_reporev (rev, repo, date) '
@@ -73,7 +77,8 @@ def set_up_database(db):
     c.execute("INSERT INTO imp_test_names (id, name, unit) VALUES (%s,%s,%s)",
               (100, 'em-longtest', 5))
     c.execute("CREATE TABLE imp_test ( name INT, arch INT, state TEXT, "
-              "detail TEXT, runtime FLOAT, date DATE, delta TEXT )")
+              "detail TEXT, runtime FLOAT, date DATE, delta TEXT, "
+              "signature CHAR(16) )")
     c.execute("INSERT INTO imp_test (name, arch, state, detail, runtime, "
               "date, delta) VALUES (%s,%s,%s,%s,%s,%s,%s)",
               (42, 3, "OK", "", 1.0, DEFAULT_DATE, None))
@@ -95,12 +100,32 @@ def set_up_database(db):
               'VALUES (%s,%s,%s)', (5, 'IMP.em', 0))
     c.execute("CREATE TABLE imp_test_unit_result ( arch INT, unit INT, "
               "state TEXT, logline INT, date DATE )")
+    c.execute("CREATE TABLE imp_test_rollup ( date DATE, arch INT, unit INT, "
+              "state TEXT, numfails INT, numnewfails INT, logline INT )")
+    c.execute("CREATE TABLE imp_test_slowdown ( date DATE, name INT, "
+              "arch INT, baseline FLOAT, runtime FLOAT, effect FLOAT )")
+    c.execute("CREATE TABLE imp_test_history ( name INT, arch INT, "
+              "first_date DATE, last_date DATE, runs TEXT, last_ok DATE, "
+              "last_fail DATE, covered_from DATE, PRIMARY KEY (name, arch) )")
+    c.execute("CREATE TABLE imp_test_signature ( signature CHAR(16), "
+              "first_date DATE, last_date DATE, summary TEXT, "
+              "PRIMARY KEY (signature) )")
+    c.execute("CREATE TABLE imp_test_flaky ( date DATE, name INT, arch INT, "
+              "runs INT, flips INT, score FLOAT )")
     c.execute("CREATE TABLE imp_build_summary ( state TEXT, date DATE, "
               "lab_only INT )")
     c.execute("CREATE TABLE imp_doc ( date DATE, nbroken_tutorial INT, "
               "nbroken_manual INT, nbroken_rmf_manual INT )")
     c.execute("CREATE TABLE imp_benchmark ( name INT, runtime FLOAT, "
               "checkval FLOAT, date DATE, platform INT )")
+    c.execute("CREATE TABLE imp_benchmark_rollup ( bucket TEXT, "
+              "bucket_start DATE, name INT, platform INT, samples INT, "
+              "min_runtime FLOAT, median_runtime FLOAT, max_runtime FLOAT, "
+              "min_checkval FLOAT, median_checkval FLOAT, "
+              "max_checkval FLOAT )")
+    c.execute("CREATE TABLE imp_benchmark_regression ( date DATE, "
+              "change_date DATE, name INT, platform INT, baseline FLOAT, "
+              "runtime FLOAT, effect FLOAT, rev_from TEXT, rev_to TEXT )")
     c.execute("CREATE TABLE imp_benchmark_files ( id INT, unit INT, "
               "name TEXT )")
     c.execute("CREATE TABLE imp_benchmark_names ( id INT, file INT, "